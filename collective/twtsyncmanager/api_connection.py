@@ -7,10 +7,14 @@
 #
 
 # Global dependencies
+import random
 import re
 import requests
 import sys
+import threading
+import time
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from .utils import DATE_FORMAT
 
 try:
@@ -19,11 +23,66 @@ except ImportError:
     # support python 2
     from urllib import urlencode
 
+try:
+    from queue import Queue, Empty
+except ImportError:
+    # support python 2
+    from Queue import Queue, Empty
+
 # Product dependencies
 from .error import raise_error
+from . import api_constants
+from .circuit_breaker import get_circuit_breaker
+from .response_cache import get_response_cache, get_cache_key, CachedResponse
+from .json_stream import StreamingJSONObject
+from .rate_limiter import get_rate_limiter, parse_retry_after
+
+
+# Shared HTTP sessions
+# One pooled keep-alive session per pool size, reused by every APIConnection in the process
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
 
 
 # Global method
+def get_http_session(pool_size):
+    """
+    Get the process wide pooled session for the pool size
+    """
+    with _http_sessions_lock:
+        session = _http_sessions.get(pool_size, None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Connection': 'keep-alive'})
+            session.twt_requests = 0
+            # The session is shared by the threads of the process, the counter is updated under its lock
+            session.twt_requests_lock = threading.Lock()
+            _http_sessions[pool_size] = session
+        return session
+
+def get_http_session_stats(session):
+    """
+    Count the requests sent and the connections opened by a pooled session
+    """
+    connections = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+
+    total_requests = getattr(session, 'twt_requests', 0)
+    stats = {
+        "requests": total_requests,
+        "connections": connections,
+        "reused": max(total_requests - connections, 0)
+    }
+    return stats
+
 def generate_querystring(params):
     """
     Generate a querystring
@@ -52,16 +111,37 @@ class APIConnection(object):
         r'(?::\d+)?' # optional port
         r'(?:/?|[/?]\S+)$', re.IGNORECASE)
     API_KEY_SIZE = 5
-    TIMEOUT = 10
+    TIMEOUT = api_constants.TIMEOUT
+    POOL_SIZE = 10
+    MAX_WORKERS = 4
+    # Retries of idempotent requests, with a jittered exponential backoff in seconds
+    RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    RETRY_METHODS = ["get", "head"]
+    BREAKER_THRESHOLD = 5
+    BREAKER_RESET = 60
+    # Time to live in seconds of the cached responses, per endpoint type
+    CACHE_TTLS = {
+        "list": 300,
+        "availability": 60,
+        "arrangements": 600
+    }
+    CACHE_METHODS = ["get"]
+    # Large list responses are parsed while they are read, in chunks of this many bytes
+    STREAM_CHUNK_SIZE = 64 * 1024
     HTTP_METHOD = "get"
-    FOUND_STATUS = "PERFORMANCE_FOUND"
-    NOT_FOUND_STATUS = "PERFORMANCE_NOT_FOUND"
-    ERROR_STATUS = "ERROR"
-
-    ENDPOINTS = { # TODO: should get this from the settings
-        "list": "performanceList",
-        "availability": "performanceAvailability",
-        "arrangements": "arrangementList"
+    TOO_MANY_REQUESTS = 429
+    FOUND_STATUS = api_constants.FOUND_STATUS
+    NOT_FOUND_STATUS = api_constants.NOT_FOUND_STATUS
+    ERROR_STATUS = api_constants.ERROR_STATUS
+
+    ENDPOINTS = api_constants.ENDPOINTS
+    # Requests per second and burst size, per endpoint type in ENDPOINTS
+    # A rate of 0 sends the requests without limit, only the pauses asked by the API apply
+    RATE_LIMITS = {
+        "list": {"rate": 0, "burst": None},
+        "availability": {"rate": 0, "burst": None},
+        "arrangements": {"rate": 0, "burst": None}
     }
 
     #
@@ -74,6 +154,24 @@ class APIConnection(object):
             raise_error("requestSetupError", "Required API settings are not found or have an invalid format.")
 
         self.api_mode = api_settings['api_mode']
+        self.pool_size = api_settings.get('pool_size', None) or self.POOL_SIZE
+        self.max_workers = api_settings.get('max_workers', None) or self.MAX_WORKERS
+        self.session = get_http_session(max(self.pool_size, self.max_workers))
+        self.retries = api_settings.get('retries', None)
+        if self.retries is None:
+            self.retries = self.RETRIES
+        self.retry_backoff = api_settings.get('retry_backoff', None) or self.RETRY_BACKOFF
+        self.breaker_threshold = api_settings.get('breaker_threshold', None) or self.BREAKER_THRESHOLD
+        self.breaker_reset = api_settings.get('breaker_reset', None) or self.BREAKER_RESET
+        self.cache_ttls = dict(self.CACHE_TTLS, **dict((endpoint_type, ttl) for endpoint_type, ttl in (api_settings.get('cache_ttls', None) or {}).items() if ttl is not None))
+        self.rate_limits = dict((endpoint_type, dict(rate_limit)) for endpoint_type, rate_limit in self.RATE_LIMITS.items())
+        for endpoint_type, rate in (api_settings.get('rate_limits', None) or {}).items():
+            if rate is not None:
+                self.rate_limits.setdefault(endpoint_type, {})['rate'] = rate
+        self.stream_responses = api_settings.get('stream_responses', None)
+        if self.stream_responses is None:
+            self.stream_responses = True
+        self.response_cache = get_response_cache(api_settings.get('cache_backend', None), api_settings.get('cache_directory', None), api_settings.get('cache_size', None))
         # TODO: endpoints should be validated
 
     #
@@ -84,49 +182,107 @@ class APIConnection(object):
         self.api_mode = api_mode
         return self.api_mode
 
+    def get_circuit_breaker(self):
+        # One breaker per API url, shared by the threads and connections of the process
+        return get_circuit_breaker(self.get_api_url(), self.breaker_threshold, self.breaker_reset)
+
+    def get_circuit_breaker_state(self):
+        return self.get_circuit_breaker().get_state()
+
+    def get_rate_limiter(self, endpoint_type):
+        # One limiter per API url and endpoint type, shared by the threads and connections of the process
+        rate_limit = self.rate_limits.get(endpoint_type, None) or {}
+        return get_rate_limiter("%s/%s" %(self.get_api_url(), self.ENDPOINTS.get(endpoint_type, endpoint_type or '')), rate_limit.get('rate', None), rate_limit.get('burst', None))
+
+    def get_rate_limiter_states(self):
+        return dict((endpoint_type, self.get_rate_limiter(endpoint_type).get_state()) for endpoint_type in self.ENDPOINTS.keys())
+
     def get_api_url(self):
         return self.api_settings[self.api_mode]['url']
 
     def get_api_key(self):
         return self.api_settings[self.api_mode]['api_key']
 
+    def get_connection_stats(self):
+        connection_stats = get_http_session_stats(self.session)
+        connection_stats['circuit_breaker'] = self.get_circuit_breaker_state()['state']
+        connection_stats['throttled'] = sum(rate_limiter_state['throttled'] for rate_limiter_state in self.get_rate_limiter_states().values())
+        if self.response_cache is not None:
+            connection_stats['cache'] = self.response_cache.get_stats()
+        return connection_stats
+
     def get_performance_list_by_date(self, date_from, date_until):
         #
         # Request the performance list from the Ticketworks API
         # Requires: dateFrom and dateUntil in the format YYYY-MM-DD
         #
+        return list(self.iter_performance_list_by_date(date_from=date_from, date_until=date_until))
+
+    def iter_performance_list_by_date(self, date_from, date_until):
+        #
+        # Yield the performances of the list one at a time while the response is read
+        # Requires: dateFrom and dateUntil in the format YYYY-MM-DD
+        #
         date_from = self.validate_date(date_from)
         date_until = self.validate_date(date_until)
-        
-        params = {"dateFrom": date_from, "dateUntil": date_until}
-        response = self.perform_api_call(self.HTTP_METHOD, endpoint_type='list', params=params)
 
-        if 'performances' in response:
-            return response['performances']
-        else:
-            raise_error("requestHandlingError", "Performance list is not available in the TWT API response.")
+        params = {"dateFrom": date_from, "dateUntil": date_until}
+        return self.perform_streaming_api_call(self.HTTP_METHOD, endpoint_type='list', params=params,
+            items_key='performances', missing_message="Performance list is not available in the TWT API response.")
 
     def get_arrangement_list_by_date(self, date_from, date_until):
         #
-        # Request the performance list from the Ticketworks API
+        # Request the arrangement list from the Ticketworks API
+        # Requires: dateFrom and dateUntil in the format YYYY-MM-DD
+        #
+        return list(self.iter_arrangement_list_by_date(date_from=date_from, date_until=date_until))
+
+    def iter_arrangement_list_by_date(self, date_from, date_until):
+        #
+        # Yield the products of the arrangement list one at a time while the response is read
         # Requires: dateFrom and dateUntil in the format YYYY-MM-DD
         #
         date_from = self.validate_date(date_from)
         date_until = self.validate_date(date_until)
-        
-        params = {"dateFrom": date_from, "dateUntil": date_until}
-        response = self.perform_api_call(self.HTTP_METHOD, endpoint_type='arrangements', params=params)
 
-        if 'products' in response:
-            return response['products']
-        else:
-            raise_error("requestHandlingError", "Arrangement list is not available in the TWT API response.")
+        params = {"dateFrom": date_from, "dateUntil": date_until}
+        return self.perform_streaming_api_call(self.HTTP_METHOD, endpoint_type='arrangements', params=params,
+            items_key='products', missing_message="Arrangement list is not available in the TWT API response.")
 
     def get_arrangement_list_by_performance_id(self, find_performance_id, date_from, date_until):
-        arrangement_list_response = self.get_arrangement_list_by_date(date_from=date_from, date_until=date_until)
+        arrangement_list_response = self.iter_arrangement_list_by_date(date_from=date_from, date_until=date_until)
         arrangement_list = self.find_arrangements_by_performance_id(find_performance_id, arrangement_list_response)
         return arrangement_list
 
+    def get_arrangement_index_by_date(self, date_from, date_until):
+        #
+        # Request the arrangement list once and index it by performance ID
+        # Returns: { performance_id: [arrangement, ...] }
+        #
+        arrangement_list_response = self.iter_arrangement_list_by_date(date_from=date_from, date_until=date_until)
+        arrangement_index = self.build_arrangement_index(arrangement_list_response)
+        return arrangement_index
+
+    def build_arrangement_index(self, arrangement_list_response):
+        # Same matching rules as find_arrangements_by_performance_id,
+        # one arrangement per product and performance, in a single pass
+        arrangement_index = {}
+        for product in arrangement_list_response:
+            product_id = product.get('id', '')
+            indexed_performances = set()
+            for arrangement in product.get('arrangements', []):
+                performance = arrangement.get('performance', None)
+                if performance:
+                    performance_id = str(performance.get('id', ''))
+                    if performance_id in indexed_performances:
+                        continue
+                    indexed_performances.add(performance_id)
+                    new_arrangement = arrangement
+                    new_arrangement['product_id'] = product_id
+                    arrangement_index.setdefault(performance_id, []).append(new_arrangement)
+
+        return arrangement_index
+
     # TODO: Maybe move to the sync mechanism
     def find_arrangements_by_performance_id(self, find_performance_id, arrangement_list_response):
         arrangement_list = []
@@ -161,6 +317,51 @@ class APIConnection(object):
         else:
             raise_error('responseHandlingError', 'Performance is not found in the API JSON response. ID: %s' %(performance_id))
 
+    def get_performance_availability_by_ids(self, performance_ids, max_workers=None):
+        #
+        # Request the availability of several performances with a bounded pool of threads
+        # Returns: { performance_id: performance data or the error raised for it }
+        #
+        max_workers = max_workers or self.max_workers
+        pending = Queue()
+        for performance_id in performance_ids:
+            pending.put(performance_id)
+
+        results = {}
+        total_workers = min(max_workers, len(performance_ids))
+        workers = [threading.Thread(target=self._availability_worker, args=(pending, results)) for worker in range(total_workers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return results
+
+    def _availability_worker(self, pending, results):
+        while True:
+            try:
+                performance_id = pending.get_nowait()
+            except Empty:
+                return
+
+            try:
+                results[str(performance_id)] = self.get_performance_availability(performance_id)
+            except Exception as err:
+                results[str(performance_id)] = err
+
+    def get_window_data(self, date_from, date_until):
+        #
+        # Request the performances of a date range with their arrangements and availability
+        # Returns: { "performance_list": [...], "arrangement_index": {...}, "availability_data": {...} }
+        #
+        performance_list = self.get_performance_list_by_date(date_from=date_from, date_until=date_until)
+        return {
+            "performance_list": performance_list,
+            "arrangement_index": self.get_arrangement_index_by_date(date_from=date_from, date_until=date_until),
+            "availability_data": self.get_performance_availability_by_ids([performance.get('id', '') for performance in performance_list])
+        }
+
     # 
     # Validaton methods
     #
@@ -249,26 +450,127 @@ class APIConnection(object):
 
         return url
 
-    def perform_http_call(self, http_method, endpoint_type=None, params=None):
+    def perform_http_call(self, http_method, endpoint_type=None, params=None, headers=None, stream=False):
         try:
             url = self._format_request_data(endpoint_type, params)
-
-            response = requests.request(
-                http_method, url,
-                headers={
-                    'Accept': 'application/json',
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'Mozilla/5.0',
-                },
-                timeout=self.TIMEOUT
-            )
         except Exception as err:
             raise_error("requestError", 'Unable to communicate with TWT API: {error}'.format(error=err))
 
+        circuit_breaker = self.get_circuit_breaker()
+        rate_limiter = self.get_rate_limiter(endpoint_type)
+        # The breaker is asked once per request, before the request waits for the rate limit
+        if not circuit_breaker.allow_request():
+            raise_error("circuitOpenError", "TWT API requests are stopped after {failures} failures, the next attempt is at {retry_at}.".format(
+                failures=circuit_breaker.failures, retry_at=datetime.fromtimestamp(circuit_breaker.get_retry_time() or time.time()).strftime('%H:%M:%S')))
+
+        attempts = self.retries + 1 if http_method.lower() in self.RETRY_METHODS else 1
+        response = None
+        error = None
+        for attempt in range(attempts):
+            rate_limiter.acquire()
+            try:
+                response = self.send_request(http_method, url, headers, stream)
+                error = None
+            except Exception as err:
+                response = None
+                error = err
+
+            # The API asks to slow down, the limiter pauses and lowers the rate before the retry
+            if response is not None and response.status_code == self.TOO_MANY_REQUESTS:
+                rate_limiter.throttle(parse_retry_after(response.headers.get('Retry-After', None)))
+                if attempt + 1 < attempts:
+                    response.close()
+                continue
+
+            # Server errors and connection errors count as failures, other responses are handled by perform_api_call
+            if response is not None and response.status_code < 500:
+                circuit_breaker.record_success()
+                rate_limiter.record_success()
+                return response
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After', None)) if response is not None else None
+            if retry_after is not None:
+                rate_limiter.throttle(retry_after)
+            if attempt + 1 < attempts:
+                if response is not None:
+                    response.close()
+                time.sleep(self.get_retry_delay(attempt))
+
+        if response is not None and response.status_code == self.TOO_MANY_REQUESTS:
+            # A throttling API is reachable, it is not a failure of the breaker
+            circuit_breaker.record_success()
+            raise_error("requestError", "TWT API requests are rate limited, the API answered {status} after {attempts} attempts.".format(
+                status=response.status_code, attempts=attempts))
+
+        # One failure per request, after its retries
+        circuit_breaker.record_failure()
+        if response is not None:
+            return response
+        raise_error("requestError", 'Unable to communicate with TWT API: {error}'.format(error=error))
+
+    def send_request(self, http_method, url, headers=None, stream=False):
+        with self.session.twt_requests_lock:
+            self.session.twt_requests += 1
+        request_headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'User-Agent': 'Mozilla/5.0',
+        }
+        request_headers.update(headers or {})
+        response = self.session.request(
+            http_method, url,
+            headers=request_headers,
+            timeout=self.TIMEOUT,
+            stream=stream
+        )
         return response
 
+    def get_retry_delay(self, attempt):
+        # Full jitter, so the threads of a bulk fetch do not retry at the same time
+        return random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+    def is_cacheable(self, http_method, endpoint_type):
+        return self.response_cache is not None and http_method.lower() in self.CACHE_METHODS and self.cache_ttls.get(endpoint_type, 0) > 0
+
+    def perform_cached_http_call(self, http_method, endpoint_type=None, params=None):
+        #
+        # Serve the request from the response cache
+        # A fresh response is returned without a request, an expired one is revalidated when possible
+        #
+        if not self.is_cacheable(http_method, endpoint_type):
+            return None, self.perform_http_call(http_method, endpoint_type=endpoint_type, params=params)
+
+        response_cache = self.response_cache
+        # The key is taken before the API key is added to the params, the API url keeps the
+        # responses of the test and production APIs apart
+        cache_key = get_cache_key(http_method, "%s/%s" %(self.get_api_url(), self.ENDPOINTS.get(endpoint_type, endpoint_type)), params)
+        cache_entry = response_cache.get(cache_key)
+        if cache_entry is not None and response_cache.is_fresh(cache_entry):
+            response_cache.count('hits')
+            return cache_key, CachedResponse(cache_entry)
+
+        headers = None
+        if cache_entry is not None and response_cache.can_revalidate(cache_entry):
+            headers = response_cache.get_revalidation_headers(cache_entry)
+
+        resp = self.perform_http_call(http_method, endpoint_type=endpoint_type, params=params, headers=headers)
+        if resp.status_code == 304 and cache_entry is not None:
+            response_cache.count('revalidated')
+            cache_entry = response_cache.refresh(cache_key, cache_entry, self.cache_ttls[endpoint_type])
+            return cache_key, CachedResponse(cache_entry, revalidated=True)
+
+        response_cache.count('misses')
+        return cache_key, resp
+
+    def store_cached_response(self, cache_key, endpoint_type, resp):
+        # Only responses with a valid payload are cached
+        if cache_key is None or getattr(resp, 'from_cache', False) or resp.status_code != 200:
+            return None
+        self.response_cache.set(cache_key, self.response_cache.create_entry(resp, self.cache_ttls[endpoint_type]))
+        self.response_cache.count('stored')
+
     def perform_api_call(self, http_method, endpoint_type=None, params=None):
-        resp = self.perform_http_call(http_method, endpoint_type=endpoint_type, params=params)
+        cache_key, resp = self.perform_cached_http_call(http_method, endpoint_type=endpoint_type, params=params)
 
         try:
             result = resp.json() if resp.status_code != 204 else {}
@@ -277,12 +579,17 @@ class APIConnection(object):
                 "Unable to decode TWT API response (status code: {status}): '{response}'.".format(
                     status=resp.status_code, response=resp.text))
 
+        result = self.check_api_result(result, resp.status_code, resp.text)
+        self.store_cached_response(cache_key, endpoint_type, resp)
+        return result
+
+    def check_api_result(self, result, status_code, response_text):
         if 'status' in result:
             status = result['status']
             if status == self.NOT_FOUND_STATUS:
                 raise_error("performanceNotFoundError", 
                     "Received HTTP error from TWT API, performance was not found. (status code: {status}): '{response}'.".format(
-                        status=resp.status_code, response=resp.text))
+                        status=status_code, response=response_text))
 
             elif status == self.ERROR_STATUS:
                 error_msg = result['error']
@@ -294,7 +601,56 @@ class APIConnection(object):
             raise_error("responseHandlingError", 
                     "Received HTTP error from TWT API, but no status in payload "
                     "(status code: {status}): '{response}'.".format(
-                        status=resp.status_code, response=resp.text))
+                        status=status_code, response=response_text))
         return result
+
+    def perform_streaming_api_call(self, http_method, endpoint_type=None, params=None, items_key=None, missing_message=None):
+        #
+        # Yield the items of the items_key array of the response one at a time
+        # The response is parsed while it is read, only the other members of the payload are kept.
+        # Cached responses are read whole, they are kept as text in the cache anyway.
+        #
+        if not self.stream_responses or self.is_cacheable(http_method, endpoint_type):
+            result = self.perform_api_call(http_method, endpoint_type=endpoint_type, params=params)
+            if items_key not in result:
+                raise_error("requestHandlingError", missing_message)
+            return iter(result[items_key])
+
+        # The request is sent before the first item is asked for, so request errors are raised here
+        resp = self.perform_http_call(http_method, endpoint_type=endpoint_type, params=params, stream=True)
+        return self.iter_response_items(resp, items_key, missing_message)
+
+    def iter_response_items(self, resp, items_key, missing_message):
+        try:
+            response_object = StreamingJSONObject(resp.iter_content(chunk_size=self.STREAM_CHUNK_SIZE))
+            status_checked = []
+            # Items read before the status is known, they are only used once the status is checked
+            pending_items = []
+
+            def check_status(members):
+                # A status sent before the items is checked before the first item is used
+                if 'status' in members:
+                    self.check_api_result(members, resp.status_code, members)
+                    status_checked.append(True)
+
+            try:
+                for item in response_object.iter_items(items_key, before_items=check_status):
+                    if status_checked:
+                        yield item
+                    else:
+                        pending_items.append(item)
+            except ValueError as err:
+                raise_error("requestHandlingError",
+                    "Unable to decode TWT API response (status code: {status}): '{error}'.".format(
+                        status=resp.status_code, error=err))
+
+            self.check_api_result(response_object.members, resp.status_code, response_object.members)
+            if not response_object.found_items:
+                raise_error("requestHandlingError", missing_message)
+
+            for item in pending_items:
+                yield item
+        finally:
+            resp.close()
     
 
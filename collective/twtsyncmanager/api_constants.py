@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Constants of the Ticketworks API
+# Kept free of Plone imports, the offline API stand-in runs without Plone.
+#
+
+TIMEOUT = 10
+FOUND_STATUS = "PERFORMANCE_FOUND"
+NOT_FOUND_STATUS = "PERFORMANCE_NOT_FOUND"
+ERROR_STATUS = "ERROR"
+
+ENDPOINTS = { # TODO: should get this from the settings
+    "list": "performanceList",
+    "availability": "performanceAvailability",
+    "arrangements": "arrangementList"
+}
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Non-blocking Ticketworks API client
+# The API calls are queued and sent by a few worker threads, each call returns
+# an APIFuture right away. A process wide semaphore keeps the requests in flight
+# within the connection pool size, so thousands of availability requests are
+# multiplexed over a handful of connections. SyncAPIAdapter gives the
+# SyncManager the blocking interface of APIConnection on top of it, the
+# requests of a sync window are submitted together and waited for once.
+#
+
+# Global dependencies
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    # support python 2
+    from Queue import Queue
+
+# Product dependencies
+from .api_connection import APIConnection
+from .error import raise_error
+
+# Shared request slots
+# One semaphore per pool size, shared by every AsyncAPIConnection in the process
+_request_slots = {}
+_request_slots_lock = threading.Lock()
+
+
+def get_request_slots(pool_size):
+    """
+    Get the process wide semaphore that limits the requests in flight to the pool size
+    """
+    with _request_slots_lock:
+        request_slots = _request_slots.get(pool_size, None)
+        if request_slots is None:
+            request_slots = threading.BoundedSemaphore(pool_size)
+            _request_slots[pool_size] = request_slots
+        return request_slots
+
+
+class APIFuture(object):
+    """
+    Result of an API call that is sent in the background
+    """
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def done(self):
+        return self.finished.is_set()
+
+    def set_result(self, value):
+        self.value = value
+        self.finish()
+
+    def set_exception(self, error):
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        with self.lock:
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return None
+        callback(self)
+
+    def wait(self, timeout=None):
+        if not self.finished.wait(timeout):
+            raise_error("requestError", "TWT API call did not finish within %s seconds." %(timeout))
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        return self.error
+
+    def result(self, timeout=None):
+        # Errors of the call are raised here, with the types of raise_error
+        self.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class AsyncAPIConnection(object):
+
+    #
+    # Local definitions to the async API connection
+    #
+    WORKER_NAME = "twt-api-worker"
+
+    #
+    # Initialisation methods
+    #
+    def __init__(self, api_settings):
+        # Settings, validation, pooling, retries and caching are those of the blocking connection
+        self.connection = APIConnection(api_settings)
+        self.max_workers = self.connection.max_workers
+        # Workers beyond the pool size wait for a free connection
+        self.request_slots = get_request_slots(self.connection.pool_size)
+        self.calls = Queue()
+        self.workers = []
+        self.workers_lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #
+    # Workers
+    #
+    def start_workers(self):
+        with self.workers_lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            for index in range(self.max_workers - len(self.workers)):
+                worker = threading.Thread(target=self.work, name=self.WORKER_NAME)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                return
+            future, method, args, kwargs = call
+            try:
+                with self.request_slots:
+                    self.count_in_flight(1)
+                    try:
+                        value = method(*args, **kwargs)
+                    finally:
+                        self.count_in_flight(-1)
+            except Exception as err:
+                future.set_exception(err)
+            else:
+                future.set_result(value)
+
+    def count_in_flight(self, value):
+        with self.stats_lock:
+            self.in_flight += value
+
+    def submit(self, method, *args, **kwargs):
+        self.start_workers()
+        future = APIFuture()
+        with self.stats_lock:
+            self.submitted += 1
+        self.calls.put((future, method, args, kwargs))
+        return future
+
+    def close(self):
+        # Queued calls are sent before the workers stop
+        with self.workers_lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            self.calls.put(None)
+        return len(workers)
+
+    #
+    # CRUD operations
+    #
+    def get_connection_stats(self):
+        connection_stats = self.connection.get_connection_stats()
+        connection_stats['async'] = {
+            "workers": len(self.workers),
+            "submitted": self.submitted,
+            "queued": self.calls.qsize(),
+            "in_flight": self.in_flight
+        }
+        return connection_stats
+
+    def get_performance_list_by_date(self, date_from, date_until):
+        # The dates are validated right away, the request errors are raised by the future
+        date_from = self.connection.validate_date(date_from)
+        date_until = self.connection.validate_date(date_until)
+        return self.submit(self.connection.get_performance_list_by_date, date_from=date_from, date_until=date_until)
+
+    def get_arrangement_list_by_date(self, date_from, date_until):
+        date_from = self.connection.validate_date(date_from)
+        date_until = self.connection.validate_date(date_until)
+        return self.submit(self.connection.get_arrangement_list_by_date, date_from=date_from, date_until=date_until)
+
+    def get_arrangement_index_by_date(self, date_from, date_until):
+        date_from = self.connection.validate_date(date_from)
+        date_until = self.connection.validate_date(date_until)
+        return self.submit(self.connection.get_arrangement_index_by_date, date_from=date_from, date_until=date_until)
+
+    def get_arrangement_list_by_performance_id(self, find_performance_id, date_from, date_until):
+        date_from = self.connection.validate_date(date_from)
+        date_until = self.connection.validate_date(date_until)
+        return self.submit(self.connection.get_arrangement_list_by_performance_id, find_performance_id, date_from=date_from, date_until=date_until)
+
+    def get_performance_availability(self, performance_id):
+        return self.submit(self.connection.get_performance_availability, performance_id)
+
+    def get_performance_availability_by_ids(self, performance_ids):
+        #
+        # Request the availability of several performances through the workers
+        # Returns: a future of { performance_id: performance data or the error raised for it }
+        #
+        availability_future = APIFuture()
+        performance_futures = [(str(performance_id), self.get_performance_availability(performance_id)) for performance_id in performance_ids]
+        pending = [len(performance_futures)]
+        pending_lock = threading.Lock()
+
+        def performance_done(future):
+            with pending_lock:
+                pending[0] -= 1
+                all_done = pending[0] == 0
+            if all_done:
+                availability_future.set_result(dict((performance_id, future.error if future.error is not None else future.value) for performance_id, future in performance_futures))
+
+        if not performance_futures:
+            availability_future.set_result({})
+        for performance_id, future in performance_futures:
+            future.add_done_callback(performance_done)
+        return availability_future
+
+    def get_window_data(self, date_from, date_until):
+        #
+        # Request the performances of a date range with their arrangements and availability
+        # The list and arrangements are requested together, the availability as soon as the list is in
+        # Returns: a future of the window data of APIConnection.get_window_data
+        #
+        window_future = APIFuture()
+        list_future = self.get_performance_list_by_date(date_from=date_from, date_until=date_until)
+        arrangement_future = self.get_arrangement_index_by_date(date_from=date_from, date_until=date_until)
+
+        def window_done(performance_list, availability_future):
+            if arrangement_future.error is not None:
+                window_future.set_exception(arrangement_future.error)
+            else:
+                window_future.set_result({
+                    "performance_list": performance_list,
+                    "arrangement_index": arrangement_future.value,
+                    "availability_data": availability_future.value
+                })
+
+        def list_done(future):
+            # Runs in a worker thread, the availability requests are queued behind the arrangements
+            if future.error is not None:
+                window_future.set_exception(future.error)
+                return None
+            performance_list = future.value
+            availability_future = self.get_performance_availability_by_ids([performance.get('id', '') for performance in performance_list])
+            availability_future.add_done_callback(lambda availability_future: arrangement_future.add_done_callback(lambda arrangement_future: window_done(performance_list, availability_future)))
+
+        list_future.add_done_callback(list_done)
+        return window_future
+
+
+class SyncAPIAdapter(object):
+    """
+    Blocking interface of APIConnection on top of AsyncAPIConnection, for the SyncManager.
+    Methods without an async version are called on the blocking connection.
+    """
+
+    def __init__(self, async_connection):
+        self.async_connection = async_connection
+
+    def __getattr__(self, name):
+        return getattr(self.async_connection.connection, name)
+
+    def close(self):
+        return self.async_connection.close()
+
+    def get_connection_stats(self):
+        return self.async_connection.get_connection_stats()
+
+    def get_performance_list_by_date(self, date_from, date_until):
+        return self.async_connection.get_performance_list_by_date(date_from=date_from, date_until=date_until).result()
+
+    def get_arrangement_list_by_date(self, date_from, date_until):
+        return self.async_connection.get_arrangement_list_by_date(date_from=date_from, date_until=date_until).result()
+
+    def get_arrangement_index_by_date(self, date_from, date_until):
+        return self.async_connection.get_arrangement_index_by_date(date_from=date_from, date_until=date_until).result()
+
+    def get_arrangement_list_by_performance_id(self, find_performance_id, date_from, date_until):
+        return self.async_connection.get_arrangement_list_by_performance_id(find_performance_id, date_from=date_from, date_until=date_until).result()
+
+    def get_performance_availability(self, performance_id):
+        return self.async_connection.get_performance_availability(performance_id).result()
+
+    def get_performance_availability_by_ids(self, performance_ids, max_workers=None):
+        # The concurrency is set by the workers of the async connection
+        return self.async_connection.get_performance_availability_by_ids(performance_ids).result()
+
+    def get_window_data(self, date_from, date_until):
+        return self.async_connection.get_window_data(date_from=date_from, date_until=date_until).result()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Sync pipeline benchmark by Andre Goncalves
+#
+# Runs the sync modes against a throwaway Plone site and the offline Ticketworks API
+# stand-in, and stores the results as JSON so releases can be compared.
+#
+# Usage (inside a Zope instance):
+#   bin/instance run path/to/collective/twtsyncmanager/benchmark.py --sizes 100,1000,10000 --output bench.json
+#   bin/instance run path/to/collective/twtsyncmanager/benchmark.py --sizes 100 --compare previous.json
+#
+
+# Global dependencies
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+import plone.api
+import transaction
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SpecialUsers import system
+from Acquisition import aq_base
+from Products.CMFPlone.CatalogTool import CatalogTool
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+
+# Product dependencies
+from collective.twtsyncmanager import logging as twt_logging
+from collective.twtsyncmanager.api_connection import APIConnection
+from collective.twtsyncmanager.fake_api import create_server
+from collective.twtsyncmanager.mapping_core import CORE as SYNC_CORE
+from collective.twtsyncmanager.sync_manager import SyncManager
+from collective.twtsyncmanager.utils import get_datetime_today, get_datetime_future
+
+BENCHMARK_SITE_ID = "twt-benchmark"
+PERFORMANCE_BEHAVIOR = "collective.behavior.performance.behavior.IPerformance"
+SYNC_MODES = ["list_create", "list_unchanged", "availability_unchanged", "availability_changed", "list_changed", "performance_by_id"]
+METRICS = ["wall_time", "http_calls", "catalog_queries", "commits", "objects_written"]
+# Status of a committed transaction, as exposed by ITransaction.status
+COMMITTED_STATUS = "Committed"
+
+
+class TransactionCounter(object):
+    """Transaction synchronizer counting commits and the objects written by them."""
+
+    def __init__(self):
+        self.commits = 0
+        self.objects_written = 0
+        self.pending_objects = 0
+
+    def beforeCompletion(self, txn):
+        # Also called before an abort, the objects only count when the transaction commits
+        self.pending_objects = sum([len(self.get_pending_oids(resource)) for resource in getattr(txn, '_resources', [])])
+
+    def get_pending_oids(self, resource):
+        # The changes made before the last savepoint are kept in the savepoint storage
+        oids = set(getattr(resource, '_added', {}).keys())
+        oids.update(obj._p_oid for obj in getattr(resource, '_registered_objects', []))
+        savepoint_storage = getattr(resource, '_savepoint_storage', None)
+        if savepoint_storage is not None:
+            oids.update(savepoint_storage.index.keys())
+        oids.discard(None)
+        return oids
+
+    def afterCompletion(self, txn):
+        if txn.status == COMMITTED_STATUS:
+            self.commits += 1
+            self.objects_written += self.pending_objects
+        self.pending_objects = 0
+
+    def newTransaction(self, txn):
+        pass
+
+
+class CatalogCounter(object):
+    """Counts the queries of one portal_catalog while installed."""
+
+    WRAPPED_METHODS = ["searchResults", "__call__"]
+
+    def __init__(self):
+        self.queries = 0
+        self.catalog = None
+        self.original_methods = {}
+
+    def install(self, catalog):
+        # The catalog is called through its class, and the tool is persistent: an attribute
+        # set on it would be written by the next commit. The class methods are wrapped while
+        # the benchmark runs and only the queries of this catalog are counted.
+        self.catalog = aq_base(catalog)
+        for name in self.WRAPPED_METHODS:
+            self.original_methods[name] = CatalogTool.__dict__.get(name, None)
+            setattr(CatalogTool, name, self.wrap_method(getattr(CatalogTool, name)))
+
+    def wrap_method(self, method):
+        counter = self
+
+        def counted_method(catalog, *args, **kwargs):
+            if aq_base(catalog) is counter.catalog:
+                counter.queries += 1
+            return method(catalog, *args, **kwargs)
+
+        return counted_method
+
+    def uninstall(self):
+        for name, method in self.original_methods.items():
+            if method is None:
+                delattr(CatalogTool, name)
+            else:
+                setattr(CatalogTool, name, method)
+        self.original_methods = {}
+        self.catalog = None
+
+
+class SyncBenchmark(object):
+
+    def __init__(self, app, options):
+        self.app = app
+        self.options = options
+        self.transaction_counter = TransactionCounter()
+        self.catalog_counter = CatalogCounter()
+        self.random = random.Random(options.seed)
+
+    #
+    # Throwaway site
+    #
+    def create_site(self):
+        from Products.CMFPlone.factory import addPloneSite
+
+        if BENCHMARK_SITE_ID in self.app.objectIds():
+            self.app.manage_delObjects([BENCHMARK_SITE_ID])
+        site = addPloneSite(self.app, BENCHMARK_SITE_ID, extension_ids=self.options.profiles)
+        setSite(site)
+
+        fti = plone.api.portal.get_tool('portal_types')[SyncManager.DEFAULT_CONTENT_TYPE]
+        if PERFORMANCE_BEHAVIOR not in fti.behaviors:
+            fti.behaviors = tuple(fti.behaviors) + (PERFORMANCE_BEHAVIOR,)
+
+        if not plone.api.content.get(path=SyncManager.DEFAULT_FOLDER):
+            plone.api.content.create(container=site, type="Folder", id=SyncManager.DEFAULT_FOLDER.strip('/'), title="Programma")
+
+        transaction.commit()
+        return site
+
+    def delete_site(self):
+        setSite(None)
+        transaction.abort()
+        if BENCHMARK_SITE_ID in self.app.objectIds():
+            self.app.manage_delObjects([BENCHMARK_SITE_ID])
+            transaction.commit()
+
+    #
+    # Measuring
+    #
+    def measure(self, size, mode, server, api_connection, sync_call):
+        server.reset_stats()
+        transaction.commit()
+        self.transaction_counter.commits = 0
+        self.transaction_counter.objects_written = 0
+        self.catalog_counter.queries = 0
+
+        self.catalog_counter.install(plone.api.portal.get_tool('portal_catalog'))
+        try:
+            start = time.time()
+            sync_stats = sync_call()
+            wall_time = time.time() - start
+        finally:
+            self.catalog_counter.uninstall()
+
+        result = {
+            "size": size,
+            "mode": mode,
+            "wall_time": round(wall_time, 3),
+            "http_calls": sum(server.get_stats().values()),
+            "catalog_queries": self.catalog_counter.queries,
+            "commits": self.transaction_counter.commits,
+            "objects_written": self.transaction_counter.objects_written,
+            "sync_stats": dict(sync_stats or {}),
+            "connection_stats": api_connection.get_connection_stats()
+        }
+        print("[%s] %s: %.3fs, %s HTTP calls, %s catalog queries, %s commits, %s objects written" %(
+            size, mode, wall_time, result['http_calls'], result['catalog_queries'], result['commits'], result['objects_written']))
+        return result
+
+    def run_size(self, size):
+        server = create_server(performances=size, seed=self.options.seed, latency=self.options.latency,
+            payload_size=self.options.payload_size).start()
+        api_connection = APIConnection(server.get_api_settings())
+        date_from = get_datetime_today(as_string=True)
+        date_until = get_datetime_future(as_string=True)
+        results = []
+
+        def new_sync_manager():
+            sync_options = {"api": api_connection, 'core': SYNC_CORE, 'commit_batch_size': self.options.batch_size, 'commit_interval': 0}
+            return SyncManager(sync_options)
+
+        def run_list_sync():
+            sync_manager = new_sync_manager()
+            sync_manager.update_performance_list_by_date(date_from=date_from, date_until=date_until, create_and_unpublish=True)
+            return sync_manager.get_sync_stats()
+
+        def run_availability_sync():
+            sync_manager = new_sync_manager()
+            sync_manager.update_availability_by_date(date_from=date_from, date_until=date_until)
+            return sync_manager.get_sync_stats()
+
+        def run_performance_by_id():
+            sync_manager = new_sync_manager()
+            performance_ids = [performance['id'] for performance in server.season.performances]
+            for performance_id in self.random.sample(performance_ids, min(self.options.sample, len(performance_ids))):
+                sync_manager.update_performance_by_id(performance_id)
+            sync_manager.flush_commits()
+            return sync_manager.get_sync_stats()
+
+        try:
+            self.create_site()
+            results.append(self.measure(size, "list_create", server, api_connection, run_list_sync))
+            results.append(self.measure(size, "list_unchanged", server, api_connection, run_list_sync))
+            results.append(self.measure(size, "availability_unchanged", server, api_connection, run_availability_sync))
+            server.season.mutate(self.options.change_rate)
+            results.append(self.measure(size, "availability_changed", server, api_connection, run_availability_sync))
+            server.season.mutate(self.options.change_rate)
+            results.append(self.measure(size, "list_changed", server, api_connection, run_list_sync))
+            results.append(self.measure(size, "performance_by_id", server, api_connection, run_performance_by_id))
+        finally:
+            server.stop()
+            self.delete_site()
+
+        return results
+
+    def run(self):
+        twt_logging.print_status = False
+        twt_logging.print_errors = self.options.verbose
+        newSecurityManager(None, system)
+        transaction.manager.registerSynch(self.transaction_counter)
+
+        results = []
+        try:
+            for size in self.options.sizes:
+                results.extend(self.run_size(size))
+        finally:
+            transaction.manager.unregisterSynch(self.transaction_counter)
+
+        report = {
+            "created": datetime.now().isoformat(),
+            "options": {
+                "sizes": self.options.sizes,
+                "batch_size": self.options.batch_size,
+                "latency": self.options.latency,
+                "payload_size": self.options.payload_size,
+                "change_rate": self.options.change_rate,
+                "sample": self.options.sample,
+                "seed": self.options.seed
+            },
+            "results": results
+        }
+        return report
+
+
+def compare_reports(previous, current):
+    # Print the relative change per size, mode and metric
+    previous_results = dict(((result['size'], result['mode']), result) for result in previous.get('results', []))
+    for result in current['results']:
+        previous_result = previous_results.get((result['size'], result['mode']), None)
+        if not previous_result:
+            continue
+        changes = []
+        for metric in METRICS:
+            before = previous_result.get(metric, 0)
+            after = result.get(metric, 0)
+            if before:
+                changes.append("%s %+.1f%%" %(metric, (after - before) * 100.0 / before))
+            else:
+                changes.append("%s %s -> %s" %(metric, before, after))
+        print("[%s] %s: %s" %(result['size'], result['mode'], ", ".join(changes)))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the Ticketworks sync against a throwaway Plone site")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma separated number of performances")
+    parser.add_argument("--output", default="twt-benchmark.json", help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--batch-size", type=int, default=50, help="Commit batch size of the sync")
+    parser.add_argument("--latency", type=float, default=0, help="Latency of the API stand-in in seconds")
+    parser.add_argument("--payload-size", type=int, default=0, help="Extra bytes per performance and product")
+    parser.add_argument("--change-rate", type=float, default=0.1, help="Share of performances changed between runs")
+    parser.add_argument("--sample", type=int, default=20, help="Number of performances synced by ID")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--profile", dest="profiles", action="append", default=[], help="Extra GenericSetup profiles for the site")
+    parser.add_argument("--verbose", action="store_true")
+    options = parser.parse_args(argv)
+    options.sizes = [int(size) for size in options.sizes.split(',') if size.strip()]
+    if not options.profiles:
+        options.profiles = ["collective.behavior.performance:default", "collective.twtsyncmanager:default"]
+    return options
+
+
+def main(app, argv=None):
+    options = parse_arguments(argv)
+    app = makerequest(app)
+    report = SyncBenchmark(app, options).run()
+
+    with open(options.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print("Results stored in %s" %(options.output))
+
+    if options.compare:
+        with open(options.compare) as previous:
+            compare_reports(json.load(previous), report)
+
+    return report
+
+
+if __name__ == "__main__":
+    # 'app' is provided by 'bin/instance run'
+    main(app, sys.argv[1:])
@@ -1,21 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from collective.twtsyncmanager.api_connection import APIConnection
 from collective.twtsyncmanager.sync_manager import SyncManager
 from collective.twtsyncmanager.mapping_core import CORE as SYNC_CORE
 from Products.statusmessages.interfaces import IStatusMessage
 from zExceptions import Redirect
-from plone.registry.interfaces import IRegistry
-from zope.component import getUtility
 
 #
 # Product dependencies
 #
 from collective.twtsyncmanager.utils import get_api_settings, get_datetime_today, get_datetime_future
-from collective.twtsyncmanager.error import raise_error
 from collective.twtsyncmanager.logging import logger
+from collective.twtsyncmanager.sync_runs import SyncRunRegistry
+from collective.twtsyncmanager.jobs import get_job_queue
+from collective.twtsyncmanager.circuit_breaker import get_circuit_breaker_states
+from collective.twtsyncmanager.response_cache import get_response_cache_stats
+from collective.twtsyncmanager.rate_limiter import get_rate_limiter_states
 import plone.api
+import json
 
 def test_get_performances_future():
     with plone.api.env.adopt_user(username="admin"):
@@ -119,6 +123,24 @@ def test_api_arrangement_list_call():
 
 
 
+def enqueue_sync_job(view, job_type):
+    # The sync runs in the background worker, the job status is available in @@sync_job_status
+    # adopt_user looks the user up by the login name, it differs from the user id with email login or LDAP
+    user_name = plone.api.user.get_current().getUserName()
+    form = dict((key, view.request.form[key]) for key in ['batch_size', 'batch_interval'] if key in view.request.form)
+    job = get_job_queue().enqueue(job_type, "/".join(view.context.getPhysicalPath()), user_name, form)
+    status_url = "%s/@@sync_job_status?job_id=%s" %(view.context.absolute_url(), job.id)
+    return job, status_url
+
+def sync_job_response(view, job, status_url, message):
+    if view.request.form.get('format', None) == 'json':
+        view.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps(dict(job.to_dict(), status_url=status_url), default=str)
+
+    messages = IStatusMessage(view.request)
+    messages.add(u"%s Status: %s" %(message, status_url), type=u"info")
+    raise Redirect(view.context.absolute_url())
+
 #
 # Performance hourly sync
 #
@@ -128,71 +150,97 @@ class SyncPerformancesAvailability(BrowserView):
         return self.sync()
 
     def sync(self):
-        redirect_url = self.context.absolute_url()
-        messages = IStatusMessage(self.request)
+        job, status_url = enqueue_sync_job(self, "availability")
+        return sync_job_response(self, job, status_url, u"Performances availability sync is queued.")
 
-        # Get API settings from the controlpanel
-        api_settings = get_api_settings()
 
-        # Create the API connection
-        api_connection = APIConnection(api_settings)
+#
+# Performance List sync
+#
+class SyncPerformancesList(BrowserView):
 
-        # Create the settings for the sync
-        # Initiate the sync manager
-        sync_options = {"api": api_connection, 'core': SYNC_CORE}
-        sync_manager = SyncManager(sync_options)
+    def __call__(self):
+        return self.sync()
 
-        dateFrom = get_datetime_today(as_string=True)
-        dateUntil = get_datetime_future(as_string=True)
+    def sync(self):
+        job, status_url = enqueue_sync_job(self, "list")
+        return sync_job_response(self, job, status_url, u"Performance list sync is queued.")
 
-        try:
-            logger("[Status] Start availability sync.")
-            synced_availability_list = sync_manager.update_availability_by_date(date_from=dateFrom, date_until=dateUntil)
-            logger("[Status] Finished availability sync.")
-            messages.add(u"Performances availability is now synced.", type=u"info")
-        except Exception as err:
-            logger("[Error] Error while requesting the sync for the performances availability.", err)
-            messages.add(u"Performances availability failed to sync with the api. Please contact the website administrator.", type=u"error")
+#
+# Performance List incremental sync
+# Only new, changed and missing performances since the last run
+#
+class SyncPerformancesIncremental(BrowserView):
 
-        raise Redirect(redirect_url)
+    def __call__(self):
+        return self.sync()
 
+    def sync(self):
+        job, status_url = enqueue_sync_job(self, "incremental")
+        return sync_job_response(self, job, status_url, u"Performance list changes sync is queued.")
 
 #
-# Performance List sync
+# Sync job status
+# Returns the status and progress of the background sync jobs as JSON
 #
-class SyncPerformancesList(BrowserView):
+class SyncJobStatus(BrowserView):
 
     def __call__(self):
-        return self.sync()
+        self.request.response.setHeader("Content-Type", "application/json")
+        job_queue = get_job_queue()
+        job_id = self.request.form.get('job_id', None)
+
+        if job_id:
+            job = job_queue.get_job(job_id)
+            if job is None:
+                self.request.response.setStatus(404)
+                # The jobs are kept in memory by the Zope process that queued them, the other ZEO clients do not know them
+                return json.dumps({"error": "Sync job '%s' is not found. Sync jobs are only known by the Zope process that queued them." %(job_id)})
+            return json.dumps(self.get_job_status(job), default=str)
+
+        site_path = "/".join(self.context.getPhysicalPath())
+        return json.dumps({"jobs": [self.get_job_status(job) for job in job_queue.get_jobs(site_path)]}, default=str)
+
+    def get_job_status(self, job):
+        job_status = job.to_dict()
+        if job.joined_run_id:
+            # Progress of the sync run started by another client
+            joined_run = SyncRunRegistry(self.context).get_run(job.joined_run_id)
+            job_status['joined_run'] = joined_run.to_dict() if joined_run is not None else None
+        return job_status
 
-    def sync(self):
-        redirect_url = self.context.absolute_url()
-        messages = IStatusMessage(self.request)
+#
+# API status
+# Returns the state of the API circuit breakers, rate limiters and response caches of this process as JSON, for monitoring
+#
+class SyncAPIStatus(BrowserView):
 
-        # Get API settings from the controlpanel
-        api_settings = get_api_settings()
+    def __call__(self):
+        self.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps({"circuit_breakers": get_circuit_breaker_states(), "rate_limiters": get_rate_limiter_states(), "response_caches": get_response_cache_stats()})
 
-        # Create the API connection
-        api_connection = APIConnection(api_settings)
+#
+# Sync runs overview
+# Lists the recorded sync runs with their progress
+#
+class SyncRuns(BrowserView):
 
-        # Create the settings for the sync
-        # Initiate the sync manager
-        sync_options = {"api": api_connection, 'core': SYNC_CORE}
-        sync_manager = SyncManager(sync_options)
+    template = ViewPageTemplateFile("templates/sync_runs.pt")
 
-        dateFrom = get_datetime_today(as_string=True)
-        dateUntil = get_datetime_future(as_string=True)
+    def __call__(self):
+        return self.template()
 
-        try:
-            logger("[Status] Start syncing performance list.")
-            performance_list = sync_manager.update_performance_list_by_date(date_from=dateFrom, date_until=dateUntil, create_and_unpublish=True)
-            logger("[Status] Syncing performance list finished.")
-            messages.add(u"Performance list is now synced.", type=u"info")
-        except Exception as err:
-            logger("[Error] Error while requesting the sync for the performance list.", err)
-            messages.add(u"Performance list failed to sync with the api. Please contact the website administrator.", type=u"error")
+    def get_runs(self):
+        registry = SyncRunRegistry(self.context)
+        return [sync_run.to_dict() for sync_run in registry.get_runs()]
 
-        raise Redirect(redirect_url)
+    def format_date(self, value):
+        if value:
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        return ""
+
+    def format_stats(self, stats):
+        return ", ".join(["%s: %s" %(key, value) for key, value in sorted(stats.items())])
 
 #
 # Performance Availability
@@ -219,7 +267,8 @@ class SyncPerformance(BrowserView):
 
                 # Create the settings for the sync
                 # Initiate the sync manager
-                sync_options = {"api": api_connection, 'core': SYNC_CORE}
+                # A manual sync always writes the fields, also when the fingerprint did not change
+                sync_options = {"api": api_connection, 'core': SYNC_CORE, 'force_update': True}
                 sync_manager = SyncManager(sync_options)
                 
                 # Trigger the sync to update one performance
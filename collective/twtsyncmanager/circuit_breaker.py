@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Circuit breaker for the API
+# After a number of consecutive failures the breaker opens and requests fail fast.
+# After the reset timeout one trial request is let through, its result closes or
+# opens the breaker again.
+#
+
+# Global dependencies
+import threading
+import time
+
+CLOSED_STATE = "closed"
+OPEN_STATE = "open"
+HALF_OPEN_STATE = "half_open"
+
+# Shared circuit breakers
+# One breaker per API url, shared by every APIConnection in the process
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED_STATE
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CLOSED_STATE:
+                return True
+            if self.state == OPEN_STATE and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN_STATE
+            if self.state == HALF_OPEN_STATE and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.total_rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED_STATE
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.total_failures += 1
+            if self.state == HALF_OPEN_STATE or self.failures >= self.failure_threshold:
+                self.state = OPEN_STATE
+                self.opened_at = time.time()
+            self.trial_in_flight = False
+
+    def get_retry_time(self):
+        if self.opened_at is None:
+            return None
+        return self.opened_at + self.reset_timeout
+
+    def get_state(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "opened_at": self.opened_at,
+                "retry_at": self.get_retry_time(),
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected
+            }
+
+
+def get_circuit_breaker(name, failure_threshold=5, reset_timeout=60):
+    """
+    Get the process wide circuit breaker for the name, the settings of the last caller apply
+    """
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(name, None)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+            _circuit_breakers[name] = circuit_breaker
+        circuit_breaker.failure_threshold = failure_threshold
+        circuit_breaker.reset_timeout = reset_timeout
+        return circuit_breaker
+
+def get_circuit_breaker_states():
+    with _circuit_breakers_lock:
+        circuit_breakers = list(_circuit_breakers.values())
+    return [circuit_breaker.get_state() for circuit_breaker in circuit_breakers]
@@ -43,6 +43,224 @@ class ITWTControlPanel(Interface):
         required=False
     )
 
+    api_pool_size = schema.Int(
+        title=u'HTTP connection pool size',
+        description=u'Number of keep-alive connections kept open to the API',
+        required=False,
+        default=10
+    )
+
+    api_max_workers = schema.Int(
+        title=u'Concurrent API requests',
+        description=u'Maximum number of availability requests sent to the API at the same time',
+        required=False,
+        default=4
+    )
+
+    api_retries = schema.Int(
+        title=u'API request retries',
+        description=u'Number of times a failed API request is retried',
+        required=False,
+        default=3
+    )
+
+    api_retry_backoff = schema.Float(
+        title=u'API retry backoff (seconds)',
+        description=u'Base of the random exponential delay between retries',
+        required=False,
+        default=0.5
+    )
+
+    api_breaker_threshold = schema.Int(
+        title=u'API failures before requests are stopped',
+        description=u'After this many failures in a row the API requests fail immediately and the sync stops',
+        required=False,
+        default=5
+    )
+
+    api_breaker_reset = schema.Int(
+        title=u'API pause after failures (seconds)',
+        description=u'Time before a new API request is tried after the requests were stopped',
+        required=False,
+        default=60
+    )
+
+    api_rate_limit_list = schema.Float(
+        title=u'Performance list requests per second',
+        description=u'Maximum rate of the performance list requests. Use 0 for no limit.',
+        required=False,
+        default=0.0
+    )
+
+    api_rate_limit_availability = schema.Float(
+        title=u'Performance availability requests per second',
+        description=u'Maximum rate of the availability requests, shared by all threads of the Zope process. Use 0 for no limit.',
+        required=False,
+        default=0.0
+    )
+
+    api_rate_limit_arrangements = schema.Float(
+        title=u'Arrangement list requests per second',
+        description=u'Maximum rate of the arrangement list requests. Use 0 for no limit.',
+        required=False,
+        default=0.0
+    )
+
+    api_cache_backend = schema.Choice(
+        title=u'API response cache',
+        description=u'Keep the API responses for a while. The disk cache is shared by the ZEO clients on the same host.',
+        values=[u'none', u'memory', u'disk'],
+        required=False,
+        default=u'none'
+    )
+
+    api_cache_directory = schema.TextLine(
+        title=u'API response cache directory',
+        description=u'Directory of the disk cache, the temporary directory when empty',
+        required=False
+    )
+
+    api_cache_size = schema.Int(
+        title=u'API response cache size',
+        description=u'Maximum number of cached responses, the least recently used are removed first',
+        required=False,
+        default=1000
+    )
+
+    api_cache_list_ttl = schema.Int(
+        title=u'Performance list cache time (seconds)',
+        description=u'Use 0 to not cache the performance list',
+        required=False,
+        default=300
+    )
+
+    api_cache_availability_ttl = schema.Int(
+        title=u'Performance availability cache time (seconds)',
+        description=u'Use 0 to not cache the performance availability',
+        required=False,
+        default=60
+    )
+
+    api_cache_arrangements_ttl = schema.Int(
+        title=u'Arrangement list cache time (seconds)',
+        description=u'Use 0 to not cache the arrangement list',
+        required=False,
+        default=600
+    )
+
+    api_async_client = schema.Bool(
+        title=u'Send the API requests of the background syncs from worker threads',
+        description=u'The background sync jobs queue their API requests, which are sent by the concurrent API requests workers over the pooled connections',
+        required=False,
+        default=False
+    )
+
+    api_stream_responses = schema.Bool(
+        title=u'Read the list responses while they arrive',
+        description=u'The performance and arrangement lists are parsed one item at a time instead of loading the whole response in memory',
+        required=False,
+        default=True
+    )
+
+    sync_commit_batch_size = schema.Int(
+        title=u'Commit batch size',
+        description=u'Number of changed performances saved to the database in one commit',
+        required=False,
+        default=50
+    )
+
+    sync_commit_interval = schema.Int(
+        title=u'Commit interval (seconds)',
+        description=u'Commit the pending changes at least this often. Use 0 to commit by batch size only.',
+        required=False,
+        default=30
+    )
+
+    sync_window_months = schema.Int(
+        title=u'Sync window (months)',
+        description=u'The performance list is synced in windows of this many months, for example 1 per month or 12 per season. Use 0 to sync the whole range at once.',
+        required=False,
+        default=3
+    )
+
+    sync_lock_backend = schema.Choice(
+        title=u'Sync lock',
+        description=u'Where the lock that allows one sync at a time is kept. Use the file lock when the ZEO clients share a directory.',
+        values=[u'zodb', u'file', u'none'],
+        required=False,
+        default=u'zodb'
+    )
+
+    sync_lock_directory = schema.TextLine(
+        title=u'Sync lock directory',
+        description=u'Directory of the file lock, the temporary directory when empty',
+        required=False
+    )
+
+    sync_lock_timeout = schema.Int(
+        title=u'Sync lock lease (seconds)',
+        description=u'The lock of a sync that stopped responding expires after this time',
+        required=False,
+        default=300
+    )
+
+    sync_lock_conflict = schema.Choice(
+        title=u'When a sync is already running',
+        description=u'exit: stop the new sync, join: report the status of the running sync, wait: wait until the running sync is finished',
+        values=[u'exit', u'join', u'wait'],
+        required=False,
+        default=u'join'
+    )
+
+    sync_lock_wait = schema.Int(
+        title=u'Sync lock wait (seconds)',
+        description=u'Maximum time a new sync waits for the running sync',
+        required=False,
+        default=600
+    )
+
+    schedule_enabled = schema.Bool(
+        title=u'Scheduled syncs',
+        description=u'Run the availability and list syncs on a schedule inside the Zope process instead of an external cron job',
+        required=False,
+        default=False
+    )
+
+    schedule_user = schema.TextLine(
+        title=u'Scheduled syncs user',
+        description=u'User the scheduled syncs run as',
+        required=False,
+        default=u'admin'
+    )
+
+    schedule_availability_interval = schema.Int(
+        title=u'Availability sync interval (minutes)',
+        description=u'Use 0 to disable the scheduled availability sync',
+        required=False,
+        default=60
+    )
+
+    schedule_list_interval = schema.Int(
+        title=u'List sync interval (minutes)',
+        description=u'Use 0 to disable the scheduled list sync',
+        required=False,
+        default=1440
+    )
+
+    schedule_list_hour = schema.Int(
+        title=u'List sync hour',
+        description=u'Hour of the day the list sync interval starts from',
+        required=False,
+        default=3
+    )
+
+    schedule_jitter = schema.Int(
+        title=u'Schedule jitter (seconds)',
+        description=u'Random delay added to each scheduled run',
+        required=False,
+        default=300
+    )
+
 
 class PerformanceControlPanelForm(RegistryEditForm):
     schema = ITWTControlPanel
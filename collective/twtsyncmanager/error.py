@@ -47,6 +47,16 @@ class PerformanceNotFoundError(Error):
     """Errors related to handling the response from the API."""
     pass
 
+
+class CircuitOpenError(RequestError):
+    """Errors when the circuit breaker of the API is open."""
+    pass
+
+
+class SyncLockedError(Error):
+    """Errors when another sync holds the sync lock."""
+    pass
+
 # 
 # Error handling
 #
@@ -68,13 +78,21 @@ def _raise_response_handling_error(message):
 def _raise_performance_not_found_error(message):
     raise PerformanceNotFoundError(message)
 
+def _raise_circuit_open_error(message):
+    raise CircuitOpenError(message)
+
+def _raise_sync_locked_error(message):
+    raise SyncLockedError(message)
+
 def raise_error(error_type, message):
     switcher = {
         'requestSetupError': _raise_request_setup_error,
         'requestError': _raise_request_error,
         'requestHandlingError': _raise_response_handling_error,
         'performanceNotFoundError': _raise_performance_not_found_error,
-        'validationError': _raise_validation_error
+        'validationError': _raise_validation_error,
+        'syncLockedError': _raise_sync_locked_error,
+        'circuitOpenError': _raise_circuit_open_error
     }
 
     error_handler = switcher.get(error_type, None)
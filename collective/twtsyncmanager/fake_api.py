@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Offline Ticketworks API stand-in for load testing by Andre Goncalves
+#
+# Serves performanceList, performanceAvailability and arrangementList with the
+# same status semantics as the Ticketworks API. Seasons are generated from a seed,
+# or responses recorded from the real API are replayed.
+#
+# Usage:
+#   python -m collective.twtsyncmanager.fake_api --port 8899 --performances 1000
+#   python -m collective.twtsyncmanager.fake_api --record-dir ./recorded --upstream https://api.example.com
+#   python -m collective.twtsyncmanager.fake_api --replay-dir ./recorded
+#
+
+# Global dependencies
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, urlencode
+except ImportError:
+    # support python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import urlencode
+
+# Product dependencies
+from . import api_constants
+
+API_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+API_DATE_FORMAT = "%Y-%m-%d"
+FAKE_API_KEY = "fake-fake-fake-fake-fake"
+
+FOUND_STATUS = api_constants.FOUND_STATUS
+NOT_FOUND_STATUS = api_constants.NOT_FOUND_STATUS
+ERROR_STATUS = api_constants.ERROR_STATUS
+
+PERFORMANCE_STATUSES = ["ONSALE", "ONSALE", "ONSALE", "SOLDOUT", "CANCELLED", "AVAILABLESOON", "ONHOLD", "NOSALE"]
+EVENT_GENRES = ["Muziek", "Theater", "Dans", "Cabaret", "Jeugd", "Opera"]
+
+
+class FakeSeason(object):
+    """Synthetic Ticketworks programme generated from a seed."""
+
+    def __init__(self, performances=100, products=None, seed=1, payload_size=0, start_date=None):
+        self.random = random.Random(seed)
+        self.payload_size = payload_size
+        self.start_date = start_date or datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.lock = threading.Lock()
+
+        total_products = products if products is not None else max(performances // 10, 1)
+        self.performances = [self.generate_performance(index) for index in range(performances)]
+        self.performances_by_id = dict((str(performance['id']), performance) for performance in self.performances)
+        self.products = [self.generate_product(index) for index in range(total_products)]
+
+    def get_padding(self):
+        if self.payload_size:
+            return ["x" * self.payload_size]
+        return []
+
+    def generate_performance(self, index):
+        performance_id = 1000 + index
+        start = self.start_date + timedelta(days=index // 3, hours=19 + (index % 3))
+        performance_status = self.random.choice(PERFORMANCE_STATUSES)
+        sales_start = start - timedelta(days=120)
+
+        performance = {
+            "id": performance_id,
+            "title": "Performance %s" %(performance_id),
+            "subtitle": "Subtitle %s" %(performance_id),
+            "season": "%s-%s" %(start.year, start.year + 1),
+            "eventType": "Voorstelling",
+            "eventGenre": self.random.choice(EVENT_GENRES),
+            "tags": [],
+            "facility": "Grote Zaal",
+            "performanceStatus": performance_status,
+            "onsale": performance_status == "ONSALE",
+            "startOnlineSalesDate": sales_start.strftime(API_DATETIME_FORMAT),
+            "endOnlineSalesDate": start.strftime(API_DATETIME_FORMAT),
+            "statusMessage": "",
+            "percentageTaken": self.random.randint(0, 100),
+            "startDateTime": start.strftime(API_DATETIME_FORMAT),
+            "endDateTime": (start + timedelta(hours=2)).strftime(API_DATETIME_FORMAT),
+            "ranks": [{
+                "rankDescription": "Rang 1",
+                "prices": [
+                    {"priceTypeDescription": "Normaal", "price": "%s.00" %(self.random.randint(10, 60)), "isDefault": True, "currency": "EUR"},
+                    {"priceTypeDescription": "CJP", "price": "%s.00" %(self.random.randint(5, 10)), "isDefault": False, "currency": "EUR"}
+                ]
+            }],
+            "event": "Event %s" %(performance_id),
+            "date": start.strftime(API_DATE_FORMAT),
+            "code": "P%s" %(performance_id),
+            "facilityCode": "GZ",
+            "facilityAddressLines": self.get_padding()
+        }
+        return performance
+
+    def generate_product(self, index):
+        product_id = 500 + index
+        total_performances = len(self.performances)
+        arrangements = []
+        if total_performances:
+            for arrangement_index in range(self.random.randint(1, 5)):
+                performance = self.performances[self.random.randint(0, total_performances - 1)]
+                arrangements.append({
+                    "id": product_id * 100 + arrangement_index,
+                    "shortTitle": "Arrangement %s" %(product_id * 100 + arrangement_index),
+                    "performance": {"id": performance['id']}
+                })
+
+        product = {
+            "id": product_id,
+            "title": "Product %s" %(product_id),
+            "description": "".join(self.get_padding()),
+            "arrangements": arrangements
+        }
+        return product
+
+    def get_performance_list(self, date_from, date_until):
+        date_from = datetime.strptime(date_from, API_DATE_FORMAT)
+        date_until = datetime.strptime(date_until, API_DATE_FORMAT) + timedelta(days=1)
+        performances = []
+        for performance in self.performances:
+            start = datetime.strptime(performance['startDateTime'], API_DATETIME_FORMAT)
+            if date_from <= start < date_until:
+                performances.append(self.get_list_item(performance))
+        return performances
+
+    def get_list_item(self, performance):
+        list_fields = ["id", "title", "performanceStatus", "onsale", "statusMessage", "startOnlineSalesDate", "endOnlineSalesDate", "startDateTime", "endDateTime"]
+        return dict((field, performance[field]) for field in list_fields)
+
+    def get_performance(self, performance_id):
+        return self.performances_by_id.get(str(performance_id), None)
+
+    def mutate(self, rate):
+        # Change the availability of a share of the performances, to simulate upstream changes
+        with self.lock:
+            changed = 0
+            for performance in self.performances:
+                if self.random.random() < rate:
+                    performance['performanceStatus'] = self.random.choice(PERFORMANCE_STATUSES)
+                    performance['onsale'] = performance['performanceStatus'] == "ONSALE"
+                    performance['percentageTaken'] = self.random.randint(0, 100)
+                    changed += 1
+            return changed
+
+
+def dump_response(result):
+    """
+    JSON of a response with the status first, like the Ticketworks API, and the other keys sorted for stable ETags
+    """
+    if not isinstance(result, dict) or 'status' not in result:
+        return json.dumps(result, sort_keys=True)
+    members = [(key, result[key]) for key in ['status'] + sorted(key for key in result.keys() if key != 'status')]
+    return "{%s}" %(", ".join("%s: %s" %(json.dumps(key), json.dumps(value, sort_keys=True)) for key, value in members))
+
+
+class FakeTicketworksHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        endpoint = parsed_url.path.strip('/').split('/')[-1]
+        params = dict((param, values[0]) for param, values in parse_qs(parsed_url.query).items())
+        self.server.count_request(endpoint)
+
+        if endpoint.startswith('_'):
+            return self.send_json(200, self.server.handle_control(endpoint, params))
+
+        retry_after = self.server.check_quota()
+        if retry_after:
+            return self.send_json(429, {"status": ERROR_STATUS, "error": "Too many requests"}, headers={"Retry-After": str(retry_after)})
+
+        latency = self.server.get_latency()
+        if latency:
+            time.sleep(latency)
+
+        status_code, result = self.server.handle_api_call(endpoint, params)
+        return self.send_json(status_code, result, etag=True)
+
+    def send_json(self, status_code, result, etag=False, headers=None):
+        body = dump_response(result).encode('utf-8')
+        # Unchanged responses are answered with 304 when the client sends the ETag of its copy
+        body_etag = '"%s"' %(hashlib.sha1(body).hexdigest()) if etag and status_code == 200 else None
+        if body_etag and self.headers.get('If-None-Match', None) == body_etag:
+            self.send_response(304)
+            self.send_header('ETag', body_etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if body_etag:
+            self.send_header('ETag', body_etag)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTicketworksServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    ENDPOINTS = api_constants.ENDPOINTS
+
+    def __init__(self, address, season=None, latency=0, jitter=0, error_rate=0, not_found_rate=0,
+                 record_dir=None, upstream=None, replay_dir=None, seed=1, verbose=False, quota=0):
+        HTTPServer.__init__(self, address, FakeTicketworksHandler)
+        self.season = season or FakeSeason(seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self.record_dir = record_dir
+        self.upstream = upstream
+        self.replay_dir = replay_dir
+        self.verbose = verbose
+        # Requests per second answered before the API responds with 429
+        self.quota = quota
+        self.quota_second = None
+        self.quota_requests = 0
+        self.throttled = 0
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.thread = None
+
+    #
+    # Server control
+    #
+    def get_url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%s" %(host, port)
+
+    def get_api_settings(self):
+        environment = {"url": self.get_url(), "api_key": FAKE_API_KEY}
+        return {"test": environment, "prod": environment, "api_mode": "test"}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count_request(self, endpoint):
+        with self.stats_lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {}
+
+    def check_quota(self):
+        # Seconds the client has to wait, None while the quota of this second is not used up
+        if not self.quota:
+            return None
+        with self.stats_lock:
+            second = int(time.time())
+            if second != self.quota_second:
+                self.quota_second = second
+                self.quota_requests = 0
+            self.quota_requests += 1
+            if self.quota_requests > self.quota:
+                self.throttled += 1
+                return 1
+        return None
+
+    def get_latency(self):
+        if self.jitter:
+            return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+        return self.latency
+
+    def handle_control(self, endpoint, params):
+        if endpoint == "_stats":
+            return self.get_stats()
+        elif endpoint == "_reset":
+            self.reset_stats()
+            return {}
+        elif endpoint == "_mutate":
+            return {"changed": self.season.mutate(float(params.get('rate', 0.1)))}
+        else:
+            return {"error": "Unknown control endpoint '%s'" %(endpoint)}
+
+    #
+    # API endpoints
+    #
+    def handle_api_call(self, endpoint, params):
+        if self.replay_dir:
+            return self.replay_response(endpoint, params)
+        elif self.upstream:
+            return self.record_response(endpoint, params)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 200, {"status": ERROR_STATUS, "error": "Simulated error for '%s'" %(endpoint)}
+
+        try:
+            if endpoint == self.ENDPOINTS['list']:
+                performances = self.season.get_performance_list(params['dateFrom'], params['dateUntil'])
+                return 200, {"status": FOUND_STATUS, "performances": performances}
+
+            elif endpoint == self.ENDPOINTS['availability']:
+                performance = self.season.get_performance(params.get('id', ''))
+                if performance is None or (self.not_found_rate and self.random.random() < self.not_found_rate):
+                    return 200, {"status": NOT_FOUND_STATUS}
+                return 200, {"status": FOUND_STATUS, "performance": performance}
+
+            elif endpoint == self.ENDPOINTS['arrangements']:
+                return 200, {"status": FOUND_STATUS, "products": self.season.products}
+
+            else:
+                return 404, {"status": ERROR_STATUS, "error": "Unknown endpoint '%s'" %(endpoint)}
+        except (KeyError, ValueError) as err:
+            return 200, {"status": ERROR_STATUS, "error": "Invalid request parameters: %s" %(err)}
+
+    #
+    # Record and replay
+    #
+    def get_recording_path(self, directory, endpoint, params):
+        # The API key is not part of the recording key
+        recorded_params = sorted((param, value) for param, value in params.items() if param != 'key')
+        recording_key = hashlib.sha1(json.dumps([endpoint, recorded_params]).encode('utf-8')).hexdigest()
+        return os.path.join(directory, "%s-%s.json" %(endpoint, recording_key))
+
+    def replay_response(self, endpoint, params):
+        recording_path = self.get_recording_path(self.replay_dir, endpoint, params)
+        if not os.path.exists(recording_path):
+            return 404, {"status": ERROR_STATUS, "error": "No recorded response for '%s'" %(endpoint)}
+
+        with open(recording_path) as recording:
+            recorded = json.load(recording)
+        return recorded['status_code'], recorded['response']
+
+    def record_response(self, endpoint, params):
+        import requests
+
+        url = "%s/%s?%s" %(self.upstream.rstrip('/'), endpoint, urlencode(sorted(params.items())))
+        response = requests.get(url, headers={'Accept': 'application/json'}, timeout=api_constants.TIMEOUT)
+        recorded = {"status_code": response.status_code, "response": response.json()}
+
+        if not os.path.isdir(self.record_dir):
+            os.makedirs(self.record_dir)
+        with open(self.get_recording_path(self.record_dir, endpoint, params), 'w') as recording:
+            json.dump(recorded, recording)
+
+        return recorded['status_code'], recorded['response']
+
+
+def create_server(host="localhost", port=0, performances=100, products=None, seed=1, payload_size=0, **kwargs):
+    season = FakeSeason(performances=performances, products=products, seed=seed, payload_size=payload_size)
+    return FakeTicketworksServer((host, port), season=season, seed=seed, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Ticketworks API stand-in")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--performances", type=int, default=100, help="Number of generated performances")
+    parser.add_argument("--products", type=int, default=None, help="Number of generated products (default: performances / 10)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--payload-size", type=int, default=0, help="Extra bytes added to every performance and product")
+    parser.add_argument("--latency", type=float, default=0, help="Response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="Random latency variation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of responses with an ERROR status")
+    parser.add_argument("--not-found-rate", type=float, default=0, help="Share of availability responses with PERFORMANCE_NOT_FOUND")
+    parser.add_argument("--quota", type=int, default=0, help="Requests per second answered before the API responds with 429")
+    parser.add_argument("--upstream", default=None, help="Real API URL to record responses from")
+    parser.add_argument("--record-dir", default=None, help="Directory to store recorded responses")
+    parser.add_argument("--replay-dir", default=None, help="Directory with recorded responses to replay")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.upstream and not args.record_dir:
+        parser.error("--upstream requires --record-dir")
+
+    server = create_server(
+        host=args.host, port=args.port, performances=args.performances, products=args.products,
+        seed=args.seed, payload_size=args.payload_size, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, not_found_rate=args.not_found_rate, record_dir=args.record_dir,
+        upstream=args.upstream, replay_dir=args.replay_dir, verbose=args.verbose, quota=args.quota)
+
+    print("Fake Ticketworks API running on %s (API key: %s)" %(server.get_url(), FAKE_API_KEY))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Background sync jobs
+# The sync views enqueue a job in a local queue, a worker thread runs the sync
+# in its own database connection. The job status is kept in memory per process.
+#
+
+# Global dependencies
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    from queue import Queue
+except ImportError:
+    # support python 2
+    from Queue import Queue
+
+try:
+    from io import BytesIO
+except ImportError:
+    # support python 2
+    from StringIO import StringIO as BytesIO
+
+import plone.api
+import transaction
+from ZPublisher.BaseRequest import RequestContainer
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+
+# Product dependencies
+from .api_connection import APIConnection
+from .async_api_connection import AsyncAPIConnection, SyncAPIAdapter
+from .error import SyncLockedError
+from .logging import logger
+from .mapping_core import CORE as SYNC_CORE
+from .sync_manager import SyncManager
+from .sync_runs import SyncRunRegistry, RUNNING_STATUS as RUN_RUNNING_STATUS
+from .utils import get_api_settings, get_sync_options, get_datetime_today, get_datetime_future
+
+MAX_JOBS = 100
+
+QUEUED_STATUS = "queued"
+RUNNING_STATUS = "running"
+FINISHED_STATUS = "finished"
+FAILED_STATUS = "failed"
+# Another sync holds the sync lock
+LOCKED_STATUS = "locked"
+JOINED_STATUS = "joined"
+
+
+#
+# Syncs run by the jobs
+#
+def run_availability_sync(sync_manager):
+    dateFrom = get_datetime_today(as_string=True)
+    dateUntil = get_datetime_future(as_string=True)
+    return sync_manager.update_availability_by_date(date_from=dateFrom, date_until=dateUntil)
+
+def run_list_sync(sync_manager):
+    dateFrom = get_datetime_today(as_string=True)
+    dateUntil = get_datetime_future(as_string=True)
+    if sync_manager.window_months:
+        return sync_manager.update_performance_list_by_windows(date_from=dateFrom, date_until=dateUntil, create_and_unpublish=True)
+    return sync_manager.update_performance_list_by_date(date_from=dateFrom, date_until=dateUntil, create_and_unpublish=True)
+
+def run_incremental_sync(sync_manager):
+    dateFrom = get_datetime_today(as_string=True)
+    dateUntil = get_datetime_future(as_string=True)
+    return sync_manager.update_performance_list_incremental(date_from=dateFrom, date_until=dateUntil)
+
+SYNC_JOBS = {
+    "availability": run_availability_sync,
+    "list": run_list_sync,
+    "incremental": run_incremental_sync
+}
+
+
+class SyncJob(object):
+
+    def __init__(self, job_type, site_path, user_name, form=None):
+        self.id = uuid.uuid4().hex
+        self.job_type = job_type
+        self.site_path = site_path
+        self.user_name = user_name
+        self.form = dict(form or {})
+        self.status = QUEUED_STATUS
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = ""
+        self.sync_manager = None
+        self.stats = {}
+        self.connection_stats = {}
+        self.lock_holder = None
+        self.joined_run_id = None
+
+    def is_active(self):
+        return self.status in (QUEUED_STATUS, RUNNING_STATUS)
+
+    def get_progress(self):
+        # The stats of the sync manager are plain dicts, they can be read from other threads
+        if self.sync_manager is not None:
+            stats = dict(self.sync_manager.get_sync_stats())
+            total = self.sync_manager.sync_total
+        else:
+            stats = dict(self.stats)
+            total = stats.pop('total', 0)
+        processed = sum([stats.get(key, 0) for key in ['changed', 'unchanged', 'skipped', 'failed']])
+        return {
+            "processed": processed,
+            "total": total,
+            "percentage": min(int(processed * 100 / total), 100) if total else 0,
+            "stats": stats
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.job_type,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "progress": self.get_progress(),
+            "connection_stats": self.connection_stats,
+            "lock_holder": self.lock_holder,
+            "joined_run_id": self.joined_run_id
+        }
+
+
+class SyncJobQueue(object):
+    """
+    Local queue with one worker thread, so the syncs of a process never run in parallel.
+    """
+
+    def __init__(self, app_factory=None):
+        self.queue = Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.app_factory = app_factory
+
+    def enqueue(self, job_type, site_path, user_name, form=None):
+        if job_type not in SYNC_JOBS:
+            raise ValueError("Unknown sync job type '%s'." %(job_type))
+
+        with self.lock:
+            # A sync that is already waiting or running is not queued again
+            for job in self.jobs.values():
+                if job.job_type == job_type and job.site_path == site_path and job.is_active():
+                    return job
+
+            job = SyncJob(job_type, site_path, user_name, form)
+            self.jobs[job.id] = job
+            self.prune()
+            self.start_worker()
+
+        self.queue.put(job.id)
+        logger("[Status] Sync job '%s' of type '%s' is queued." %(job.id, job_type))
+        return job
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id, None)
+
+    def get_jobs(self, site_path=None):
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if site_path is None or job.site_path == site_path]
+        return list(reversed(jobs))
+
+    def prune(self):
+        for job_id in list(self.jobs.keys()):
+            if len(self.jobs) <= MAX_JOBS:
+                break
+            if not self.jobs[job_id].is_active():
+                del self.jobs[job_id]
+
+    def start_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.work, name="twt-sync-worker")
+            self.worker.daemon = True
+            self.worker.start()
+
+    def work(self):
+        while True:
+            job = self.get_job(self.queue.get())
+            if job is not None:
+                self.run_job(job)
+            self.queue.task_done()
+
+    def run_job(self, job):
+        job.status = RUNNING_STATUS
+        job.started = time.time()
+        logger("[Status] Start sync job '%s' of type '%s'." %(job.id, job.job_type))
+        try:
+            self.execute_job(job)
+            job.status = FINISHED_STATUS
+            logger("[Status] Finished sync job '%s'." %(job.id))
+        except SyncLockedError as err:
+            job.status = JOINED_STATUS if job.joined_run_id else LOCKED_STATUS
+            job.error = str(err)
+            logger("[Status] Sync job '%s' is not run, another sync is running." %(job.id))
+        except Exception as err:
+            job.status = FAILED_STATUS
+            job.error = str(err)
+            logger("[Error] Error while running the sync job '%s' of type '%s'." %(job.id, job.job_type), err)
+        finally:
+            if job.sync_manager is not None:
+                job.stats = dict(job.sync_manager.get_sync_stats(), total=job.sync_manager.sync_total)
+                job.sync_manager = None
+            job.finished = time.time()
+
+    def get_app(self):
+        if self.app_factory is not None:
+            return self.app_factory()
+        import Zope2
+        return Zope2.app()
+
+    def wrap_app(self, app):
+        # The worker thread has no request of its own, the app is wrapped in an empty one
+        environ = {"SERVER_NAME": "localhost", "SERVER_PORT": "80", "REQUEST_METHOD": "GET"}
+        response = HTTPResponse(stdout=BytesIO())
+        request = HTTPRequest(BytesIO(), environ, response)
+        request['PARENTS'] = [app]
+        return app.__of__(RequestContainer(REQUEST=request))
+
+    def execute_job(self, job):
+        # The worker thread opens its own database connection
+        app = self.wrap_app(self.get_app())
+        try:
+            site = app.unrestrictedTraverse(job.site_path)
+            setSite(site)
+            setRequest(app.REQUEST)
+            with plone.api.env.adopt_user(username=job.user_name):
+                api_settings = get_api_settings()
+                api_connection = self.get_api_connection(api_settings)
+                sync_options = get_sync_options(api_connection, SYNC_CORE, form=job.form)
+                job.sync_manager = SyncManager(sync_options)
+                try:
+                    SYNC_JOBS[job.job_type](job.sync_manager)
+                except SyncLockedError:
+                    self.join_running_sync(job, site, sync_options['lock_settings'])
+                    raise
+                finally:
+                    job.connection_stats = api_connection.get_connection_stats()
+                    if isinstance(api_connection, SyncAPIAdapter):
+                        api_connection.close()
+            transaction.commit()
+        except Exception:
+            transaction.abort()
+            raise
+        finally:
+            setSite(None)
+            setRequest(None)
+            app._p_jar.close()
+
+    def get_api_connection(self, api_settings):
+        # The async client sends the requests of the job from its worker threads
+        if api_settings.get('async_client', None):
+            return SyncAPIAdapter(AsyncAPIConnection(api_settings))
+        return APIConnection(api_settings)
+
+    def join_running_sync(self, job, site, lock_settings):
+        # The job reports the run of the sync that holds the lock
+        job.lock_holder = job.sync_manager.lock_holder
+        if lock_settings.get('conflict', None) == "join":
+            running_runs = [sync_run for sync_run in SyncRunRegistry(site).get_runs() if sync_run.status == RUN_RUNNING_STATUS]
+            if running_runs:
+                job.joined_run_id = running_runs[0].id
+        return job.joined_run_id
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = SyncJobQueue()
+        return _job_queue
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Streaming JSON parser for the API responses
+# Reads a JSON object from chunks of bytes and yields the items of one of its
+# arrays one at a time, so the response text and the whole parsed response are
+# never held in memory. The other members of the object are kept, for example
+# the status of the response.
+#
+
+# Global dependencies
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_START = u"-0123456789"
+NUMBER_PART = u"0123456789.eE+-"
+# The parsed part of the buffer is dropped when it is larger than this
+TRIM_SIZE = 64 * 1024
+
+
+class StreamingJSONObject(object):
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder(encoding)()
+        self.buffer = u""
+        self.position = 0
+        self.exhausted = False
+        self.started = False
+        self.finished = False
+        # Members of the object other than the streamed array
+        self.members = {}
+        self.found_items = False
+
+    #
+    # Buffer
+    #
+    def read_more(self):
+        if self.exhausted:
+            return False
+
+        if self.position > TRIM_SIZE:
+            self.buffer = self.buffer[self.position:]
+            self.position = 0
+
+        for chunk in self.chunks:
+            if chunk:
+                text = self.text_decoder.decode(chunk)
+                if text:
+                    self.buffer += text
+                    return True
+
+        self.buffer += self.text_decoder.decode(b"", True)
+        self.exhausted = True
+        return False
+
+    def peek(self):
+        # Next character after the whitespace, None at the end of the stream
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return None
+
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError("Expected '%s' at position %s of the JSON stream, found '%s'." %("' or '".join(characters), self.position, character))
+        self.position += 1
+        return character
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # The value is not complete yet
+                if not self.read_more():
+                    raise
+                continue
+
+            # A number that reaches the end of the buffer can continue in the next chunk
+            is_number = self.buffer[self.position] in NUMBER_START
+            if (end == len(self.buffer) or (is_number and self.buffer[end] in NUMBER_PART)) and self.read_more():
+                continue
+
+            self.position = end
+            return value
+
+    #
+    # Object members
+    #
+    def iter_items(self, items_key, before_items=None):
+        """
+        Yield the items of the array under items_key, the other members are decoded into self.members.
+        before_items is called with the members read before the array, before its first item is decoded.
+        """
+        if not self.started:
+            self.started = True
+            self.expect('{')
+            if self.peek() == '}':
+                self.position += 1
+                self.finished = True
+
+        while not self.finished:
+            key = self.decode_value()
+            self.expect(':')
+
+            if key == items_key and self.peek() == '[':
+                self.found_items = True
+                self.position += 1
+                if before_items is not None:
+                    before_items(self.members)
+                if self.peek() == ']':
+                    self.position += 1
+                else:
+                    while True:
+                        yield self.decode_value()
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                self.members[key] = self.decode_value()
+
+            if self.expect(',}') == '}':
+                self.finished = True
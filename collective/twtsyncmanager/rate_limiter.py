@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Client side rate limiter for the API
+# A token bucket per API url and endpoint type, shared by the threads of the
+# process. A 429 response or a Retry-After header pauses the requests and halves
+# the rate; the rate grows back to the configured rate with each success.
+#
+
+# Global dependencies
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+# The rate is never lowered below this share of the configured rate
+MIN_RATE_FACTOR = 0.1
+# Share of the configured rate added back after each successful request
+RECOVERY_FACTOR = 0.05
+# Pause when a 429 response has no Retry-After header
+DEFAULT_PAUSE = 1
+
+# Shared rate limiters
+# One limiter per API url and endpoint type, shared by every APIConnection in the process
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header, in seconds or as an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    retry_date = parsedate_tz(value)
+    if retry_date is None:
+        return None
+    return max(mktime_tz(retry_date) - time.time(), 0)
+
+
+def get_limits(rate=None, burst=None):
+    """
+    Rate and bucket size of the limits, the bucket holds one second of requests by default
+    """
+    rate = float(rate) if rate else None
+    return rate, float(burst or max(rate or 1, 1))
+
+
+class RateLimiter(object):
+
+    def __init__(self, name, rate=None, burst=None):
+        self.name = name
+        self.lock = threading.Lock()
+        self.throttled = 0
+        self.waited = 0.0
+        self.paused_until = 0
+        self.configure(rate, burst)
+        self.updated = time.time()
+
+    def configure(self, rate=None, burst=None):
+        # A rate of 0 or None sends the requests without limit, the pauses asked by the API still apply
+        self.max_rate, self.burst = get_limits(rate, burst)
+        self.rate = self.max_rate
+        # A smaller bucket does not keep the tokens saved up in the old one
+        self.tokens = min(getattr(self, 'tokens', self.burst), self.burst)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Wait until a request may be sent, returns the seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.refill(now)
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                elif not self.rate:
+                    break
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+        if waited:
+            with self.lock:
+                self.waited += waited
+        return waited
+
+    def throttle(self, retry_after=None):
+        # The API asked to slow down
+        with self.lock:
+            now = time.time()
+            if self.max_rate:
+                self.rate = max(self.rate / 2, self.max_rate * MIN_RATE_FACTOR)
+            pause = retry_after if retry_after is not None else DEFAULT_PAUSE
+            self.paused_until = max(self.paused_until, now + pause)
+            self.tokens = 0
+            self.updated = now
+            self.throttled += 1
+
+    def record_success(self):
+        with self.lock:
+            if self.max_rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FACTOR)
+
+    def get_state(self):
+        with self.lock:
+            return {
+                "name": self.name,
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "burst": self.burst,
+                "paused_until": self.paused_until if self.paused_until > time.time() else None,
+                "throttled": self.throttled,
+                "waited": round(self.waited, 3)
+            }
+
+
+def get_rate_limiter(name, rate=None, burst=None):
+    """
+    Get the process wide rate limiter for the name, the limits of the last caller apply
+    """
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(name, None)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(name, rate, burst)
+            _rate_limiters[name] = rate_limiter
+        elif get_limits(rate, burst) != (rate_limiter.max_rate, rate_limiter.burst):
+            with rate_limiter.lock:
+                rate_limiter.configure(rate, burst)
+        return rate_limiter
+
+def get_rate_limiter_states():
+    with _rate_limiters_lock:
+        rate_limiters = list(_rate_limiters.values())
+    return [rate_limiter.get_state() for rate_limiter in rate_limiters]
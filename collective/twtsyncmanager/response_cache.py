@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# API response cache
+# Successful API responses are kept for a TTL per endpoint type. An expired
+# response is revalidated with its ETag or Last-Modified date when the API sent
+# one. The memory cache is shared by the threads of a process, the disk cache is
+# shared by the processes on the same host.
+#
+
+# Global dependencies
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    # support python 2
+    from urllib import urlencode
+
+MAX_ENTRIES = 1000
+# Params that are not part of the cache key
+EXCLUDED_PARAMS = ['key']
+
+
+def get_cache_key(http_method, url, params):
+    """
+    Cache key of a request to the full url of the endpoint, the API key is left out
+    """
+    key_params = sorted((param, value) for param, value in (params or {}).items() if param not in EXCLUDED_PARAMS)
+    return "%s %s?%s" %(http_method.upper(), url, urlencode(key_params))
+
+
+class CachedResponse(object):
+    """
+    Response served from the cache, with the parts of a requests response that are used
+    """
+
+    def __init__(self, cache_entry, revalidated=False):
+        self.cache_entry = cache_entry
+        self.status_code = cache_entry['status_code']
+        self.text = cache_entry['body']
+        self.headers = {}
+        self.from_cache = True
+        self.revalidated = revalidated
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache(object):
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, stat, value=1):
+        with self.stats_lock:
+            self.stats[stat] += value
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def create_entry(self, response, ttl):
+        now = time.time()
+        return {
+            "status_code": response.status_code,
+            "body": response.text,
+            "etag": response.headers.get('ETag', None),
+            "last_modified": response.headers.get('Last-Modified', None),
+            "stored": now,
+            "expires": now + ttl
+        }
+
+    def is_fresh(self, cache_entry):
+        return cache_entry['expires'] > time.time()
+
+    def can_revalidate(self, cache_entry):
+        return bool(cache_entry.get('etag', None) or cache_entry.get('last_modified', None))
+
+    def get_revalidation_headers(self, cache_entry):
+        headers = {}
+        if cache_entry.get('etag', None):
+            headers['If-None-Match'] = cache_entry['etag']
+        if cache_entry.get('last_modified', None):
+            headers['If-Modified-Since'] = cache_entry['last_modified']
+        return headers
+
+    def refresh(self, key, cache_entry, ttl):
+        # A 304 response renews the TTL of the stored response
+        cache_entry = dict(cache_entry, expires=time.time() + ttl)
+        self.set(key, cache_entry)
+        return cache_entry
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    LRU cache in memory, shared by the threads of the process
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        ResponseCache.__init__(self, max_entries)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            cache_entry = self.entries.pop(key, None)
+            if cache_entry is not None:
+                # Most recently used entries are at the end
+                self.entries[key] = cache_entry
+            return cache_entry
+
+    def set(self, key, cache_entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = cache_entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.count('evicted')
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskResponseCache(ResponseCache):
+    """
+    LRU cache in a directory, shared by the processes on the same host.
+    The access time of an entry is the modification time of its file.
+    """
+    EVICT_EVERY = 50
+
+    def __init__(self, directory=None, max_entries=MAX_ENTRIES):
+        ResponseCache.__init__(self, max_entries)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "twtsyncmanager-cache")
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Created by another process
+                pass
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, "%s.json" %(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path) as cache_file:
+                cache_entry = json.load(cache_file)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return cache_entry
+
+    def set(self, key, cache_entry):
+        path = self.get_path(key)
+        temporary_path = "%s.%s.%s.tmp" %(path, os.getpid(), threading.current_thread().ident)
+        with open(temporary_path, 'w') as cache_file:
+            json.dump(cache_entry, cache_file)
+        os.rename(temporary_path, path)
+
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                path = os.path.join(self.directory, filename)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        entries.sort()
+        for modified, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+                self.count('evicted')
+            except OSError:
+                continue
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+
+
+# Shared response caches
+# One cache per backend and location, shared by every APIConnection in the process
+_response_caches = {}
+_response_caches_lock = threading.Lock()
+
+def get_response_cache(backend, directory=None, max_entries=None):
+    max_entries = max_entries or MAX_ENTRIES
+    with _response_caches_lock:
+        cache_key = (backend, directory)
+        response_cache = _response_caches.get(cache_key, None)
+        if response_cache is None:
+            if backend == "memory":
+                response_cache = MemoryResponseCache(max_entries)
+            elif backend == "disk":
+                response_cache = DiskResponseCache(directory, max_entries)
+            else:
+                return None
+            _response_caches[cache_key] = response_cache
+        response_cache.max_entries = max_entries
+        return response_cache
+
+def get_response_cache_stats():
+    with _response_caches_lock:
+        response_caches = list(_response_caches.items())
+    return [dict(response_cache.get_stats(), backend=backend, directory=directory) for (backend, directory), response_cache in response_caches]
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# In-process sync scheduler
+# Replaces the external cron calls of the sync views. A scheduler thread in each
+# Zope process checks the schedules of the sites every minute and queues the due
+# syncs in the local job queue. A due run is claimed with a commit in the site
+# annotation, so when several ZEO clients run the scheduler only one of them
+# queues the run and the others get a ConflictError and skip it.
+#
+
+# Global dependencies
+import random
+import threading
+from datetime import datetime, timedelta
+
+import transaction
+from ZODB.POSException import ConflictError
+from persistent.mapping import PersistentMapping
+from zope.annotation.interfaces import IAnnotations
+from zope.component.hooks import setSite
+
+# Product dependencies
+from .jobs import get_job_queue
+from .logging import logger
+from .utils import get_schedule_settings
+
+SCHEDULE_KEY = "collective.twtsyncmanager.schedule"
+TICK_SECONDS = 60
+# A run that did not report back within this time is considered dead
+RUN_TIMEOUT = timedelta(hours=6)
+
+
+class SyncSchedule(object):
+    """
+    Persistent schedule of a site, stored in an annotation.
+    Keeps the next run, the last run and the running flag per sync job type.
+    """
+
+    def __init__(self, context):
+        annotations = IAnnotations(context)
+        schedule = annotations.get(SCHEDULE_KEY, None)
+        if schedule is None:
+            schedule = PersistentMapping()
+            annotations[SCHEDULE_KEY] = schedule
+        self.schedule = schedule
+
+    def get_entry(self, job_type):
+        entry = self.schedule.get(job_type, None)
+        if entry is None:
+            entry = PersistentMapping()
+            entry.update({"next_run": None, "last_started": None, "last_finished": None, "last_status": None, "running": False})
+            self.schedule[job_type] = entry
+        return entry
+
+    def is_running(self, job_type, now):
+        entry = self.get_entry(job_type)
+        return entry['running'] and entry['last_started'] is not None and now - entry['last_started'] < RUN_TIMEOUT
+
+    def is_due(self, job_type, now):
+        next_run = self.get_entry(job_type)['next_run']
+        return next_run is not None and now >= next_run
+
+    def set_next_run(self, job_type, next_run):
+        self.get_entry(job_type)['next_run'] = next_run
+
+    def mark_started(self, job_type, now):
+        entry = self.get_entry(job_type)
+        entry['running'] = True
+        entry['last_started'] = now
+
+    def mark_finished(self, job_type, status, now):
+        entry = self.get_entry(job_type)
+        entry['running'] = False
+        entry['last_finished'] = now
+        entry['last_status'] = status
+
+
+def get_next_run(now, interval, start_hour=None, jitter=0):
+    # Runs every interval minutes, aligned to start_hour when given
+    interval = timedelta(minutes=max(interval, 1))
+    if start_hour is None:
+        next_run = now + interval
+    else:
+        next_run = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+        while next_run > now:
+            next_run -= interval
+        while next_run <= now:
+            next_run += interval
+    if jitter:
+        next_run += timedelta(seconds=random.uniform(0, jitter))
+    return next_run
+
+
+def get_scheduled_jobs(schedule_settings):
+    scheduled_jobs = {}
+    if schedule_settings['availability_interval']:
+        scheduled_jobs['availability'] = (schedule_settings['availability_interval'], None)
+    if schedule_settings['list_interval']:
+        scheduled_jobs['list'] = (schedule_settings['list_interval'], schedule_settings['list_hour'])
+    return scheduled_jobs
+
+
+class SyncScheduler(object):
+
+    def __init__(self, app_factory=None, job_queue=None):
+        self.app_factory = app_factory
+        self.job_queue = job_queue
+        self.thread = None
+        self.stopped = threading.Event()
+        # Jobs queued by this process, per site path and job type
+        self.queued_jobs = {}
+
+    def get_app(self):
+        if self.app_factory is not None:
+            return self.app_factory()
+        import Zope2
+        return Zope2.app()
+
+    def get_job_queue(self):
+        return self.job_queue or get_job_queue()
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.run, name="twt-sync-scheduler")
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(TICK_SECONDS):
+            try:
+                self.tick()
+            except Exception as err:
+                logger("[Error] Error while checking the sync schedules.", err)
+
+    def tick(self, now=None):
+        app = self.get_app()
+        try:
+            for site in app.objectValues("Plone Site"):
+                try:
+                    self.check_site(site, now or datetime.now())
+                except Exception as err:
+                    transaction.abort()
+                    logger("[Error] Error while checking the sync schedule of the site '%s'." %(site.getId()), err)
+        finally:
+            setSite(None)
+            transaction.abort()
+            app._p_jar.close()
+
+    def check_site(self, site, now):
+        setSite(site)
+        schedule_settings = get_schedule_settings()
+        if not schedule_settings['enabled']:
+            return None
+
+        site_path = "/".join(site.getPhysicalPath())
+        self.update_finished_jobs(site, site_path, now)
+
+        for job_type, (interval, start_hour) in get_scheduled_jobs(schedule_settings).items():
+            self.check_job(site, site_path, job_type, interval, start_hour, schedule_settings, now)
+
+    def update_finished_jobs(self, site, site_path, now):
+        # Reports the jobs queued by this process that finished since the last check
+        for (job_site_path, job_type), job in list(self.queued_jobs.items()):
+            if job_site_path != site_path or job.is_active():
+                continue
+            try:
+                SyncSchedule(site).mark_finished(job_type, job.status, now)
+                transaction.commit()
+                del self.queued_jobs[(job_site_path, job_type)]
+            except ConflictError:
+                # Reported again on the next check
+                transaction.abort()
+
+    def check_job(self, site, site_path, job_type, interval, start_hour, schedule_settings, now):
+        schedule = SyncSchedule(site)
+        if schedule.get_entry(job_type)['next_run'] is None:
+            schedule.set_next_run(job_type, get_next_run(now, interval, start_hour, schedule_settings['jitter']))
+            return self.commit_claim(job_type)
+
+        if not schedule.is_due(job_type, now):
+            return False
+
+        next_run = get_next_run(now, interval, start_hour, schedule_settings['jitter'])
+        local_job = self.queued_jobs.get((site_path, job_type), None)
+        if schedule.is_running(job_type, now) or (local_job is not None and local_job.is_active()):
+            # The previous run is still going, this run is skipped
+            schedule.set_next_run(job_type, next_run)
+            if self.commit_claim(job_type):
+                logger("[Status] Scheduled %s sync skipped, the previous run is still going." %(job_type))
+            return False
+
+        # The claim is committed before the job is queued, a ConflictError means another client has it
+        schedule.set_next_run(job_type, next_run)
+        schedule.mark_started(job_type, now)
+        if not self.commit_claim(job_type):
+            return False
+
+        job = self.get_job_queue().enqueue(job_type, site_path, schedule_settings['user'])
+        self.queued_jobs[(site_path, job_type)] = job
+        logger("[Status] Scheduled %s sync is queued as job '%s'. Next run: %s" %(job_type, job.id, next_run))
+        return True
+
+    def commit_claim(self, job_type):
+        try:
+            transaction.commit()
+            return True
+        except ConflictError:
+            transaction.abort()
+            logger("[Status] Scheduled %s sync is claimed by another client." %(job_type))
+            return False
+
+
+_scheduler = None
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = SyncScheduler()
+    return _scheduler
+
+def start_scheduler(event=None):
+    # Started when the Zope process starts, it only queues syncs for the sites where the schedule is enabled
+    return get_scheduler().start()
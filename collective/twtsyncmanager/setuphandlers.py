@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+import plone.api
+import transaction
+
+# Product dependencies
+from .logging import logger
+
+PROFILE_ID = "profile-collective.twtsyncmanager:default"
+REINDEX_BATCH_SIZE = 500
+
+# Catalog indexes read by the sync: (index name, index type)
+CATALOG_INDEXES = [
+    ("performance_id", "FieldIndex"),
+    ("product_id", "FieldIndex"),
+    ("performanceStatus", "FieldIndex"),
+    ("onsale", "BooleanIndex"),
+    ("statusMessage", "FieldIndex"),
+    ("sync_fingerprint", "FieldIndex"),
+    ("last_synced", "DateIndex")
+]
+
+
+def add_catalog_indexes(catalog):
+    """
+    Add the missing sync indexes. Existing indexes are kept with their data.
+    """
+    current_indexes = catalog.indexes()
+    added_indexes = []
+    for name, meta_type in CATALOG_INDEXES:
+        if name not in current_indexes:
+            catalog.addIndex(name, meta_type)
+            added_indexes.append(name)
+            logger("[Status] Added catalog index '%s' (%s)." %(name, meta_type))
+    return added_indexes
+
+
+def reindex_performances(catalog, indexes, portal_type="Event", batch_size=REINDEX_BATCH_SIZE):
+    """
+    Index the performances in batches, committing after each batch so large sites
+    are not rebuilt in one transaction. Metadata is updated with every reindex.
+    """
+    brains = catalog.unrestrictedSearchResults(portal_type=portal_type)
+    total = len(brains)
+    idxs = indexes or ["getId"]
+
+    for position, brain in enumerate(brains, 1):
+        try:
+            obj = brain._unrestrictedGetObject()
+        except (AttributeError, KeyError):
+            logger("[Error] Cannot index the object at %s" %(brain.getPath()), "Object not found.")
+            continue
+
+        obj.reindexObject(idxs=idxs)
+        if position % batch_size == 0:
+            transaction.get().note("collective.twtsyncmanager: indexed %s of %s performances" %(position, total))
+            transaction.get().commit()
+            logger("[Status] Indexed %s of %s performances." %(position, total))
+
+    transaction.get().commit()
+    logger("[Status] Indexed %s performances." %(total))
+    return total
+
+
+def post_install(context):
+    """
+    Post install script for the default profile
+    """
+    catalog = plone.api.portal.get_tool('portal_catalog')
+    added_indexes = add_catalog_indexes(catalog)
+    # Also fills the metadata columns of existing performances
+    reindex_performances(catalog, added_indexes)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+# Cluster wide sync lock
+# A lease with an expiry time, renewed by the heartbeat of the sync that holds it.
+# The lease of a sync that died expires and can be taken over by the next sync.
+#
+
+# Global dependencies
+import json
+import os
+import socket
+import tempfile
+import time
+import uuid
+
+import transaction
+from ZODB.POSException import ConflictError
+from persistent.mapping import PersistentMapping
+from zope.annotation.interfaces import IAnnotations
+
+SYNC_LOCK_KEY = "collective.twtsyncmanager.sync_lock"
+DEFAULT_LOCK_NAME = "sync"
+LEASE_SECONDS = 300
+
+
+def get_lock_owner():
+    return "%s:%s:%s" %(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class ZODBSyncLock(object):
+    """
+    Lease stored in an annotation on the site, shared by all ZEO clients.
+    Acquiring and releasing commit the lease. The heartbeat only changes it, it is
+    committed with the next batch of the sync.
+    """
+    transactional = True
+
+    def __init__(self, context, name=DEFAULT_LOCK_NAME, lease_seconds=LEASE_SECONDS):
+        self.context = context
+        self.name = name
+        self.lease_seconds = lease_seconds
+
+    def get_leases(self):
+        annotations = IAnnotations(self.context)
+        leases = annotations.get(SYNC_LOCK_KEY, None)
+        if leases is None:
+            leases = PersistentMapping()
+            annotations[SYNC_LOCK_KEY] = leases
+        return leases
+
+    def get_holder(self):
+        lease = IAnnotations(self.context).get(SYNC_LOCK_KEY, {}).get(self.name, None)
+        if lease is None or lease['expires'] < time.time():
+            return None
+        return dict(lease)
+
+    def acquire(self, owner, info=None):
+        holder = self.get_holder()
+        if holder is not None and holder['owner'] != owner:
+            return False
+
+        now = time.time()
+        self.get_leases()[self.name] = {"owner": owner, "acquired": now, "heartbeat": now, "expires": now + self.lease_seconds, "info": dict(info or {})}
+        try:
+            transaction.get().commit()
+        except ConflictError:
+            # Another client acquired or renewed the lease at the same time
+            transaction.abort()
+            return False
+        return True
+
+    def heartbeat(self, owner):
+        leases = self.get_leases()
+        lease = leases.get(self.name, None)
+        if lease is None or lease['owner'] != owner:
+            return False
+        now = time.time()
+        leases[self.name] = dict(lease, heartbeat=now, expires=now + self.lease_seconds)
+        return True
+
+    def release(self, owner):
+        leases = self.get_leases()
+        lease = leases.get(self.name, None)
+        if lease is not None and lease['owner'] == owner:
+            del leases[self.name]
+            transaction.get().commit()
+            return True
+        return False
+
+    def refresh(self):
+        # Starts a new transaction to see the lease changes of other clients
+        transaction.abort()
+
+
+class FileSyncLock(object):
+    """
+    Lease stored in a file, shared by the ZEO clients on the same host or with a shared directory.
+    The lease file is created exclusively, an expired lease file is moved away before it is taken over.
+    """
+    transactional = False
+
+    def __init__(self, directory=None, name=DEFAULT_LOCK_NAME, lease_seconds=LEASE_SECONDS):
+        self.path = os.path.join(directory or tempfile.gettempdir(), "twtsyncmanager-%s.lock" %(name))
+        self.name = name
+        self.lease_seconds = lease_seconds
+
+    def read_lease(self, path=None):
+        try:
+            with open(path or self.path) as lease_file:
+                return json.load(lease_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_lease(self, lease, path):
+        with open(path, 'w') as lease_file:
+            json.dump(lease, lease_file)
+
+    def get_holder(self):
+        lease = self.read_lease()
+        if lease is None or lease['expires'] < time.time():
+            return None
+        return lease
+
+    def acquire(self, owner, info=None):
+        lease = self.read_lease()
+        if lease is not None:
+            if lease['owner'] == owner:
+                return self.heartbeat(owner)
+            if lease['expires'] >= time.time() or not self.remove_expired_lease(owner):
+                return False
+
+        now = time.time()
+        try:
+            lease_fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            # Another client created the lease first
+            return False
+        with os.fdopen(lease_fd, 'w') as lease_file:
+            json.dump({"owner": owner, "acquired": now, "heartbeat": now, "expires": now + self.lease_seconds, "info": dict(info or {})}, lease_file)
+        return True
+
+    def remove_expired_lease(self, owner):
+        stale_path = "%s.%s" %(self.path, owner.replace(':', '-'))
+        try:
+            os.rename(self.path, stale_path)
+        except OSError:
+            return False
+
+        # Another client may have taken over the lease between reading and moving it
+        lease = self.read_lease(stale_path)
+        if lease is not None and lease['expires'] >= time.time():
+            os.rename(stale_path, self.path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def heartbeat(self, owner):
+        lease = self.read_lease()
+        if lease is None or lease['owner'] != owner:
+            return False
+        now = time.time()
+        lease.update({"heartbeat": now, "expires": now + self.lease_seconds})
+        temporary_path = "%s.%s.tmp" %(self.path, os.getpid())
+        self.write_lease(lease, temporary_path)
+        os.rename(temporary_path, self.path)
+        return True
+
+    def release(self, owner):
+        lease = self.read_lease()
+        if lease is not None and lease['owner'] == owner:
+            os.remove(self.path)
+            return True
+        return False
+
+    def refresh(self):
+        pass
+
+
+def get_sync_lock(context, lock_settings):
+    backend = lock_settings.get('backend', None)
+    lease_seconds = lock_settings.get('timeout', None) or LEASE_SECONDS
+    if backend == "zodb":
+        return ZODBSyncLock(context, lease_seconds=lease_seconds)
+    elif backend == "file":
+        return FileSyncLock(lock_settings.get('directory', None), lease_seconds=lease_seconds)
+    return None
@@ -6,24 +6,35 @@
 #
 import plone.api
 import transaction
+import hashlib
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
 
 # Plone dependencies
 from zope.schema.interfaces import ITextLine, ITuple, IBool
+from ZODB.POSException import ConflictError
 from plone.app.textfield.interfaces import IRichText
 from plone.app.textfield.value import RichTextValue
 from zope.schema import getFieldsInOrder
 from plone.event.interfaces import IEventAccessor
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import OrderedDict
 from zope.component import getUtility
 from plone.i18n.normalizer.interfaces import IIDNormalizer
 
 # Product dependencies
 from collective.behavior.performance.behavior import IPerformance
-from .error import raise_error
+from .error import raise_error, CircuitOpenError
 from .logging import logger
 from .utils import str2bool, normalize_id
+from .sync_state import SyncState
+from .sync_runs import SyncRunRegistry
+from .sync_lock import get_sync_lock, get_lock_owner
 
-from collective.twtsyncmanager.utils import get_datetime_today, get_datetime_future, DATE_FORMAT
+from collective.twtsyncmanager.utils import get_datetime_today, get_datetime_future, split_date_range, DATE_FORMAT
 
 class SyncManager(object):
     #
@@ -32,6 +43,31 @@ class SyncManager(object):
     DEFAULT_CONTENT_TYPE = "Event"
     DEFAULT_FOLDER = "/programma"
     AVAILABILITY_FIELDS = ['onsale', 'performanceStatus', 'statusMessage']
+    SALES_WINDOW_FIELDS = ['startOnlineSalesDate', 'endOnlineSalesDate']
+    CLEAN_IGNORE_FIELDS = ['performance_id', 'waiting_list']
+    DATE_FIELDS = ['startDateTime', 'endDateTime']
+    API_DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+    FINGERPRINT_FIELD = 'sync_fingerprint'
+    LAST_SYNCED_FIELD = 'last_synced'
+    # Catalog indexes affected by a field, other fields are indexed under their own name
+    FIELD_INDEXES = {
+        "Subject": ["Subject", "SearchableText"],
+        "performance_title": ["SearchableText"],
+        "subtitle": ["SearchableText"],
+        "start": ["start", "end"],
+        "end": ["start", "end"]
+    }
+    METADATA_ONLY_INDEX = "getId"
+    PRODUCT_DETAILS_TTL = 3600
+    PRODUCT_IMAGE_SCALE = "mini"
+    # Performances processed before the checkpoint of the run is written
+    CHECKPOINT_SIZE = 100
+    LOCK_POLL_SECONDS = 5
+    # Commit retries after a ConflictError, with an exponential backoff in seconds
+    CONFLICT_RETRIES = 3
+    CONFLICT_BACKOFF = 0.5
+    # Hours after the last full run when an incremental run syncs every performance
+    FULL_SYNC_MAX_AGE = 24
     PERFORMANCE_STATUSES_TEXT = {
         "ONSALE": "Bestellen",
         "SOLDOUT": "Uitverkocht",
@@ -47,67 +83,294 @@ class SyncManager(object):
         self.twt_api = self.options['api']
         self.CORE = self.options['core']
         self.fields_schema = getFieldsInOrder(IPerformance)
+        self.force_update = self.options.get('force_update', False)
+        self.commit_batch_size = self.options.get('commit_batch_size', None) or 1
+        self.commit_interval = self.options.get('commit_interval', None) or 0
+        self.window_months = self.options.get('window_months', None) or 0
+        self.checkpoints = self.options.get('checkpoints', True)
+        self.pending_commits = 0
+        self.conflict_retries = self.options.get('conflict_retries', self.CONFLICT_RETRIES)
+        self.conflict_backoff = self.options.get('conflict_backoff', self.CONFLICT_BACKOFF)
+        self.full_sync_max_age = self.options.get('full_sync_max_age', self.FULL_SYNC_MAX_AGE)
+        self.pending_writes = OrderedDict()
+        self.pending_operations = []
+        self.replaying = False
+        self.sync_run = None
+        self.pending_checkpoints = []
+        self.sync_total = 0
+        self.lock_settings = self.options.get('lock_settings', None) or {}
+        self.sync_lock = None
+        self.lock_owner = None
+        self.lock_holder = None
+        self.last_heartbeat = 0
+        self.last_commit_time = time.time()
+        self.catalog_indexes = None
+        self.catalog_metadata = None
+        self.arrangement_index = None
+        self.arrangement_index_window = None
+        self.availability_data = {}
+        self.performance_brains = None
+        self.failed_performance_ids = set()
+        self.product_details = None
+        self.product_details_time = 0
+        self.product_details_ttl = self.options.get('product_details_ttl', self.PRODUCT_DETAILS_TTL)
+        self.sync_stats = {}
+        self.reset_sync_stats()
 
     #
     # Sync operations
     #
     def update_performance_by_id(self, performance_id, arrangement_list=None):
         performance = self.find_performance(performance_id)
-        performance_data = self.twt_api.get_performance_availability(performance_id)
+        performance_data = self.get_performance_availability(performance_id)
 
-        if not arrangement_list:
-            arrangement_list = self.twt_api.get_arrangement_list_by_performance_id(performance_id, date_from=get_datetime_today(as_string=True), date_until=get_datetime_future(as_string=True))
+        if arrangement_list is None:
+            arrangement_list = self.get_arrangements_by_performance_id(performance_id)
 
         updated_performance = self.update_performance(performance_id, performance, performance_data, arrangement_list)
 
         return updated_performance
 
     def update_performance_list_by_date(self, date_from, date_until, create_and_unpublish=False):
-        performance_list = self.twt_api.get_performance_list_by_date(date_from=date_from, date_until=date_until)
-        
+        self.start_sync_run()
+        with self.hold_sync_lock("list"):
+            date_from, date_until = self.begin_run_record("list_full" if create_and_unpublish else "list_update", date_from, date_until)
+
+            try:
+                performance_list = self.call_keeping_lock(self.twt_api.get_performance_list_by_date, date_from=date_from, date_until=date_until)
+                arrangement_index = self.load_arrangement_index(date_from=date_from, date_until=date_until)
+                self.add_run_total(len(performance_list))
+
+                if create_and_unpublish:
+                    website_performances = self.get_all_events(date_from=date_from)
+                    self.sync_performance_list(performance_list, website_performances, arrangement_index)
+                    # A full run is the baseline for the next incremental runs
+                    self.record_sync_state(performance_list, performance_list, arrangement_index, full=True)
+                else:
+                    self.update_performance_list(performance_list, arrangement_index)
+
+                self.flush_commits()
+            except Exception as err:
+                self.fail_run_record(err)
+                raise
+
+            self.finish_run_record()
+            self.log_sync_stats()
+            return performance_list
+
+    def update_performance_list_by_windows(self, date_from, date_until, create_and_unpublish=False, window_months=None):
+        # Splits the range in windows of window_months that are fetched, synced and committed one by one.
+        # The API data of the next window is fetched while the current window is written.
+        self.start_sync_run()
+        with self.hold_sync_lock("list"):
+            date_from, date_until = self.begin_run_record("windows_full" if create_and_unpublish else "windows_update", date_from, date_until)
+            window_months = window_months or self.window_months
+            windows = split_date_range(date_from, date_until, months=window_months)
+            failed_windows = []
+            synced_performance_ids = []
+            website_data = None
+            unsynced_data = None
+
+            try:
+                if create_and_unpublish:
+                    # A performance can move to another window, the website performances of the whole
+                    # range are matched with every window and unpublished after the last window
+                    website_data = self.build_website_data_dict(self.get_all_events(date_from=date_from, date_until=date_until))
+                    unsynced_data = dict(website_data)
+
+                next_window_fetch = self.start_window_fetch(windows[0]) if windows else None
+                for position, window in enumerate(windows):
+                    window_data = self.wait_window_fetch(next_window_fetch)
+                    next_window_fetch = self.start_window_fetch(windows[position + 1]) if position + 1 < len(windows) else None
+
+                    savepoint = transaction.savepoint(optimistic=True)
+                    window_checkpoints = len(self.pending_checkpoints)
+                    window_writes = set(self.pending_writes.keys())
+                    window_operations = len(self.pending_operations)
+                    try:
+                        performance_list = self.sync_window(window, window_data, create_and_unpublish, website_data, unsynced_data)
+                        synced_performance_ids.extend(str(performance.get('id', '')) for performance in performance_list)
+                        self.flush_commits()
+                    except Exception as err:
+                        # A batch committed during the window invalidates the savepoint
+                        if savepoint.valid:
+                            savepoint.rollback()
+                            del self.pending_checkpoints[window_checkpoints:]
+                            del self.pending_operations[window_operations:]
+                            for performance_id in [performance_id for performance_id in self.pending_writes.keys() if performance_id not in window_writes]:
+                                del self.pending_writes[performance_id]
+                        else:
+                            self.discard_pending_changes()
+                        if isinstance(err, CircuitOpenError):
+                            raise
+                        failed_windows.append(window)
+                        logger("[Error] Error while syncing the performances from %s until %s." %(window[0], window[1]), err)
+
+                if create_and_unpublish and not failed_windows:
+                    self.unpublish_performances(unsynced_data.values())
+                    self.record_full_sync_state(synced_performance_ids)
+
+                self.flush_commits()
+            except Exception as err:
+                self.fail_run_record(err)
+                raise
+
+            self.sync_stats['failed_windows'] = len(failed_windows)
+            self.finish_run_record()
+            logger("[Status] Synced %s of %s date windows." %(len(windows) - len(failed_windows), len(windows)))
+            self.log_sync_stats()
+            return synced_performance_ids
+
+    def sync_window(self, window, window_data, create_and_unpublish=False, website_data=None, unsynced_data=None):
+        if isinstance(window_data, Exception):
+            raise window_data
+
+        performance_list = window_data['performance_list']
+        self.add_run_total(len(performance_list))
+        arrangement_index = self.set_arrangement_index(window_data['arrangement_index'], window)
+        self.availability_data = window_data['availability_data']
+        self.performance_brains = None
+
         if create_and_unpublish:
-            website_performances = self.get_all_events(date_from=date_from)
-            self.sync_performance_list(performance_list, website_performances)
+            self.sync_performances(performance_list, website_data, unsynced_data, arrangement_index)
+            self.record_sync_state(performance_list, performance_list, arrangement_index, full=False, remove_missing=False)
         else:
-            self.update_performance_list(performance_list)
-        
+            self.update_performance_list(performance_list, arrangement_index)
+
         return performance_list
 
+    def start_window_fetch(self, window):
+        # Only API requests run in the fetch thread, the catalog and database are used in this thread
+        window_fetch = {"window": window, "result": None}
+        window_fetch['thread'] = threading.Thread(target=self.fetch_window, args=(window_fetch,))
+        window_fetch['thread'].daemon = True
+        window_fetch['thread'].start()
+        return window_fetch
+
+    def wait_window_fetch(self, window_fetch):
+        self.wait_keeping_lock(window_fetch['thread'])
+        return window_fetch['result']
+
+    def fetch_window(self, window_fetch):
+        date_from, date_until = window_fetch['window']
+        try:
+            # The async client sends the requests of the window together
+            window_fetch['result'] = self.twt_api.get_window_data(date_from=date_from, date_until=date_until)
+        except Exception as err:
+            window_fetch['result'] = err
+
+    def update_performance_list_incremental(self, date_from, date_until):
+        # Processes only new, changed and missing performances, compared with the sync state of the last run.
+        # The change check only sees the fields of the performance list, the arrangements and the product
+        # details. Fields that only the availability endpoint returns (prices, genre, subtitle, facility)
+        # are synced by a full run, so every performance is synced when the last full run is too old.
+        self.start_sync_run()
+        with self.hold_sync_lock("incremental"):
+            sync_state = self.get_sync_state()
+            performance_list = self.call_keeping_lock(self.twt_api.get_performance_list_by_date, date_from=date_from, date_until=date_until)
+            arrangement_index = self.load_arrangement_index(date_from=date_from, date_until=date_until)
+
+            website_performances = self.get_all_events(date_from=date_from)
+            website_data = self.build_website_data_dict(website_performances)
+            api_performance_ids = set(str(performance.get('id', '')) for performance in performance_list)
+            self.add_run_total(len(performance_list))
+
+            full_sync = self.is_full_sync_due(sync_state)
+            changed_list = []
+            for performance in performance_list:
+                performance_id = str(performance.get('id', ''))
+                fingerprint = self.generate_fingerprint(performance, arrangement_index.get(performance_id, []))
+                if not full_sync and performance_id in website_data and sync_state.get_fingerprint(performance_id) == fingerprint:
+                    self.sync_stats['skipped'] += 1
+                else:
+                    changed_list.append(performance)
+
+            # Changed performances and performances that are no longer in the API
+            changed_ids = set(str(performance.get('id', '')) for performance in changed_list)
+            website_changed = [brain for performance_id, brain in website_data.items() if performance_id in changed_ids or performance_id not in api_performance_ids]
+
+            logger("[Status] Incremental sync: %s of %s performances are new or changed." %(len(changed_list), len(performance_list)))
+            self.sync_performance_list(changed_list, website_changed, arrangement_index)
+            self.record_sync_state(performance_list, changed_list, arrangement_index, full=full_sync)
+
+            self.flush_commits()
+            self.log_sync_stats()
+            return changed_list
+
+    def is_full_sync_due(self, sync_state):
+        last_full_run = sync_state.get_last_full_run()
+        if not self.full_sync_max_age:
+            return False
+        if last_full_run is None or datetime.now() - last_full_run > timedelta(hours=self.full_sync_max_age):
+            logger("[Status] Incremental sync: no full sync within %s hours, all performances are synced." %(self.full_sync_max_age))
+            return True
+        return False
+
     def update_availability_by_date(self, date_from, date_until):
-        website_performances = self.get_all_events(date_from=date_from)
-        api_performances = self.twt_api.get_performance_list_by_date(date_from=date_from, date_until=date_until)
-        
-        performances_data = self.build_performances_data_dict(api_performances)
-        updated_availability = self.update_availability(performances_data, website_performances)
+        self.start_sync_run()
+        with self.hold_sync_lock("availability"):
+            website_performances = self.get_all_events(date_from=date_from)
+            # The performances are indexed by ID while the response is read
+            api_performances = self.twt_api.iter_performance_list_by_date(date_from=date_from, date_until=date_until)
+            self.add_run_total(len(website_performances))
 
-        return updated_availability
+            performances_data = self.build_performances_data_dict(api_performances)
+            updated_availability = self.update_availability(performances_data, website_performances)
+
+            self.flush_commits()
+            self.log_sync_stats()
+            return updated_availability
 
     #
     # CRUD operations
     #
     def update_performance(self, performance_id, performance, performance_data, arrangement_list=None):
-        updated_performance = self.update_all_fields(performance, performance_data, arrangement_list)
+        fingerprint = self.generate_fingerprint(performance_data, arrangement_list)
+        if not self.force_update and getattr(performance, self.FINGERPRINT_FIELD, None) == fingerprint:
+            self.sync_stats['skipped'] += 1
+            logger("[Status] Performance with ID '%s' is unchanged since the last sync." %(performance_id))
+            return performance
+
+        updated_performance = self.update_all_fields(performance, performance_data, arrangement_list, fingerprint)
         logger("[Status] Performance with ID '%s' is now updated. URL: %s" %(performance_id, performance.absolute_url()))
         return updated_performance
 
-    def create_performance(self, performance_id):
-        performance_data = self.twt_api.get_performance_availability(performance_id)
-        
+    def create_performance(self, performance_id, arrangement_list=None):
+        performance_data = self.get_performance_availability(performance_id)
+        return self.create_performance_from_data(performance_id, performance_data, arrangement_list)
+
+    def create_performance_from_data(self, performance_id, performance_data, arrangement_list=None):
+        savepoint = transaction.savepoint(optimistic=True)
+
         try:
             title = performance_data['title']
             description = performance_data.get('subtitle', '')
             new_performance_id = normalize_id(title)
             container = self.get_container()
             new_performance = plone.api.content.create(container=container, type=self.DEFAULT_CONTENT_TYPE, id=new_performance_id, safe_id=True, title=title, description=description)
+            # Created again from the same API data when the batch is replayed after a conflict
+            self.record_pending_operation(performance_id, "create_performance_from_data", performance_id, performance_data, arrangement_list)
             logger("[Status] Performance with ID '%s' is now created. URL: %s" %(performance_id, new_performance.absolute_url()))
-            updated_performance = self.update_performance(performance_id, new_performance, performance_data)
+            updated_performance = self.update_performance(performance_id, new_performance, performance_data, arrangement_list)
         except Exception as err:
+            self.rollback_performance(savepoint, performance_id)
             logger("[Error] Error while creating the performance ID '%s'" %(performance_id), err)
+            self.mark_failed(performance_id)
             return None
 
     def update_availability(self, performances_data, website_performances):
         availability_changed_list = [performance_brain for performance_brain in website_performances if self.is_availability_changed(performance_brain, self.get_performance_data_from_list_by_id(performance_brain, performances_data))]
-        updated_availability = [self.update_availability_field(performance_brain, performances_data[performance_brain.performance_id]) for performance_brain in availability_changed_list]
+        self.sync_stats['unchanged'] += len(website_performances) - len(availability_changed_list)
+        updated_availability = []
+        for performance_brain in availability_changed_list:
+            self.keep_sync_lock()
+            savepoint = transaction.savepoint(optimistic=True)
+            try:
+                updated_availability.append(self.update_availability_field(performance_brain, performances_data[performance_brain.performance_id]))
+            except Exception as err:
+                self.rollback_performance(savepoint, performance_brain.performance_id)
+                logger("[Error] Error while updating the availability for the performance ID: %s" %(performance_brain.performance_id), err)
+                self.mark_failed(performance_brain.performance_id)
         return updated_availability
         
     def create_new_performances(self, performances_data, website_data):
@@ -115,44 +378,114 @@ class SyncManager(object):
         created_performances = [self.create_performance(performance_id) for performance_id in new_performances]
         return new_performances
 
-    def update_performance_list(self, performance_list):
+    def update_performance_list(self, performance_list, arrangement_index=None):
+        if arrangement_index is None:
+            arrangement_index = self.arrangement_index or {}
+
+        # Performances processed before an interruption of the run are not synced again
+        performance_ids = [performance.get('id', '') for performance in performance_list if not self.is_checkpointed(performance.get('id', ''))]
+        self.load_performance_brains(performance_ids)
+        missing_performances = self.get_missing_performances(performance_ids)
+        self.prefetch_performance_availability([performance_id for performance_id in performance_ids if str(performance_id) not in missing_performances])
+
         for performance in performance_list:
             performance_id = performance.get('id', '')
+            if str(performance_id) in missing_performances or self.is_checkpointed(performance_id):
+                continue
+            self.keep_sync_lock()
+            savepoint = transaction.savepoint(optimistic=True)
             try:
-                performance_data = self.update_performance_by_id(performance_id)
+                arrangement_list = arrangement_index.get(str(performance_id), [])
+                performance_data = self.update_performance_by_id(performance_id, arrangement_list)
+                self.checkpoint(performance_id)
+            except CircuitOpenError:
+                # The API is down, the rest of the run would fail as well
+                self.rollback_performance(savepoint, performance_id)
+                raise
             except Exception as err:
+                self.rollback_performance(savepoint, performance_id)
                 logger("[Error] Error while requesting the sync for the performance ID: %s" %(performance_id), err)
+                self.mark_failed(performance_id)
         
         return performance_list
 
-    def sync_performance_list(self, performance_list, website_performances):
-
+    def sync_performance_list(self, performance_list, website_performances, arrangement_index=None):
         website_data = self.build_website_data_dict(website_performances)
+        unsynced_data = self.sync_performances(performance_list, website_data, dict(website_data), arrangement_index)
+        self.unpublish_performances(unsynced_data.values())
+        return performance_list
+
+    def sync_performances(self, performance_list, website_data, unsynced_data, arrangement_index=None):
+        #
+        # Update the performances of the list that are in the website and create the others
+        # website_data: performance ID to brain of the website performances, performances that are
+        # not in it are looked up by ID before they are created, their dates may have moved
+        # unsynced_data: the performances that are in the API list are removed from it
+        #
+        if arrangement_index is None:
+            arrangement_index = self.arrangement_index or {}
+
+        unknown_ids = [str(performance.get('id', '')) for performance in performance_list if str(performance.get('id', '')) not in website_data and not self.is_checkpointed(performance.get('id', ''))]
+        if unknown_ids:
+            website_data.update(self.find_performance_brains(unknown_ids))
+        self.performance_brains = dict(website_data)
+        self.prefetch_performance_availability([performance.get('id', '') for performance in performance_list if not self.is_checkpointed(performance.get('id', ''))])
 
         for performance in performance_list:
             performance_id = str(performance.get('id', ''))
-            if performance_id in website_data.keys():
-                consume_performance = website_data.pop(performance_id)
+            # Processed before an interruption of the run or not, it is still in the API so it stays published
+            unsynced_data.pop(performance_id, None)
+            if self.is_checkpointed(performance_id):
+                continue
+            arrangement_list = arrangement_index.get(performance_id, [])
+            self.keep_sync_lock()
+            savepoint = transaction.savepoint(optimistic=True)
+            if performance_id in website_data:
                 try:
-                    performance_data = self.update_performance_by_id(performance_id)
+                    performance_data = self.update_performance_by_id(performance_id, arrangement_list)
+                    self.checkpoint(performance_id)
+                except CircuitOpenError:
+                    # The API is down, the rest of the run would fail as well
+                    self.rollback_performance(savepoint, performance_id)
+                    raise
                 except Exception as err:
+                    self.rollback_performance(savepoint, performance_id)
                     logger("[Error] Error while updating the performance ID: %s" %(performance_id), err)
+                    self.mark_failed(performance_id)
             else:
                 try:
-                    new_performance = self.create_performance(performance_id)
+                    new_performance = self.create_performance(performance_id, arrangement_list)
+                    if performance_id not in self.failed_performance_ids:
+                        self.checkpoint(performance_id)
+                except CircuitOpenError:
+                    self.rollback_performance(savepoint, performance_id)
+                    raise
                 except Exception as err:
+                    self.rollback_performance(savepoint, performance_id)
                     logger("[Error] Error while creating the performance ID: %s" %(performance_id), err)
-        
-        if len(website_data.keys()) > 0:
-            unpublished_performances = [self.unpublish_performance(performance_brain.getObject()) for performance_brain in website_data.values()]
+                    self.mark_failed(performance_id)
 
-        return performance_list
+        return unsynced_data
+
+    def unpublish_performances(self, performance_brains):
+        for performance_brain in performance_brains:
+            self.keep_sync_lock()
+            self.unpublish_performance(performance_brain.getObject())
+            # Unpublished performances count towards the batch size like the updated ones
+            self.commit_changes()
 
     def unpublish_performance(self, performance):
         plone.api.content.transition(obj=performance, to_state="private")
+        self.record_pending_operation(getattr(performance, 'performance_id', None), "unpublish_performance_by_path", "/".join(performance.getPhysicalPath()))
         logger("[Status] Unpublished performance with ID: '%s'" %(getattr(performance, 'performance_id', '')))
         return performance
 
+    def unpublish_performance_by_path(self, path):
+        performance = plone.api.content.get(path=path)
+        if performance is None:
+            raise_error("performanceNotFoundError", "Performance at '%s' is not found in Plone" %(path))
+        return self.unpublish_performance(performance)
+
     def publish_performance(self, performance):
         plone.api.content.transition(obj=performance, to_state="published")
 
@@ -172,10 +505,15 @@ class SyncManager(object):
         results = self.get_all_events(date_from=today)
         return results
 
-    def get_all_events(self, date_from=None):
+    def get_all_events(self, date_from=None, date_until=None):
         if date_from:
             if isinstance(date_from, str):
                 date_from = datetime.strptime(date_from, DATE_FORMAT)
+            if date_until:
+                if isinstance(date_until, str):
+                    date_until = datetime.strptime(date_until, DATE_FORMAT) + timedelta(days=1, seconds=-1)
+                results = plone.api.content.find(portal_type=self.DEFAULT_CONTENT_TYPE, start={'query': [date_from, date_until], 'range': 'min:max'})
+                return results
             results = plone.api.content.find(portal_type=self.DEFAULT_CONTENT_TYPE, start={'query': date_from, 'range': 'min'})
             return results
         else:
@@ -185,6 +523,487 @@ class SyncManager(object):
     #
     # CRUD utils
     # 
+    def start_sync_run(self):
+        # Run-scoped data is loaded again for every run
+        self.arrangement_index = None
+        self.arrangement_index_window = None
+        self.availability_data = {}
+        self.performance_brains = None
+        self.failed_performance_ids = set()
+        self.product_details = None
+        self.sync_total = 0
+        return self.reset_sync_stats()
+
+    def mark_failed(self, performance_id):
+        self.sync_stats['failed'] += 1
+        self.failed_performance_ids.add(str(performance_id))
+
+    def get_sync_state(self):
+        return SyncState(plone.api.portal.get())
+
+    def record_sync_state(self, performance_list, processed_list, arrangement_index, full=False, remove_missing=True):
+        # Failed performances keep their previous fingerprint so the next run retries them
+        self.record_pending_operation(None, "record_sync_state", performance_list, processed_list, arrangement_index, full, remove_missing)
+        sync_state = self.get_sync_state()
+        state_changed = False
+        for performance in processed_list:
+            performance_id = str(performance.get('id', ''))
+            if performance_id not in self.failed_performance_ids:
+                fingerprint = self.generate_fingerprint(performance, arrangement_index.get(performance_id, []))
+                state_changed = sync_state.set_performance(performance_id, fingerprint, performance.get('performanceStatus', None)) or state_changed
+
+        if remove_missing:
+            api_performance_ids = set(str(performance.get('id', '')) for performance in performance_list)
+            removed_ids = sync_state.remove_performances([performance_id for performance_id in sync_state.get_performance_ids() if performance_id not in api_performance_ids])
+            sync_state.mark_run(full=full)
+            state_changed = True
+
+        if state_changed:
+            self.pending_commits += 1
+        return sync_state
+
+    def record_full_sync_state(self, synced_performance_ids):
+        # The performances that are in none of the windows are removed from the sync state
+        self.record_pending_operation(None, "record_full_sync_state", synced_performance_ids)
+        synced_performance_ids = set(synced_performance_ids)
+        sync_state = self.get_sync_state()
+        sync_state.remove_performances([performance_id for performance_id in sync_state.get_performance_ids() if performance_id not in synced_performance_ids])
+        sync_state.mark_run(full=True)
+        self.pending_commits += 1
+        return sync_state
+
+    @contextmanager
+    def hold_sync_lock(self, mode):
+        # Only one sync of a site runs at a time in the whole cluster
+        self.acquire_sync_lock(mode)
+        try:
+            yield self.sync_lock
+        except Exception:
+            # The uncommitted changes are not committed with the release of the lock
+            if self.sync_lock is not None and self.sync_lock.transactional:
+                self.discard_pending_changes()
+            raise
+        finally:
+            self.release_sync_lock()
+
+    def acquire_sync_lock(self, mode):
+        sync_lock = get_sync_lock(plone.api.portal.get(), self.lock_settings)
+        if sync_lock is None:
+            return None
+
+        owner = get_lock_owner()
+        wait_seconds = self.lock_settings.get('wait', 0) if self.lock_settings.get('conflict', None) == "wait" else 0
+        wait_until = time.time() + (wait_seconds or 0)
+        while not sync_lock.acquire(owner, {"mode": mode}):
+            if time.time() >= wait_until:
+                self.lock_holder = sync_lock.get_holder() or {}
+                raise_error("syncLockedError", "Another sync is already running on %s. Mode: %s" %(self.lock_holder.get('owner', 'another client'), self.lock_holder.get('info', {}).get('mode', 'unknown')))
+            time.sleep(self.LOCK_POLL_SECONDS)
+            sync_lock.refresh()
+
+        self.sync_lock = sync_lock
+        self.lock_owner = owner
+        self.last_heartbeat = time.time()
+        return sync_lock
+
+    def keep_sync_lock(self):
+        # Renews the lease while the sync runs, a ZODB lease is committed with the pending changes
+        if self.sync_lock is None or time.time() - self.last_heartbeat < self.sync_lock.lease_seconds / 5.0:
+            return None
+        self.renew_sync_lock()
+        self.last_heartbeat = time.time()
+        if self.sync_lock.transactional:
+            self.pending_commits += 1
+            self.flush_commits()
+        return self.sync_lock
+
+    def call_keeping_lock(self, method, *args, **kwargs):
+        # Long API requests run in a thread while this thread renews the lease of the sync lock
+        if self.sync_lock is None:
+            return method(*args, **kwargs)
+
+        api_call = {"result": None, "error": None}
+        def run_api_call():
+            try:
+                api_call['result'] = method(*args, **kwargs)
+            except Exception as err:
+                api_call['error'] = err
+
+        thread = threading.Thread(target=run_api_call)
+        thread.daemon = True
+        thread.start()
+        self.wait_keeping_lock(thread)
+        if api_call['error'] is not None:
+            raise api_call['error']
+        return api_call['result']
+
+    def wait_keeping_lock(self, thread):
+        # The database is only used in this thread, a ZODB lease is renewed here as well
+        while thread.is_alive():
+            thread.join(self.LOCK_POLL_SECONDS)
+            self.keep_sync_lock()
+
+    def renew_sync_lock(self):
+        if not self.sync_lock.heartbeat(self.lock_owner):
+            raise_error("syncLockedError", "The sync lock expired and is taken over by another sync.")
+        if self.sync_lock.transactional:
+            # A ZODB lease is written again when the batch is replayed after a conflict
+            self.record_pending_operation(None, "renew_sync_lock")
+        return self.sync_lock
+
+    def release_sync_lock(self):
+        if self.sync_lock is None:
+            return None
+        try:
+            self.sync_lock.release(self.lock_owner)
+        except Exception as err:
+            # The lease expires on its own
+            transaction.abort()
+            logger("[Error] Error while releasing the sync lock.", err)
+        self.sync_lock = None
+        self.lock_owner = None
+
+    def get_sync_run_registry(self):
+        return SyncRunRegistry(plone.api.portal.get())
+
+    def begin_run_record(self, mode, date_from, date_until):
+        # Returns the date range of the run, a resumed run keeps the range it was started with
+        if not self.checkpoints:
+            return date_from, date_until
+
+        self.start_run_record(mode, date_from, date_until)
+        self.pending_checkpoints = []
+        self.pending_commits += 1
+        self.flush_commits()
+        if self.sync_run.is_resumed():
+            logger("[Status] Resuming sync run '%s' after %s processed performances." %(self.sync_run.id, self.sync_run.record['processed']))
+        return self.sync_run.get_window()
+
+    def start_run_record(self, mode, date_from, date_until):
+        self.record_pending_operation(None, "start_run_record", mode, date_from, date_until)
+        self.sync_run = self.get_sync_run_registry().start_run(mode, date_from, date_until)
+        return self.sync_run
+
+    def add_run_total(self, total):
+        self.sync_total += total
+        self.add_run_record_total(total)
+
+    def add_run_record_total(self, total):
+        if self.sync_run is not None:
+            self.record_pending_operation(None, "add_run_record_total", total)
+            self.sync_run.add_total(total)
+
+    def is_checkpointed(self, performance_id):
+        return self.sync_run is not None and self.sync_run.is_processed(performance_id)
+
+    def checkpoint(self, performance_id):
+        # The checkpoint is committed together with the changes of the performance
+        if self.sync_run is None:
+            return
+        self.pending_checkpoints.append(str(performance_id))
+        if len(self.pending_checkpoints) >= self.CHECKPOINT_SIZE:
+            self.pending_commits += 1
+            self.flush_commits()
+
+    def finish_run_record(self):
+        if self.sync_run is not None:
+            self.store_run_finish()
+            self.pending_commits += 1
+            self.flush_commits()
+            self.sync_run = None
+
+    def store_run_finish(self):
+        self.record_pending_operation(None, "store_run_finish")
+        self.sync_run.finish(self.sync_stats)
+        return self.sync_run
+
+    def fail_run_record(self, err):
+        # Uncommitted changes are lost, the run resumes from its last committed checkpoint
+        if self.sync_run is None:
+            return
+        self.discard_pending_changes()
+        try:
+            self.sync_run.fail(str(err), self.sync_stats)
+            transaction.get().commit()
+        except Exception as run_err:
+            transaction.abort()
+            logger("[Error] Error while storing the failed sync run '%s'." %(self.sync_run.id), run_err)
+        self.sync_run = None
+
+    def reset_sync_stats(self):
+        self.sync_stats = {"changed": 0, "unchanged": 0, "skipped": 0, "failed": 0, "commits": 0, "reindexed": 0, "conflicts": 0, "retries": 0}
+        return self.sync_stats
+
+    def get_sync_stats(self):
+        return self.sync_stats
+
+    def log_sync_stats(self):
+        logger("[Status] Sync stats. Changed: %s, unchanged: %s, skipped: %s, failed: %s, conflicts: %s, retries: %s." %(self.sync_stats['changed'], self.sync_stats['unchanged'], self.sync_stats['skipped'], self.sync_stats['failed'], self.sync_stats['conflicts'], self.sync_stats['retries']))
+
+    def commit_changes(self):
+        # Commit every commit_batch_size changed performances or every commit_interval seconds
+        self.pending_commits += 1
+        interval_passed = self.commit_interval and (time.time() - self.last_commit_time) >= self.commit_interval
+        if self.pending_commits >= self.commit_batch_size or interval_passed:
+            self.flush_commits()
+        return self.pending_commits
+
+    def flush_commits(self):
+        if self.replaying:
+            # The batch is committed once it is replayed
+            return None
+        if self.pending_commits:
+            if self.commit_pending_changes():
+                self.sync_stats['commits'] += 1
+                logger("[Status] Committed a batch of %s performances." %(self.pending_commits))
+            self.pending_commits = 0
+        self.last_commit_time = time.time()
+        self.catalog_indexes = None
+        self.catalog_metadata = None
+
+    def commit_pending_changes(self):
+        # A ConflictError aborts the batch, the changed values of its performances and its other
+        # operations are applied again on the current version of the objects and the commit is
+        # retried with a backoff
+        for attempt in range(self.conflict_retries + 1):
+            try:
+                if self.sync_run is not None and self.pending_checkpoints:
+                    self.sync_run.add_processed(self.pending_checkpoints)
+                transaction.get().commit()
+                self.pending_checkpoints = []
+                self.pending_writes.clear()
+                self.pending_operations = []
+                return True
+            except ConflictError as err:
+                transaction.abort()
+                self.sync_stats['conflicts'] += 1
+                if attempt >= self.conflict_retries:
+                    logger("[Error] Batch of %s performances is not committed after %s retries." %(len(self.pending_writes), attempt), err)
+                    break
+                time.sleep(self.conflict_backoff * (2 ** attempt) + random.uniform(0, self.conflict_backoff))
+                self.sync_stats['retries'] += 1
+                logger("[Status] Conflict while committing, retry %s for %s performances." %(attempt + 1, len(self.pending_writes)))
+                self.replay_pending_writes()
+
+        # The performances of the batch are synced again by the next run
+        for performance_id in set(list(self.pending_writes.keys()) + [operation['performance_id'] for operation in self.pending_operations if operation['performance_id'] is not None]):
+            self.mark_failed(performance_id)
+        self.pending_writes.clear()
+        self.pending_operations = []
+        self.pending_checkpoints = []
+        return False
+
+    def record_pending_write(self, performance, performance_id, target_values, changed_fields):
+        # Keeps the changed values until they are committed
+        pending_write = self.pending_writes.setdefault(str(performance_id), {"path": "/".join(performance.getPhysicalPath()), "values": OrderedDict()})
+        for fieldname in changed_fields:
+            pending_write['values'][fieldname] = target_values[fieldname] if fieldname in target_values else self.get_field_value(performance, fieldname)
+        return pending_write
+
+    def record_pending_operation(self, performance_id, method, *args):
+        # Changes other than field values are replayed by calling the method again with the same arguments
+        self.pending_operations.append({"performance_id": str(performance_id) if performance_id is not None else None, "method": method, "args": args})
+
+    def discard_pending_write(self, performance_id):
+        # The changes are rolled back with the savepoint of the performance
+        performance_id = str(performance_id)
+        self.pending_operations = [operation for operation in self.pending_operations if operation['performance_id'] != performance_id]
+        return self.pending_writes.pop(performance_id, None)
+
+    def discard_pending_changes(self):
+        transaction.abort()
+        self.pending_commits = 0
+        self.pending_checkpoints = []
+        self.pending_writes.clear()
+        self.pending_operations = []
+
+    def rollback_performance(self, savepoint, performance_id):
+        # A batch committed or aborted while the performance was synced invalidates its savepoint,
+        # the transaction then only holds the changes made to the performance after the commit
+        if savepoint.valid:
+            savepoint.rollback()
+            self.discard_pending_write(performance_id)
+        else:
+            self.discard_pending_changes()
+
+    def replay_pending_writes(self):
+        # Only the objects of the batch are loaded again, no API data is requested
+        pending_operations, self.pending_operations = self.pending_operations, []
+        # The performances of the batch are counted as changed once
+        changed = self.sync_stats['changed']
+        self.replaying = True
+        try:
+            # Performances created in the aborted batch are created again with all their fields
+            created_ids = set(operation['performance_id'] for operation in pending_operations if operation['method'] == "create_performance_from_data")
+            for performance_id, pending_write in list(self.pending_writes.items()):
+                if performance_id in created_ids:
+                    del self.pending_writes[performance_id]
+                    continue
+                performance = plone.api.content.get(path=pending_write['path'])
+                if performance is None:
+                    # Deleted since the batch was written
+                    del self.pending_writes[performance_id]
+                    self.mark_failed(performance_id)
+                    continue
+                changed_fields = self.apply_field_changes(performance, pending_write['values'])
+                if changed_fields:
+                    self.reindex_performance(performance, changed_fields)
+
+            # The operations record themselves again
+            for operation in pending_operations:
+                if operation['performance_id'] is None:
+                    # Sync state, run record and lease writes
+                    getattr(self, operation['method'])(*operation['args'])
+                    continue
+                try:
+                    getattr(self, operation['method'])(*operation['args'])
+                except Exception as err:
+                    logger("[Error] Error while replaying the changes of the performance ID: %s" %(operation['performance_id']), err)
+                    self.discard_pending_write(operation['performance_id'])
+                    self.mark_failed(operation['performance_id'])
+        finally:
+            self.replaying = False
+            self.sync_stats['changed'] = changed
+
+        # Failed performances are not checkpointed, a resumed run syncs them again
+        self.pending_checkpoints = [performance_id for performance_id in self.pending_checkpoints if performance_id not in self.failed_performance_ids]
+        return self.pending_writes
+
+    def load_catalog_schema(self):
+        if self.catalog_indexes is None:
+            catalog = plone.api.portal.get_tool('portal_catalog')
+            self.catalog_indexes = set(catalog.indexes())
+            self.catalog_metadata = set(catalog.schema())
+        return self.catalog_indexes, self.catalog_metadata
+
+    def get_affected_indexes(self, changed_fields):
+        catalog_indexes, catalog_metadata = self.load_catalog_schema()
+        affected_indexes = set()
+        for fieldname in changed_fields:
+            affected_indexes.update(self.FIELD_INDEXES.get(fieldname, [fieldname]))
+
+        affected_metadata = set(changed_fields) & catalog_metadata
+        return sorted(affected_indexes & catalog_indexes), sorted(affected_metadata)
+
+    def reindex_performance(self, performance, changed_fields):
+        # Reindex only the indexes touched by the changed fields.
+        # Metadata is updated with any reindex, a cheap index is used when only metadata changed.
+        indexes, metadata = self.get_affected_indexes(changed_fields)
+        if indexes:
+            performance.reindexObject(idxs=indexes)
+        elif metadata:
+            performance.reindexObject(idxs=[self.METADATA_ONLY_INDEX])
+        else:
+            return []
+
+        self.sync_stats['reindexed'] += 1
+        return indexes or metadata
+
+    def load_arrangement_index(self, date_from, date_until):
+        # The arrangement list is fetched once per date window and reused for the whole run
+        window = (date_from, date_until)
+        if self.arrangement_index is None or self.arrangement_index_window != window:
+            arrangement_index = self.call_keeping_lock(self.twt_api.get_arrangement_index_by_date, date_from=date_from, date_until=date_until)
+            self.set_arrangement_index(arrangement_index, window)
+        return self.arrangement_index
+
+    def set_arrangement_index(self, arrangement_index, window):
+        self.arrangement_index = arrangement_index
+        self.arrangement_index_window = window
+        logger("[Status] Arrangement index loaded for %s performances." %(len(self.arrangement_index)))
+        self.load_product_details(self.get_arrangement_index_product_ids(self.arrangement_index))
+        return self.arrangement_index
+
+    def get_arrangement_index_product_ids(self, arrangement_index):
+        product_ids = set()
+        for arrangement_list in arrangement_index.values():
+            for arrangement in arrangement_list:
+                if arrangement.get('product_id', ''):
+                    product_ids.add(self.safe_value(arrangement['product_id']))
+        return product_ids
+
+    def load_product_details(self, product_ids):
+        # One catalog query for the products and one for their lead images
+        product_ids = list(product_ids)
+        brains = plone.api.content.find(product_id=product_ids) if product_ids else []
+
+        # The product_id metadata column is added by the profile, the objects are not loaded
+        product_brains = {}
+        for brain in brains:
+            product_id = getattr(brain, 'product_id', None)
+            if product_id:
+                product_brains.setdefault(self.safe_value(product_id), brain)
+
+        lead_media_uids = [brain.leadMedia for brain in product_brains.values() if getattr(brain, 'leadMedia', None)]
+        images = plone.api.content.find(UID=lead_media_uids) if lead_media_uids else []
+        image_urls = dict((image.UID, image.getURL()) for image in images)
+
+        self.product_details = dict((product_id, ("", "")) for product_id in product_ids)
+        for product_id, brain in product_brains.items():
+            lead_image_scale_url = ""
+            leadMedia = getattr(brain, 'leadMedia', None)
+            if leadMedia and leadMedia in image_urls:
+                lead_image_scale_url = "%s/@@images/image/%s" %(image_urls[leadMedia], self.PRODUCT_IMAGE_SCALE)
+            self.product_details[product_id] = (lead_image_scale_url, brain.Description)
+
+        self.product_details_time = time.time()
+        logger("[Status] Product details loaded for %s products." %(len(product_brains)))
+        return self.product_details
+
+    def get_cached_product_details(self, product_id):
+        if self.product_details is None:
+            return None
+        if self.product_details_ttl and (time.time() - self.product_details_time) > self.product_details_ttl:
+            # Expired details are loaded again for the same products, with the same two queries
+            self.load_product_details(set(self.product_details.keys()) | set([product_id]))
+        return self.product_details.get(product_id, None)
+
+    def prefetch_performance_availability(self, performance_ids):
+        # Only the API requests run concurrently, the database writes stay in this thread
+        missing_ids = [performance_id for performance_id in performance_ids if str(performance_id) not in self.availability_data]
+        if missing_ids:
+            self.availability_data.update(self.call_keeping_lock(self.twt_api.get_performance_availability_by_ids, missing_ids))
+            logger("[Status] Availability prefetched for %s performances." %(len(missing_ids)))
+        return self.availability_data
+
+    def get_performance_availability(self, performance_id):
+        performance_data = self.availability_data.pop(str(performance_id), None)
+        if performance_data is None:
+            return self.twt_api.get_performance_availability(performance_id)
+        elif isinstance(performance_data, Exception):
+            raise performance_data
+        else:
+            return performance_data
+
+    def load_performance_brains(self, performance_ids):
+        # One catalog query for all the performances in the run
+        self.performance_brains = self.find_performance_brains(performance_ids)
+        return self.performance_brains
+
+    def find_performance_brains(self, performance_ids):
+        performance_ids = [self.safe_value(performance_id) for performance_id in performance_ids]
+        brains = plone.api.content.find(performance_id=performance_ids) if performance_ids else []
+        performance_brains = {}
+        for brain in brains:
+            performance_id = getattr(brain, 'performance_id', None)
+            if performance_id:
+                performance_brains.setdefault(self.safe_value(performance_id), brain)
+        return performance_brains
+
+    def get_missing_performances(self, performance_ids):
+        missing_performances = set(str(performance_id) for performance_id in performance_ids if self.safe_value(performance_id) not in self.performance_brains)
+        if missing_performances:
+            logger("[Error] %s performances are not found in Plone. IDs: %s" %(len(missing_performances), ", ".join(sorted(missing_performances))), "performanceNotFoundError")
+            self.sync_stats['failed'] += len(missing_performances)
+            self.failed_performance_ids.update(missing_performances)
+        return missing_performances
+
+    def get_arrangements_by_performance_id(self, performance_id):
+        if self.arrangement_index is not None:
+            return self.arrangement_index.get(str(performance_id), [])
+        else:
+            return self.twt_api.get_arrangement_list_by_performance_id(performance_id, date_from=get_datetime_today(as_string=True), date_until=get_datetime_future(as_string=True))
+
     def get_performance_data_from_list_by_id(self, performance_brain, performances_data):
         performance_id = getattr(performance_brain, 'performance_id', None)
         if performance_id and performance_id in performances_data:
@@ -196,6 +1015,8 @@ class SyncManager(object):
     def build_performances_data_dict(self, api_performances):
         performances_data = {}
         for api_performance in api_performances:
+            # The streamed response is read while the items arrive
+            self.keep_sync_lock()
             if 'id' in api_performance:
                 performances_data[self.safe_value(api_performance['id'])] = api_performance
             else:
@@ -215,44 +1036,76 @@ class SyncManager(object):
 
     def update_availability_field(self, performance_brain, performance_data):
         performance = performance_brain.getObject()
+        target_values = OrderedDict()
         for field in self.AVAILABILITY_FIELDS:
-            try:
-                setattr(performance, field, performance_data[field])
-            except Exception as err:
-                logger("[Error] Availability field '%s' cannot be updated for performance ID '%s'."%(field, performance_data.get('id', 'Unknown')), err)
+            if field in performance_data:
+                target_values[field] = performance_data[field]
+            else:
+                logger("[Error] Availability field '%s' cannot be updated for performance ID '%s'."%(field, performance_data.get('id', 'Unknown')), "Field not found in the API response.")
+
+        for field in self.SALES_WINDOW_FIELDS:
+            if field in performance_data:
+                target_values[field] = self.safe_value(performance_data[field])
 
         try:
-            performance = self.generate_performance_availability_field(performance, performance_data)
+            target_values['performance_availability'] = self.generate_availability_html(performance_data)
         except Exception as err:
             logger("[Error] Performance availability field value cannot be updated for performance ID '%s'." %(performance_data.get('id', 'Unknown')), err)
 
-        performance.reindexObject()
-        transaction.get().commit()
-        logger("[Status] Performance availability is now updated for ID: %s" %(performance_brain.performance_id))
+        changed_fields = self.apply_field_changes(performance, target_values)
+        if changed_fields:
+            changed_fields = self.set_last_synced(performance, changed_fields)
+            self.record_pending_write(performance, performance_brain.performance_id, target_values, changed_fields)
+            self.reindex_performance(performance, changed_fields)
+            self.commit_changes()
+            self.sync_stats['changed'] += 1
+            logger("[Status] Performance availability is now updated for ID: %s" %(performance_brain.performance_id))
+        else:
+            self.sync_stats['unchanged'] += 1
+            logger("[Status] Performance availability is NOT changed for ID: %s" %(performance_brain.performance_id))
         return performance_brain
 
     def is_availability_changed(self, performance_brain, performance_data):
-        ## TODO needs refactoring 
-        current_onsale_value = str2bool(performance_brain.onsale)
-        
-        if performance_data and 'onsale' in performance_data:
-            performance_data_onsale_value = performance_data['onsale']
-            if performance_data_onsale_value != current_onsale_value:
-                logger('[Status] Availability field is changed for the performance ID: %s.' %(performance_brain.performance_id))
-                return True
-            else:
-                logger('[Status] Availability field is NOT changed for the performance ID: %s.' %(performance_brain.performance_id))
-                return False
-        elif not performance_data:
+        # Compares the list payload with the catalog metadata only, the object is not loaded here.
+        # Fields without a metadata column count as changed, the diff in update_availability_field decides.
+        if not performance_data:
             return False
-        else:
+
+        if 'onsale' not in performance_data:
             if getattr(performance_brain, 'performance_id', None):
                 logger("[Error] Performance 'onsale' field is not available for the ID '%s'." %(performance_brain.performance_id), 'requestHandlingError')
-            else:
-                return False
+            return False
+
+        for field in self.AVAILABILITY_FIELDS + self.SALES_WINDOW_FIELDS:
+            if field not in performance_data:
+                continue
+
+            try:
+                current_value = getattr(performance_brain, field)
+            except AttributeError:
+                logger('[Status] Metadata column %s is missing for the performance ID: %s.' %(field, performance_brain.performance_id))
+                return True
+
+            if self.is_metadata_value_changed(field, current_value, performance_data[field]):
+                logger('[Status] Availability field %s is changed for the performance ID: %s.' %(field, performance_brain.performance_id))
+                return True
+
+        logger('[Status] Availability field is NOT changed for the performance ID: %s.' %(performance_brain.performance_id))
+        return False
+
+    def is_metadata_value_changed(self, field, current_value, api_value):
+        if field == 'onsale':
+            return str2bool(current_value) != bool(api_value)
+        # Missing.Value and None are stored for empty values
+        current_value = current_value or ""
+        api_value = self.safe_value(api_value) or ""
+        return current_value != api_value
 
     def find_performance(self, performance_id):
         performance_id = self.safe_value(performance_id)
+        if self.performance_brains and performance_id in self.performance_brains:
+            return self.performance_brains[performance_id].getObject()
+
         result = plone.api.content.find(performance_id=performance_id)
         if result:
             return result[0].getObject()
@@ -261,6 +1114,11 @@ class SyncManager(object):
 
     def find_product_details_by_id(self, product_id, scale="mini"):
         product_id = self.safe_value(product_id)
+        if scale == self.PRODUCT_IMAGE_SCALE:
+            product_details = self.get_cached_product_details(product_id)
+            if product_details is not None:
+                return product_details
+
         result = plone.api.content.find(product_id=product_id)
         if result:
             product_description = result[0].Description
@@ -290,7 +1148,8 @@ class SyncManager(object):
             logger("[Error] API field '%s' does not exist in the fields mapping" %(field), "Field not found in mapping.")
             return False
 
-    def update_field(self, performance, fieldname, fieldvalue):
+    def update_field(self, performance, target_values, fieldname, fieldvalue):
+        # Adds the target value(s) of an API field to target_values, nothing is written here
         plonefield_match = self.match(fieldname)
 
         if plonefield_match:
@@ -298,11 +1157,12 @@ class SyncManager(object):
                 if not hasattr(performance, plonefield_match):
                     logger("[Error] Plone field '%s' does not exist" %(plonefield_match), "Plone field not found")
                     return None
-                transform_value = self.transform_special_fields(performance, fieldname, fieldvalue)
-                if transform_value:
-                    return transform_value
+                transform_values = self.transform_special_fields(performance, fieldname, fieldvalue)
+                if transform_values is not False:
+                    target_values.update(transform_values)
+                    return transform_values
                 else:
-                    setattr(performance, plonefield_match, self.safe_value(fieldvalue))
+                    target_values[plonefield_match] = self.safe_value(fieldvalue)
                     return fieldvalue
             except Exception as err:
                 logger("[Error] Exception while syncing the API field '%s'" %(fieldname), err)
@@ -310,19 +1170,127 @@ class SyncManager(object):
         else:
             return None
 
-    def update_all_fields(self, performance, performance_data, arrangement_list=None):
-        self.clean_all_fields(performance)
-        updated_fields = [(self.update_field(performance, field, performance_data[field]), field) for field in performance_data.keys()]
-        performance = self.generate_performance_availability_field(performance, performance_data)
-        performance = self.generate_arrangement_list_field(performance, arrangement_list)
+    def build_target_values(self, performance, performance_data, arrangement_list=None):
+        # Fields that are not in the API response end up clean, like a full rewrite would leave them
+        target_values = OrderedDict()
+        for fieldname, field in self.fields_schema:
+            if fieldname not in self.CLEAN_IGNORE_FIELDS:
+                clean_value = self.get_clean_value(fieldname, field)
+                if clean_value is not None:
+                    target_values[fieldname] = clean_value
+        target_values['location'] = ""
+
+        updated_fields = [self.update_field(performance, target_values, field, performance_data[field]) for field in performance_data.keys()]
+
+        if performance_data.get('startDateTime', '') and not performance_data.get('endDateTime', ''):
+            target_values['end'] = performance_data['startDateTime']
+
+        target_values['performance_availability'] = self.generate_availability_html(performance_data)
+        target_values['arrangements'] = self.generate_arrangement_list_html(arrangement_list)
+        return target_values
+
+    def apply_field_changes(self, performance, target_values):
+        # Write only the values that differ, so unchanged objects are never marked as dirty
+        changed_fields = []
+        for fieldname, target_value in target_values.items():
+            current_value = self.get_field_value(performance, fieldname)
+            if self.is_value_changed(current_value, target_value):
+                self.set_field_value(performance, fieldname, target_value)
+                changed_fields.append(fieldname)
+        return changed_fields
+
+    def set_last_synced(self, performance, changed_fields):
+        setattr(performance, self.LAST_SYNCED_FIELD, datetime.now())
+        return changed_fields + [self.LAST_SYNCED_FIELD]
+
+    def get_field_value(self, performance, fieldname):
+        if fieldname == 'Subject':
+            return performance.Subject()
+        elif fieldname in ['start', 'end']:
+            date_value = getattr(IEventAccessor(performance), fieldname, None)
+            if date_value:
+                return date_value.strftime(self.API_DATETIME_FORMAT)
+            return None
+        else:
+            return getattr(performance, fieldname, None)
+
+    def set_field_value(self, performance, fieldname, fieldvalue):
+        if fieldname == 'Subject':
+            performance.setSubject(list(fieldvalue))
+        elif fieldname in ['start', 'end']:
+            setattr(IEventAccessor(performance), fieldname, self.convert_string_to_datetime(fieldvalue))
+        else:
+            setattr(performance, fieldname, fieldvalue)
+        return fieldvalue
+
+    def is_value_changed(self, current_value, target_value):
+        if isinstance(target_value, RichTextValue):
+            if not isinstance(current_value, RichTextValue):
+                return True
+            return current_value.raw != target_value.raw or current_value.mimeType != target_value.mimeType
+        elif isinstance(target_value, (list, tuple)) and isinstance(current_value, (list, tuple)):
+            return list(current_value) != list(target_value)
+        else:
+            return current_value != target_value
+
+    def update_all_fields(self, performance, performance_data, arrangement_list=None, fingerprint=None):
+        target_values = self.build_target_values(performance, performance_data, arrangement_list)
+        if fingerprint:
+            target_values[self.FINGERPRINT_FIELD] = fingerprint
+        changed_fields = self.apply_field_changes(performance, target_values)
+        if changed_fields:
+            changed_fields = self.set_last_synced(performance, changed_fields)
+            self.record_pending_write(performance, performance_data.get('id', ''), target_values, changed_fields)
 
-        performance = self.validate_performance_data(performance, performance_data)
+        try:
+            performance = self.validate_performance_data(performance, performance_data, changed_fields)
+        except Exception:
+            self.discard_pending_write(performance_data.get('id', ''))
+            raise
+        if changed_fields:
+            self.sync_stats['changed'] += 1
+            logger("[Status] Changed fields for performance ID '%s': %s" %(performance_data.get('id', 'Unknown'), ", ".join(changed_fields)))
+        else:
+            self.sync_stats['unchanged'] += 1
         return performance
 
     def get_container(self):
         container = plone.api.content.get(path=self.DEFAULT_FOLDER)
         return container
 
+    def generate_fingerprint(self, performance_data, arrangement_list=None):
+        # Stable hash of the synced API fields and arrangements.
+        # The sales phase is included because the availability text depends on the current date.
+        # The product details from Plone are included because they are rendered in the arrangements.
+        fingerprint_data = {
+            "performance": dict((field, performance_data.get(field)) for field in self.CORE.keys() if field in performance_data),
+            "arrangements": arrangement_list or [],
+            "products": self.get_fingerprint_products(arrangement_list),
+            "sales_phase": self.get_sales_phase(performance_data)
+        }
+        serialized = json.dumps(fingerprint_data, sort_keys=True, default=str)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def get_fingerprint_products(self, arrangement_list):
+        products = {}
+        for arrangement in arrangement_list or []:
+            product_id = arrangement.get('product_id', '')
+            if product_id:
+                products[self.safe_value(product_id)] = list(self.find_product_details_by_id(product_id))
+        return products
+
+    def get_sales_phase(self, performance_data):
+        now = datetime.now()
+        try:
+            if now < self.convert_string_to_datetime(performance_data.get('startOnlineSalesDate', '')):
+                return "before"
+            elif now < self.convert_string_to_datetime(performance_data.get('endOnlineSalesDate', '')):
+                return "during"
+            else:
+                return "after"
+        except (TypeError, ValueError):
+            return ""
+
     #
     # Sanitising/validation methods
     #
@@ -395,6 +1363,7 @@ class SyncManager(object):
         arrangement_id = arrangement.get('id', '')
         product_id = arrangement.get('product_id', '')
         image_url = ""
+        description = ""
         if product_id:
             image_url, description = self.find_product_details_by_id(product_id)
 
@@ -449,7 +1418,7 @@ class SyncManager(object):
 
         # get all fields from schema
         for fieldname, field in self.fields_schema:
-            if fieldname not in ['performance_id', 'waiting_list']:
+            if fieldname not in self.CLEAN_IGNORE_FIELDS:
                 self.clean_field(performance, fieldname, field)
             
         # extra fields that are not in the behavior
@@ -459,27 +1428,31 @@ class SyncManager(object):
         return performance
 
     def clean_field(self, performance, fieldname, field):
+        clean_value = self.get_clean_value(fieldname, field)
+        if clean_value is not None:
+            setattr(performance, fieldname, clean_value)
+
+        return performance
+
+    def get_clean_value(self, fieldname, field):
         if ITextLine.providedBy(field):
-            setattr(performance, fieldname, "")
+            return ""
         elif ITuple.providedBy(field):
-            setattr(performance, fieldname, [])
+            return []
         elif IBool.providedBy(field):
-            setattr(performance, fieldname, False)
+            return False
         elif IRichText.providedBy(field):
-            richvalue = RichTextValue("", 'text/html', 'text/html')
-            setattr(performance, fieldname, richvalue)
+            return RichTextValue("", 'text/html', 'text/html')
         else:
             logger("[Error] Field '%s' type is not recognised. " %(fieldname), "Field cannot be cleaned before sync.")
-
-        return performance
+            return None
 
     def validate_dates(self, performance, performance_data):
         startDateTime = performance_data.get('startDateTime', '')
         endDateTime = performance_data.get('endDateTime', '')
 
+        # A missing end date is set to the start date in build_target_values
         if startDateTime and not endDateTime:
-            performance_date_fields = IEventAccessor(performance)
-            performance_date_fields.end = performance_date_fields.start
             return True
         
         if not startDateTime and not endDateTime:
@@ -488,11 +1461,15 @@ class SyncManager(object):
 
         return True
 
-    def validate_performance_data(self, performance, performance_data):
+    def validate_performance_data(self, performance, performance_data, changed_fields=None):
         validated = self.validate_dates(performance, performance_data)
         if validated:
-            performance.reindexObject()
-            transaction.get().commit()
+            if changed_fields is None:
+                performance.reindexObject()
+                self.commit_changes()
+            elif changed_fields:
+                self.reindex_performance(performance, changed_fields)
+                self.commit_changes()
             return performance
         else:
             raise_error("validationError", "Performance is not valid. Do not commit changes to the database.")
@@ -502,15 +1479,16 @@ class SyncManager(object):
     # Special methods
     #
     def transform_special_fields(self, performance, fieldname, fieldvalue):
+        # Returns the target values of a special field, or False when the field is not special
         special_field_handler = self.get_special_fields_handlers(fieldname)
         if special_field_handler:
             if fieldvalue:
-                special_field_value = special_field_handler(performance, fieldname, fieldvalue)
-                return special_field_value
+                special_field_values = special_field_handler(performance, fieldname, fieldvalue)
+                return special_field_values
             else:
-                if fieldname in ['ranks']:
-                    return RichTextValue("", 'text/html', 'text/html')
-                return fieldvalue
+                if fieldname in ['ranks'] or fieldname in self.DATE_FIELDS:
+                    return {}
+                return False
         return False
 
     def get_special_fields_handlers(self, fieldname):
@@ -529,36 +1507,31 @@ class SyncManager(object):
             return None
 
     def _transform_performance_title(self, performance, fieldname, fieldvalue):
-        setattr(performance, 'performance_title', fieldvalue)
-        return fieldvalue
+        return {'performance_title': fieldvalue}
 
     def _transform_event_genre(self, performance, fieldname, fieldvalue):
         current_subjects = performance.Subject()
         if 'frontpage-slideshow' in current_subjects:
-            subjects = ['frontpage-slideshow', fieldvalue]
-            performance.setSubject(subjects)
+            subjects = ('frontpage-slideshow', fieldvalue)
         else:
-            performance.setSubject([fieldvalue])
+            subjects = (fieldvalue,)
             
-        return [fieldvalue]
+        return {'Subject': subjects}
 
     def _transform_start_date(self, performance, fieldname, fieldvalue):
-        performance_date_fields = IEventAccessor(performance)
-        date_datetime = datetime.strptime(fieldvalue, '%Y-%m-%d %H:%M')
-        performance_date_fields.start = date_datetime
-        return fieldvalue
+        # Validate the format, the value is compared and written as a string
+        self.convert_string_to_datetime(fieldvalue)
+        return {'start': fieldvalue}
 
     def _transform_end_date(self, performance, fieldname, fieldvalue):
-        performance_date_fields = IEventAccessor(performance)
-        date_datetime = datetime.strptime(fieldvalue, '%Y-%m-%d %H:%M')
-        performance_date_fields.end = date_datetime
-        return fieldvalue
+        self.convert_string_to_datetime(fieldvalue)
+        return {'end': fieldvalue}
 
     def _transform_tags(self, performance, fieldname, fieldvalue):
-        return fieldvalue
+        return {}
 
     def convert_string_to_datetime(self, datestring):
-        date_datetime = datetime.strptime(datestring, '%Y-%m-%d %H:%M')
+        date_datetime = datetime.strptime(datestring, self.API_DATETIME_FORMAT)
         return date_datetime
 
     def _transform_currency(self, currency):
@@ -621,18 +1594,13 @@ class SyncManager(object):
                 rankDescription = rank.get('rankDescription')
                 prices = self._transform_ranks_generate_prices(rank, True)
                 html_value += "<h6>%s</h6><div>%s</div>" %(rankDescription, prices)
-            final_value = RichTextValue(html_value, 'text/html', 'text/html')
-            setattr(performance, 'price', final_value)
 
         elif len(fieldvalue) == 1:
             rank = fieldvalue[0]
             prices = self._transform_ranks_generate_prices(rank)
             html_value += "<div>%s</div>" %(prices)
-            final_value = RichTextValue(html_value, 'text/html', 'text/html')
-            setattr(performance, 'price', final_value)
         else:
-            html_value = ""
-            final_value = RichTextValue(html_value, 'text/html', 'text/html')
-            return final_value
-        final_value = RichTextValue(html_value, 'text/html', 'text/html')   
-        return final_value
+            return {}
+
+        final_value = RichTextValue(html_value, 'text/html', 'text/html')
+        return {'price': final_value}
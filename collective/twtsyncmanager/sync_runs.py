@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+from datetime import datetime, timedelta
+
+# Zope dependencies
+from BTrees.OOBTree import OOBTree, OOTreeSet
+from persistent.mapping import PersistentMapping
+from zope.annotation.interfaces import IAnnotations
+
+SYNC_RUNS_KEY = "collective.twtsyncmanager.sync_runs"
+MAX_RUNS = 50
+RUN_STALE_AFTER = timedelta(minutes=30)
+RUN_RESUME_WITHIN = timedelta(days=1)
+
+RUNNING_STATUS = "running"
+FINISHED_STATUS = "finished"
+FAILED_STATUS = "failed"
+
+
+class SyncRun(object):
+    """
+    Persistent record of a sync run.
+    The processed IDs are the checkpoint cursor, they are written in the same
+    transaction as the changes of those performances.
+    """
+
+    def __init__(self, record):
+        self.record = record
+
+    @property
+    def id(self):
+        return self.record['id']
+
+    @property
+    def mode(self):
+        return self.record['mode']
+
+    @property
+    def status(self):
+        return self.record['status']
+
+    def get_window(self):
+        return self.record['date_from'], self.record['date_until']
+
+    def is_resumed(self):
+        return self.record['resumed'] > 0
+
+    def is_processed(self, performance_id):
+        return str(performance_id) in self.record['processed_ids']
+
+    def add_processed(self, performance_ids):
+        processed_ids = self.record['processed_ids']
+        for performance_id in performance_ids:
+            processed_ids.insert(str(performance_id))
+        self.record['processed'] = len(processed_ids)
+        self.touch()
+
+    def set_total(self, total):
+        self.record['total'] = total
+        self.touch()
+
+    def add_total(self, total):
+        self.record['total'] += total
+        self.touch()
+
+    def touch(self):
+        self.record['updated'] = datetime.now()
+
+    def is_stale(self, now=None):
+        now = now or datetime.now()
+        return now - self.record['updated'] > RUN_STALE_AFTER
+
+    def finish(self, stats=None):
+        self.record['status'] = FINISHED_STATUS
+        self.record['finished'] = datetime.now()
+        self.record['stats'] = dict(stats or {})
+        self.touch()
+
+    def fail(self, error, stats=None):
+        self.record['status'] = FAILED_STATUS
+        self.record['error'] = error
+        self.record['stats'] = dict(stats or {})
+        self.touch()
+
+    def get_progress(self):
+        if self.record['total']:
+            return min(int(self.record['processed'] * 100 / self.record['total']), 100)
+        return 0
+
+    def to_dict(self):
+        run_data = dict((key, value) for key, value in self.record.items() if key != 'processed_ids')
+        run_data['progress'] = self.get_progress()
+        return run_data
+
+
+class SyncRunRegistry(object):
+    """
+    Sync runs of a site, stored in an annotation.
+    """
+
+    def __init__(self, context):
+        # Reading the runs does not write, the annotation is created with the first run
+        self.context = context
+        self.runs = IAnnotations(context).get(SYNC_RUNS_KEY, None)
+
+    def get_storage(self):
+        if self.runs is None:
+            self.runs = OOBTree()
+            IAnnotations(self.context)[SYNC_RUNS_KEY] = self.runs
+        return self.runs
+
+    def start_run(self, mode, date_from, date_until):
+        # An interrupted or failed run of the same mode is resumed from its checkpoint
+        sync_run = self.find_resumable_run(mode)
+        if sync_run is not None:
+            sync_run.record['status'] = RUNNING_STATUS
+            sync_run.record['resumed'] += 1
+            sync_run.record['total'] = 0
+            sync_run.record['error'] = ""
+            sync_run.touch()
+            return sync_run
+
+        now = datetime.now()
+        run_id = "%s-%s" %(now.strftime("%Y%m%d%H%M%S%f"), mode)
+        record = PersistentMapping()
+        record.update({
+            "id": run_id,
+            "mode": mode,
+            "date_from": date_from,
+            "date_until": date_until,
+            "status": RUNNING_STATUS,
+            "started": now,
+            "updated": now,
+            "finished": None,
+            "resumed": 0,
+            "total": 0,
+            "processed": 0,
+            "processed_ids": OOTreeSet(),
+            "stats": {},
+            "error": ""
+        })
+        self.get_storage()[run_id] = record
+        self.prune()
+        return SyncRun(record)
+
+    def find_resumable_run(self, mode):
+        now = datetime.now()
+        for sync_run in self.get_runs():
+            if sync_run.mode != mode or now - sync_run.record['started'] > RUN_RESUME_WITHIN:
+                continue
+            if sync_run.status == FAILED_STATUS or (sync_run.status == RUNNING_STATUS and sync_run.is_stale(now)):
+                return sync_run
+            # Only the latest run of a mode can be resumed
+            return None
+        return None
+
+    def get_runs(self):
+        # Newest first
+        if self.runs is None:
+            return []
+        return [SyncRun(self.runs[run_id]) for run_id in reversed(list(self.runs.keys()))]
+
+    def get_run(self, run_id):
+        if self.runs is None:
+            return None
+        record = self.runs.get(run_id, None)
+        if record is not None:
+            return SyncRun(record)
+        return None
+
+    def prune(self):
+        run_ids = list(self.runs.keys())
+        for run_id in run_ids[:max(len(run_ids) - MAX_RUNS, 0)]:
+            del self.runs[run_id]
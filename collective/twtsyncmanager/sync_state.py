@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+from datetime import datetime
+
+# Zope dependencies
+from BTrees.OOBTree import OOBTree
+from persistent.mapping import PersistentMapping
+from zope.annotation.interfaces import IAnnotations
+
+SYNC_STATE_KEY = "collective.twtsyncmanager.sync_state"
+
+
+class SyncState(object):
+    """
+    Persistent sync state of a site, stored in an annotation.
+    Keeps the last runs and the last seen fingerprint and status per performance.
+    """
+
+    def __init__(self, context):
+        annotations = IAnnotations(context)
+        state = annotations.get(SYNC_STATE_KEY, None)
+        if state is None:
+            state = PersistentMapping()
+            state['last_run'] = None
+            state['last_full_run'] = None
+            state['performances'] = OOBTree()
+            annotations[SYNC_STATE_KEY] = state
+        self.state = state
+
+    def get_last_run(self):
+        return self.state['last_run']
+
+    def get_last_full_run(self):
+        return self.state['last_full_run']
+
+    def mark_run(self, full=False):
+        now = datetime.now()
+        self.state['last_run'] = now
+        if full:
+            self.state['last_full_run'] = now
+        return now
+
+    def get_fingerprint(self, performance_id):
+        return self.state['performances'].get(str(performance_id), (None, None))[0]
+
+    def get_status(self, performance_id):
+        return self.state['performances'].get(str(performance_id), (None, None))[1]
+
+    def set_performance(self, performance_id, fingerprint, status):
+        # Only write when different, unchanged entries do not dirty the BTree buckets
+        performance_id = str(performance_id)
+        value = (fingerprint, status)
+        if self.state['performances'].get(performance_id, None) != value:
+            self.state['performances'][performance_id] = value
+            return True
+        return False
+
+    def remove_performances(self, performance_ids):
+        performances = self.state['performances']
+        removed = [performance_id for performance_id in performance_ids if performances.pop(str(performance_id), None) is not None]
+        return removed
+
+    def get_performance_ids(self):
+        return list(self.state['performances'].keys())
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the API circuit breaker
+#
+import unittest
+
+from collective.twtsyncmanager.circuit_breaker import CircuitBreaker, get_circuit_breaker, CLOSED_STATE, OPEN_STATE, HALF_OPEN_STATE
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.circuit_breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+
+    def open_breaker(self):
+        for attempt in range(3):
+            self.circuit_breaker.record_failure()
+
+    def expire_reset_timeout(self):
+        self.circuit_breaker.opened_at -= self.circuit_breaker.reset_timeout
+
+    def test_opens_after_consecutive_failures(self):
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, CLOSED_STATE)
+        self.assertTrue(self.circuit_breaker.allow_request())
+
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, OPEN_STATE)
+        self.assertFalse(self.circuit_breaker.allow_request())
+        self.assertEqual(self.circuit_breaker.get_state()['total_rejected'], 1)
+
+    def test_success_resets_failures(self):
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_success()
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_failure()
+        self.assertEqual(self.circuit_breaker.state, CLOSED_STATE)
+
+    def test_one_trial_after_reset_timeout(self):
+        self.open_breaker()
+        self.expire_reset_timeout()
+
+        self.assertTrue(self.circuit_breaker.allow_request())
+        self.assertEqual(self.circuit_breaker.state, HALF_OPEN_STATE)
+        # Other requests wait for the result of the trial
+        self.assertFalse(self.circuit_breaker.allow_request())
+
+    def test_successful_trial_closes(self):
+        self.open_breaker()
+        self.expire_reset_timeout()
+        self.circuit_breaker.allow_request()
+        self.circuit_breaker.record_success()
+
+        self.assertEqual(self.circuit_breaker.state, CLOSED_STATE)
+        self.assertEqual(self.circuit_breaker.get_retry_time(), None)
+        self.assertTrue(self.circuit_breaker.allow_request())
+        self.assertTrue(self.circuit_breaker.allow_request())
+
+    def test_failed_trial_opens_again(self):
+        self.open_breaker()
+        self.expire_reset_timeout()
+        self.circuit_breaker.allow_request()
+        self.circuit_breaker.record_failure()
+
+        self.assertEqual(self.circuit_breaker.state, OPEN_STATE)
+        self.assertFalse(self.circuit_breaker.allow_request())
+        state = self.circuit_breaker.get_state()
+        self.assertEqual(state['retry_at'], state['opened_at'] + 60)
+        self.assertEqual(state['total_failures'], 4)
+
+    def test_shared_breaker_takes_last_settings(self):
+        circuit_breaker = get_circuit_breaker("test-shared", failure_threshold=5, reset_timeout=60)
+        self.assertIs(get_circuit_breaker("test-shared", failure_threshold=2, reset_timeout=30), circuit_breaker)
+        self.assertEqual((circuit_breaker.failure_threshold, circuit_breaker.reset_timeout), (2, 30))
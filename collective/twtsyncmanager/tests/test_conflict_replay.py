@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the replay of a batch after a ConflictError
+#
+import transaction
+import unittest
+
+from ZODB.POSException import ConflictError
+
+from collective.twtsyncmanager.mapping_core import CORE as SYNC_CORE
+from collective.twtsyncmanager.sync_manager import SyncManager
+
+
+class ConflictingDataManager(object):
+    """Data manager whose commit raises a ConflictError a number of times."""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        self.commits = 0
+        self.transaction = None
+        self.transaction_manager = transaction.manager
+
+    def join(self):
+        txn = transaction.get()
+        if self.transaction is not txn:
+            self.transaction = txn
+            txn.join(self)
+
+    def sortKey(self):
+        return "conflicting-data-manager"
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        if self.conflicts:
+            self.conflicts -= 1
+            raise ConflictError()
+
+    def tpc_finish(self, txn):
+        self.commits += 1
+        self.transaction = None
+
+    def tpc_abort(self, txn):
+        self.transaction = None
+
+    def abort(self, txn):
+        self.transaction = None
+
+
+class SyncRun(object):
+
+    def __init__(self):
+        self.processed = []
+
+    def add_processed(self, performance_ids):
+        self.processed.append(list(performance_ids))
+
+
+class ReplaySyncManager(SyncManager):
+    """Sync manager with replayable operations that write through the data manager."""
+
+    def __init__(self, options, data_manager):
+        SyncManager.__init__(self, options)
+        self.data_manager = data_manager
+        self.calls = []
+        self.failing_ids = set()
+
+    def write_performance(self, performance_id):
+        self.calls.append(performance_id)
+        if self.replaying and performance_id in self.failing_ids:
+            raise ValueError("Performance %s is deleted." %(performance_id))
+        self.data_manager.join()
+        self.record_pending_operation(performance_id, "write_performance", performance_id)
+        self.sync_stats['changed'] += 1
+
+    def write_sync_state(self):
+        self.calls.append(None)
+        self.data_manager.join()
+        self.record_pending_operation(None, "write_sync_state")
+
+
+class TestConflictReplay(unittest.TestCase):
+
+    def setUp(self):
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+
+    def create_sync_manager(self, conflicts, conflict_retries=3):
+        self.data_manager = ConflictingDataManager(conflicts)
+        sync_manager = ReplaySyncManager({"api": None, "core": SYNC_CORE, "conflict_retries": conflict_retries, "conflict_backoff": 0}, self.data_manager)
+        sync_manager.sync_run = SyncRun()
+        sync_manager.write_performance("1")
+        sync_manager.write_performance("2")
+        sync_manager.write_sync_state()
+        # The checkpoints are kept by the sync loop, they are not recorded again by the replay
+        sync_manager.pending_checkpoints = ["1", "2"]
+        return sync_manager
+
+    def test_batch_is_replayed_after_conflict(self):
+        sync_manager = self.create_sync_manager(conflicts=1)
+
+        self.assertTrue(sync_manager.commit_pending_changes())
+        self.assertEqual(sync_manager.calls, ["1", "2", None, "1", "2", None])
+        self.assertEqual(self.data_manager.commits, 1)
+        self.assertEqual(sync_manager.sync_run.processed[-1], ["1", "2"])
+        self.assertEqual(sync_manager.pending_operations, [])
+        self.assertEqual(sync_manager.pending_checkpoints, [])
+
+        sync_stats = sync_manager.get_sync_stats()
+        self.assertEqual((sync_stats['conflicts'], sync_stats['retries']), (1, 1))
+        # The replayed performances are counted once
+        self.assertEqual(sync_stats['changed'], 2)
+        self.assertEqual(sync_stats['failed'], 0)
+
+    def test_failed_performance_is_not_checkpointed(self):
+        sync_manager = self.create_sync_manager(conflicts=1)
+        sync_manager.failing_ids.add("2")
+
+        self.assertTrue(sync_manager.commit_pending_changes())
+        self.assertEqual(sync_manager.failed_performance_ids, set(["2"]))
+        self.assertEqual(sync_manager.sync_run.processed[-1], ["1"])
+        self.assertEqual(sync_manager.get_sync_stats()['failed'], 1)
+        # The sync state is still written
+        self.assertEqual(sync_manager.calls[-1], None)
+
+    def test_batch_fails_after_retries(self):
+        sync_manager = self.create_sync_manager(conflicts=10, conflict_retries=2)
+
+        self.assertFalse(sync_manager.commit_pending_changes())
+        self.assertEqual(self.data_manager.commits, 0)
+        self.assertEqual(sync_manager.failed_performance_ids, set(["1", "2"]))
+        self.assertEqual(sync_manager.pending_operations, [])
+        self.assertEqual(sync_manager.pending_checkpoints, [])
+
+        sync_stats = sync_manager.get_sync_stats()
+        self.assertEqual((sync_stats['conflicts'], sync_stats['retries'], sync_stats['failed']), (3, 2, 2))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the split of the sync date range in windows
+#
+import unittest
+from datetime import datetime
+
+from collective.twtsyncmanager.utils import add_months, split_date_range
+
+
+class TestAddMonths(unittest.TestCase):
+
+    def test_returns_first_day_of_month(self):
+        self.assertEqual(add_months(datetime(2024, 1, 15), 1), datetime(2024, 2, 1))
+        self.assertEqual(add_months(datetime(2024, 1, 31), 1), datetime(2024, 2, 1))
+
+    def test_crosses_year(self):
+        self.assertEqual(add_months(datetime(2024, 11, 15), 2), datetime(2025, 1, 1))
+        self.assertEqual(add_months(datetime(2024, 12, 31), 1), datetime(2025, 1, 1))
+        self.assertEqual(add_months(datetime(2024, 3, 1), 24), datetime(2026, 3, 1))
+
+
+class TestSplitDateRange(unittest.TestCase):
+
+    def test_without_months_returns_range(self):
+        self.assertEqual(split_date_range("2024-01-15", "2024-06-30", 0), [("2024-01-15", "2024-06-30")])
+
+    def test_windows_follow_calendar_months(self):
+        self.assertEqual(split_date_range("2024-01-15", "2024-03-10", 1), [
+            ("2024-01-15", "2024-01-31"),
+            ("2024-02-01", "2024-02-29"),
+            ("2024-03-01", "2024-03-10")
+        ])
+
+    def test_windows_of_several_months(self):
+        self.assertEqual(split_date_range("2024-11-20", "2025-04-30", 2), [
+            ("2024-11-20", "2024-12-31"),
+            ("2025-01-01", "2025-02-28"),
+            ("2025-03-01", "2025-04-30")
+        ])
+
+    def test_single_day(self):
+        self.assertEqual(split_date_range("2024-05-31", "2024-05-31", 1), [("2024-05-31", "2024-05-31")])
+
+    def test_empty_range(self):
+        self.assertEqual(split_date_range("2024-05-31", "2024-05-01", 1), [])
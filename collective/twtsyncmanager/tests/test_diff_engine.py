@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the field diff of the sync manager
+#
+import unittest
+
+from plone.app.textfield.value import RichTextValue
+
+from collective.twtsyncmanager.mapping_core import CORE as SYNC_CORE
+from collective.twtsyncmanager.sync_manager import SyncManager
+
+
+class Performance(object):
+    """Content object recording the fields that are written."""
+
+    def __init__(self, subject=(), **values):
+        self.__dict__.update(values, written=[], subject=tuple(subject))
+
+    def __setattr__(self, name, value):
+        self.written.append(name)
+        object.__setattr__(self, name, value)
+
+    def Subject(self):
+        return self.subject
+
+    def setSubject(self, subject):
+        self.written.append('Subject')
+        self.__dict__['subject'] = tuple(subject)
+
+
+class TestDiffEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.sync_manager = SyncManager({"api": None, "core": SYNC_CORE})
+
+    def test_equal_values_are_unchanged(self):
+        self.assertFalse(self.sync_manager.is_value_changed(u"Title", u"Title"))
+        self.assertFalse(self.sync_manager.is_value_changed(None, None))
+        self.assertTrue(self.sync_manager.is_value_changed(u"Title", u"Other title"))
+        self.assertTrue(self.sync_manager.is_value_changed(None, u"Title"))
+
+    def test_lists_and_tuples_compare_by_items(self):
+        self.assertFalse(self.sync_manager.is_value_changed(("a", "b"), ["a", "b"]))
+        self.assertTrue(self.sync_manager.is_value_changed(("a", "b"), ["b", "a"]))
+        self.assertTrue(self.sync_manager.is_value_changed(None, ["a"]))
+
+    def test_rich_text_compares_raw_and_mime_type(self):
+        current = RichTextValue(u"<p>Text</p>", "text/html", "text/x-html-safe")
+        self.assertFalse(self.sync_manager.is_value_changed(current, RichTextValue(u"<p>Text</p>", "text/html", "text/x-html-safe")))
+        self.assertTrue(self.sync_manager.is_value_changed(current, RichTextValue(u"<p>Other</p>", "text/html", "text/x-html-safe")))
+        self.assertTrue(self.sync_manager.is_value_changed(current, RichTextValue(u"<p>Text</p>", "text/plain", "text/x-html-safe")))
+        self.assertTrue(self.sync_manager.is_value_changed(u"<p>Text</p>", current))
+
+    def test_only_changed_fields_are_written(self):
+        performance = Performance(title=u"Title", onsale=True, subject=("Muziek",))
+        changed_fields = self.sync_manager.apply_field_changes(performance, {"title": u"Title", "onsale": False, "Subject": ["Muziek"]})
+
+        self.assertEqual(changed_fields, ["onsale"])
+        self.assertEqual(performance.written, ["onsale"])
+        self.assertFalse(performance.onsale)
+
+    def test_unchanged_object_is_not_written(self):
+        performance = Performance(title=u"Title", subject=("Muziek", "Jazz"))
+        changed_fields = self.sync_manager.apply_field_changes(performance, {"title": u"Title", "Subject": ("Muziek", "Jazz")})
+
+        self.assertEqual(changed_fields, [])
+        self.assertEqual(performance.written, [])
+
+    def test_subject_is_written_with_its_setter(self):
+        performance = Performance(subject=("Muziek",))
+        changed_fields = self.sync_manager.apply_field_changes(performance, {"Subject": ["Theater"]})
+
+        self.assertEqual(changed_fields, ["Subject"])
+        self.assertEqual(performance.Subject(), ("Theater",))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the streaming JSON parser
+#
+import json
+import unittest
+
+from collective.twtsyncmanager.json_stream import StreamingJSONObject
+
+DOCUMENT = {
+    "status": "PERFORMANCE_FOUND",
+    "performances": [
+        {"id": 12345, "title": u"Café concert ♫", "price": 12.5, "onsale": True},
+        {"id": 67890, "title": u"Opera", "price": -0.75e2, "onsale": False, "tags": [], "extra": None},
+        [1, 2, {"nested": {"list": [10, 200, 3000]}}]
+    ],
+    "count": 3
+}
+
+
+def split_chunks(data, size):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+class TestStreamingJSONObject(unittest.TestCase):
+
+    def setUp(self):
+        self.data = json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8')
+
+    def parse(self, chunks, items_key="performances"):
+        stream = StreamingJSONObject(chunks)
+        items = list(stream.iter_items(items_key))
+        return items, stream.members
+
+    def test_single_chunk(self):
+        items, members = self.parse([self.data])
+        self.assertEqual(items, DOCUMENT['performances'])
+        self.assertEqual(members, {"status": "PERFORMANCE_FOUND", "count": 3})
+
+    def test_every_chunk_boundary(self):
+        # Splits the document in two at every byte, inside keys, numbers and multibyte characters
+        for index in range(1, len(self.data)):
+            items, members = self.parse([self.data[:index], self.data[index:]])
+            self.assertEqual(items, DOCUMENT['performances'], "Split at byte %s" %(index))
+            self.assertEqual(members, {"status": "PERFORMANCE_FOUND", "count": 3}, "Split at byte %s" %(index))
+
+    def test_one_byte_chunks(self):
+        items, members = self.parse(split_chunks(self.data, 1))
+        self.assertEqual(items, DOCUMENT['performances'])
+        self.assertEqual(members['count'], 3)
+
+    def test_number_split_between_chunks(self):
+        items, members = self.parse([b'{"items": [12', b'34, 5', b'6.7', b'8e1', b'0], "total": 1', b'0}'], "items")
+        self.assertEqual(items, [1234, 56.78e10])
+        self.assertEqual(members, {"total": 10})
+
+    def test_empty_chunks_are_skipped(self):
+        items, members = self.parse([b'', b'{"items"', b'', b': [1]}', b''], "items")
+        self.assertEqual(items, [1])
+
+    def test_members_before_items(self):
+        before = []
+        stream = StreamingJSONObject(split_chunks(self.data, 7))
+        items = list(stream.iter_items("performances", before_items=lambda members: before.append(dict(members))))
+        self.assertEqual(before, [{"status": "PERFORMANCE_FOUND"}])
+        self.assertEqual(len(items), 3)
+
+    def test_empty_object_and_array(self):
+        self.assertEqual(self.parse([b'{}'], "items"), ([], {}))
+        self.assertEqual(self.parse([b'{"items": [', b' ]}'], "items"), ([], {}))
+
+    def test_missing_items_key(self):
+        stream = StreamingJSONObject([b'{"status": "ERROR"}'])
+        self.assertEqual(list(stream.iter_items("items")), [])
+        self.assertFalse(stream.found_items)
+        self.assertEqual(stream.members, {"status": "ERROR"})
+
+    def test_truncated_document(self):
+        stream = StreamingJSONObject([self.data[:len(self.data) // 2]])
+        self.assertRaises(ValueError, list, stream.iter_items("performances"))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the client side rate limiter
+#
+import time
+import unittest
+from email.utils import formatdate
+
+from collective.twtsyncmanager.rate_limiter import RateLimiter, get_rate_limiter, get_limits, parse_retry_after, MIN_RATE_FACTOR, RECOVERY_FACTOR
+
+
+class TestParseRetryAfter(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3)
+        self.assertEqual(parse_retry_after("1.5"), 1.5)
+        self.assertEqual(parse_retry_after("-2"), 0)
+
+    def test_http_date(self):
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0)
+
+    def test_missing_or_invalid(self):
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after(""), None)
+        self.assertEqual(parse_retry_after("soon"), None)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_limits(self):
+        self.assertEqual(get_limits(), (None, 1.0))
+        self.assertEqual(get_limits(4), (4.0, 4.0))
+        self.assertEqual(get_limits(0.5), (0.5, 1.0))
+        self.assertEqual(get_limits(4, 10), (4.0, 10.0))
+
+    def test_without_rate_requests_do_not_wait(self):
+        rate_limiter = RateLimiter("unlimited")
+        for attempt in range(20):
+            self.assertEqual(rate_limiter.acquire(), 0)
+
+    def test_burst_then_wait(self):
+        rate_limiter = RateLimiter("burst", rate=50, burst=2)
+        self.assertEqual(rate_limiter.acquire(), 0)
+        self.assertEqual(rate_limiter.acquire(), 0)
+        self.assertGreater(rate_limiter.acquire(), 0)
+        self.assertGreater(rate_limiter.get_state()['waited'], 0)
+
+    def test_throttle_halves_rate_and_pauses(self):
+        rate_limiter = RateLimiter("throttled", rate=10)
+        rate_limiter.throttle(retry_after=0.05)
+        self.assertEqual(rate_limiter.rate, 5)
+        self.assertEqual(rate_limiter.tokens, 0)
+        self.assertEqual(rate_limiter.get_state()['throttled'], 1)
+        self.assertIsNotNone(rate_limiter.get_state()['paused_until'])
+        self.assertGreaterEqual(rate_limiter.acquire(), 0.04)
+
+    def test_throttle_keeps_minimum_rate(self):
+        rate_limiter = RateLimiter("minimum", rate=10)
+        for attempt in range(10):
+            rate_limiter.throttle(retry_after=0)
+        self.assertEqual(rate_limiter.rate, 10 * MIN_RATE_FACTOR)
+
+    def test_pause_applies_without_rate(self):
+        rate_limiter = RateLimiter("paused")
+        rate_limiter.throttle(retry_after=0.05)
+        self.assertEqual(rate_limiter.rate, None)
+        self.assertGreaterEqual(rate_limiter.acquire(), 0.04)
+        self.assertEqual(rate_limiter.acquire(), 0)
+
+    def test_success_restores_rate(self):
+        rate_limiter = RateLimiter("recovering", rate=10)
+        rate_limiter.throttle(retry_after=0)
+        rate_limiter.record_success()
+        self.assertAlmostEqual(rate_limiter.rate, 5 + 10 * RECOVERY_FACTOR)
+        for attempt in range(int(1 / RECOVERY_FACTOR) + 1):
+            rate_limiter.record_success()
+        self.assertEqual(rate_limiter.rate, 10)
+
+    def test_shared_limiter_is_reconfigured(self):
+        rate_limiter = get_rate_limiter("test-shared", rate=10, burst=10)
+        self.assertIs(get_rate_limiter("test-shared", rate=10, burst=10), rate_limiter)
+
+        other_limiter = get_rate_limiter("test-shared", rate=2, burst=1)
+        self.assertIs(other_limiter, rate_limiter)
+        self.assertEqual((rate_limiter.max_rate, rate_limiter.burst), (2.0, 1.0))
+        self.assertLessEqual(rate_limiter.tokens, 1)
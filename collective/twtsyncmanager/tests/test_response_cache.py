@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+#
+# Tests of the API response cache
+#
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from collective.twtsyncmanager.response_cache import MemoryResponseCache, DiskResponseCache, CachedResponse, get_cache_key, get_response_cache
+
+
+class Response(object):
+
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class TestCacheKey(unittest.TestCase):
+
+    def test_api_key_is_left_out(self):
+        self.assertEqual(
+            get_cache_key("get", "https://api.example.com/performanceList", {"key": "secret", "fromDate": "2024-01-01"}),
+            get_cache_key("GET", "https://api.example.com/performanceList", {"key": "other", "fromDate": "2024-01-01"}))
+        self.assertNotIn("secret", get_cache_key("get", "https://api.example.com/performanceList", {"key": "secret"}))
+
+    def test_params_are_sorted(self):
+        self.assertEqual(
+            get_cache_key("get", "https://api.example.com/performanceList", {"fromDate": "2024-01-01", "untilDate": "2024-02-01"}),
+            "GET https://api.example.com/performanceList?fromDate=2024-01-01&untilDate=2024-02-01")
+
+    def test_url_and_params_are_part_of_key(self):
+        key = get_cache_key("get", "https://test.example.com/performanceList", {"fromDate": "2024-01-01"})
+        self.assertNotEqual(key, get_cache_key("get", "https://prod.example.com/performanceList", {"fromDate": "2024-01-01"}))
+        self.assertNotEqual(key, get_cache_key("get", "https://test.example.com/arrangementList", {"fromDate": "2024-01-01"}))
+        self.assertNotEqual(key, get_cache_key("get", "https://test.example.com/performanceList", {"fromDate": "2024-01-02"}))
+        self.assertNotEqual(key, get_cache_key("post", "https://test.example.com/performanceList", {"fromDate": "2024-01-01"}))
+
+
+class TestMemoryResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.response_cache = MemoryResponseCache(max_entries=2)
+
+    def test_least_recently_used_is_evicted(self):
+        self.response_cache.set("a", {"body": "a"})
+        self.response_cache.set("b", {"body": "b"})
+        # Reading a makes b the least recently used entry
+        self.response_cache.get("a")
+        self.response_cache.set("c", {"body": "c"})
+
+        self.assertEqual(self.response_cache.get("b"), None)
+        self.assertEqual(self.response_cache.get("a"), {"body": "a"})
+        self.assertEqual(self.response_cache.get("c"), {"body": "c"})
+        self.assertEqual(self.response_cache.get_stats()['evicted'], 1)
+
+    def test_set_replaces_entry(self):
+        self.response_cache.set("a", {"body": "a"})
+        self.response_cache.set("a", {"body": "new"})
+        self.response_cache.set("b", {"body": "b"})
+        self.assertEqual(self.response_cache.get("a"), {"body": "new"})
+        self.assertEqual(self.response_cache.get_stats()['evicted'], 0)
+
+    def test_entry_expires_after_ttl(self):
+        cache_entry = self.response_cache.create_entry(Response('{"status": "PERFORMANCE_FOUND"}'), ttl=60)
+        self.assertTrue(self.response_cache.is_fresh(cache_entry))
+        self.assertFalse(self.response_cache.is_fresh(dict(cache_entry, expires=time.time() - 1)))
+
+    def test_revalidation(self):
+        cache_entry = self.response_cache.create_entry(Response("{}", headers={"ETag": '"v1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}), ttl=0)
+        self.assertTrue(self.response_cache.can_revalidate(cache_entry))
+        self.assertEqual(self.response_cache.get_revalidation_headers(cache_entry), {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+        self.assertFalse(self.response_cache.can_revalidate(self.response_cache.create_entry(Response("{}"), ttl=0)))
+
+        refreshed_entry = self.response_cache.refresh("a", cache_entry, ttl=60)
+        self.assertTrue(self.response_cache.is_fresh(refreshed_entry))
+        self.assertEqual(self.response_cache.get("a"), refreshed_entry)
+
+    def test_cached_response(self):
+        response = CachedResponse(self.response_cache.create_entry(Response('{"status": "PERFORMANCE_FOUND"}'), ttl=60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "PERFORMANCE_FOUND"})
+        self.assertTrue(response.from_cache)
+
+
+class TestDiskResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.response_cache = DiskResponseCache(self.directory, max_entries=2)
+        self.response_cache.EVICT_EVERY = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_are_shared_by_instances(self):
+        self.response_cache.set("a", {"body": "a"})
+        self.assertEqual(DiskResponseCache(self.directory).get("a"), {"body": "a"})
+        self.assertEqual(self.response_cache.get("missing"), None)
+
+    def test_least_recently_used_is_evicted(self):
+        for index, key in enumerate(["a", "b"]):
+            self.response_cache.set(key, {"body": key})
+            os.utime(self.response_cache.get_path(key), (1000 + index, 1000 + index))
+        self.response_cache.set("c", {"body": "c"})
+
+        self.assertEqual(self.response_cache.get("a"), None)
+        self.assertEqual(self.response_cache.get("b"), {"body": "b"})
+        self.assertEqual(self.response_cache.get("c"), {"body": "c"})
+        self.assertEqual(self.response_cache.get_stats()['evicted'], 1)
+
+    def test_clear(self):
+        self.response_cache.set("a", {"body": "a"})
+        self.response_cache.clear()
+        self.assertEqual(self.response_cache.get("a"), None)
+
+
+class TestSharedResponseCache(unittest.TestCase):
+
+    def test_one_cache_per_backend(self):
+        response_cache = get_response_cache("memory", max_entries=10)
+        self.assertIs(get_response_cache("memory", max_entries=20), response_cache)
+        self.assertEqual(response_cache.max_entries, 20)
+        self.assertEqual(get_response_cache("none"), None)
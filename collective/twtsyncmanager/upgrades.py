@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Ticketworks API sync mechanism by Andre Goncalves
+#
+import plone.api
+
+# Product dependencies
+from .setuphandlers import PROFILE_ID, add_catalog_indexes, reindex_performances
+
+
+def upgrade_to_1001(context):
+    """
+    Add the sync settings, catalog indexes and metadata columns.
+    The registry is imported again, so every setting added in this release is added.
+    The new indexes and columns are built in batches.
+    """
+    context.runImportStepFromProfile(PROFILE_ID, 'plone.app.registry')
+    context.runImportStepFromProfile(PROFILE_ID, 'catalog')
+
+    catalog = plone.api.portal.get_tool('portal_catalog')
+    added_indexes = add_catalog_indexes(catalog)
+    reindex_performances(catalog, added_indexes)
+
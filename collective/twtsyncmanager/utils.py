@@ -35,7 +35,7 @@ def reverse_onsale_value(performance_ids):
 
 def get_api_settings():
     registry = getUtility(IRegistry)
-    settings = registry.forInterface(ITWTControlPanel)
+    settings = registry.forInterface(ITWTControlPanel, check=False)
     
     api_settings = {
         'test': {
@@ -46,11 +46,93 @@ def get_api_settings():
             'url': getattr(settings, 'api_url_prod', None),
             'api_key': getattr(settings, 'api_key_prod', None)
         },
-        'api_mode': getattr(settings, 'api_prod_mode', None)
+        'api_mode': getattr(settings, 'api_prod_mode', None),
+        'pool_size': getattr(settings, 'api_pool_size', None),
+        'max_workers': getattr(settings, 'api_max_workers', None),
+        'retries': getattr(settings, 'api_retries', None),
+        'retry_backoff': getattr(settings, 'api_retry_backoff', None),
+        'breaker_threshold': getattr(settings, 'api_breaker_threshold', None),
+        'breaker_reset': getattr(settings, 'api_breaker_reset', None),
+        'rate_limits': {
+            'list': getattr(settings, 'api_rate_limit_list', None),
+            'availability': getattr(settings, 'api_rate_limit_availability', None),
+            'arrangements': getattr(settings, 'api_rate_limit_arrangements', None)
+        },
+        'cache_backend': getattr(settings, 'api_cache_backend', None),
+        'cache_directory': getattr(settings, 'api_cache_directory', None),
+        'cache_size': getattr(settings, 'api_cache_size', None),
+        'cache_ttls': {
+            'list': getattr(settings, 'api_cache_list_ttl', None),
+            'availability': getattr(settings, 'api_cache_availability_ttl', None),
+            'arrangements': getattr(settings, 'api_cache_arrangements_ttl', None)
+        },
+        'stream_responses': getattr(settings, 'api_stream_responses', None),
+        'async_client': getattr(settings, 'api_async_client', None)
     }
 
     return api_settings
 
+def get_sync_settings():
+    registry = getUtility(IRegistry)
+    settings = registry.forInterface(ITWTControlPanel, check=False)
+
+    sync_settings = {
+        'commit_batch_size': getattr(settings, 'sync_commit_batch_size', None),
+        'commit_interval': getattr(settings, 'sync_commit_interval', None),
+        'window_months': getattr(settings, 'sync_window_months', None)
+    }
+
+    return sync_settings
+
+def get_lock_settings():
+    registry = getUtility(IRegistry)
+    settings = registry.forInterface(ITWTControlPanel, check=False)
+
+    lock_settings = {
+        'backend': getattr(settings, 'sync_lock_backend', None) or u'zodb',
+        'directory': getattr(settings, 'sync_lock_directory', None),
+        'timeout': getattr(settings, 'sync_lock_timeout', None),
+        'conflict': getattr(settings, 'sync_lock_conflict', None) or u'join',
+        'wait': getattr(settings, 'sync_lock_wait', None) or 0
+    }
+
+    return lock_settings
+
+def get_schedule_settings():
+    registry = getUtility(IRegistry)
+    settings = registry.forInterface(ITWTControlPanel, check=False)
+
+    schedule_list_hour = getattr(settings, 'schedule_list_hour', None)
+    schedule_settings = {
+        'enabled': getattr(settings, 'schedule_enabled', None) or False,
+        'user': getattr(settings, 'schedule_user', None) or u'admin',
+        'availability_interval': getattr(settings, 'schedule_availability_interval', None) or 0,
+        'list_interval': getattr(settings, 'schedule_list_interval', None) or 0,
+        'list_hour': schedule_list_hour if schedule_list_hour is not None else 3,
+        'jitter': getattr(settings, 'schedule_jitter', None) or 0
+    }
+
+    return schedule_settings
+
+def get_sync_options(api_connection, core, request=None, form=None):
+    # Sync options from the control panel, the view request or form can override the commit batch settings
+    sync_options = {"api": api_connection, 'core': core}
+    sync_options.update(get_sync_settings())
+    sync_options['lock_settings'] = get_lock_settings()
+
+    if request is not None:
+        form = request.form
+
+    if form:
+        batch_size = form.get('batch_size', None)
+        batch_interval = form.get('batch_interval', None)
+        if batch_size and str(batch_size).isdigit():
+            sync_options['commit_batch_size'] = int(batch_size)
+        if batch_interval and str(batch_interval).isdigit():
+            sync_options['commit_interval'] = int(batch_interval)
+
+    return sync_options
+
 
 def get_datetime_today(as_string=False):
     ## format = YYYY-MM-DD
@@ -71,6 +153,28 @@ def get_datetime_future(as_string=False, years=20):
     else:
         return future
 
+def add_months(date, months):
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return date.replace(year=year, month=month, day=1)
+
+def split_date_range(date_from, date_until, months=1):
+    ## Split YYYY-MM-DD dates in windows of calendar months, both ends included
+    if not months:
+        return [(date_from, date_until)]
+
+    start = datetime.strptime(date_from, DATE_FORMAT)
+    end = datetime.strptime(date_until, DATE_FORMAT)
+    windows = []
+    while start <= end:
+        next_start = add_months(start, months)
+        window_end = min(next_start - timedelta(days=1), end)
+        windows.append((start.strftime(DATE_FORMAT), window_end.strftime(DATE_FORMAT)))
+        start = next_start
+
+    return windows
+
 def str2bool(value):
     return str(value).lower() in ("yes", "true", "t", "1")
 
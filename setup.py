@@ -31,6 +31,9 @@ setup(name='collective.twtsyncmanager',
 
       [z3c.autoinclude.plugin]
       target = plone
+
+      [console_scripts]
+      twt-fake-api = collective.twtsyncmanager.fake_api:main
       """,
       setup_requires=["PasteScript"],
       paster_plugins=["ZopeSkel"],